@@ -0,0 +1,102 @@
+""" Measures a whole run of `_collect` against the fake ES backend, on synthetic mailboxes of ACCOUNTS accounts of
+MESSAGES messages each, every message having FAN_OUT `to` and `cc` addresses, 20 accounts of 500 messages with a fan out
+of 4 by default. For every phase of the run it reports the wall time, the ES requests made, the bytes of their bodies
+and responses, and the peak RSS of the process once the phase is over. Message roles are written in a thread alongside
+the accounts, so their requests are counted in whatever phase is running at the time. The `server` domain engine
+relies on runtime fields, which the fake does not support.
+    python ../../benchmarks/collect_throughput.py [ACCOUNTS] [MESSAGES] [FAN_OUT] [LATENCY_SECONDS]
+"""
+import random
+import resource
+import sys
+import time
+from datetime import timedelta
+
+import mailforce.main as main_module
+from mailforce import CONFIG
+from mailforce.client_operations.es import set_client
+from mailforce.client_operations.es.es_index_operations import RUNTIME_STATS_INDEX
+from mailforce.client_operations.es.es_search_operations import INDEX
+from mailforce.client_operations.es.fake_elasticsearch import FakeElasticsearch
+from mailforce.utils.date_utils import DATE_FORMAT, EPOCH
+from mailforce.utils.domain_utils import DOMAINS
+
+""" Functions called by `_collect` that are timed as phases, in the order they are called. `_changed_accounts` is
+called within `_process_accounts`, whose figures include it. """
+PHASES: list[str] = ['get_last_runtime_date', '_get_accounts_from_es', 'get_checkpoint_store', '_changed_accounts',
+                     '_process_accounts', '_write_to_es', 'insert_runtime_stats']
+
+
+def _messages(accounts: int, messages: int, fan_out: int) -> list[dict[str, any]]:
+    """ Every account writes to a pool of correspondents 10 times the fan out, so that addresses recur. """
+    rng = random.Random(42)
+    docs = []
+    for account in range(accounts):
+        correspondents = [f'person{account}-{i}@{DOMAINS[(account + i) % len(DOMAINS)]}' for i in range(fan_out * 10)]
+        for message in range(messages):
+            date = EPOCH + timedelta(milliseconds=rng.randrange(1600000000000, 1700000000000))
+            docs.append({
+                'account': f'account{account}',
+                'messageId': f'message{account}-{message}',
+                'date': date.strftime(DATE_FORMAT) + '.000Z',
+                'from': [{'address': rng.choice(correspondents)}],
+                'to': [{'address': address} for address in rng.sample(correspondents, fan_out)],
+                'cc': [{'address': address} for address in rng.sample(correspondents, fan_out)]
+            })
+    return docs
+
+
+class _Phases:
+    """ Replaces the phase functions of `main` by wrappers that record what every call costs. """
+
+    def __init__(self, client: FakeElasticsearch):
+        self.client: FakeElasticsearch = client
+        self.rows: list[tuple[str, float, int, int, int, int]] = []
+
+    def wrap(self, name: str):
+        function = getattr(main_module, name)
+
+        def timed(*args, **kwargs):
+            before = self.client.stats()
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start
+                after = self.client.stats()
+                (calls, request_bytes, response_bytes) = (
+                    sum(stats[key] for stats in after.values()) - sum(stats[key] for stats in before.values())
+                    for key in ['calls', 'request_bytes', 'response_bytes'])
+                peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                self.rows.append((name, seconds, calls, request_bytes, response_bytes, peak_rss))
+
+        setattr(main_module, name, timed)
+
+
+def main(accounts: int, messages: int, fan_out: int, latency_seconds: float):
+    client = FakeElasticsearch(latency_seconds=latency_seconds)
+    client.add_documents(INDEX, _messages(accounts, messages, fan_out))
+    client.indices.create(index=RUNTIME_STATS_INDEX)
+    set_client(client)
+    phases = _Phases(client)
+    for name in PHASES:
+        phases.wrap(name)
+    print(f'{accounts} accounts x {messages} messages x {fan_out} addresses, {latency_seconds}s latency, '
+          f'{CONFIG.domain_engine} domain engine')
+    start = time.perf_counter()
+    main_module._collect(full_rebuild=True)
+    total = time.perf_counter() - start
+    print(f'{"phase":<24}{"wall (s)":>10}{"calls":>8}{"sent (B)":>12}{"received (B)":>14}{"peak RSS (KB)":>15}')
+    for (name, seconds, calls, request_bytes, response_bytes, peak_rss) in phases.rows:
+        print(f'{name:<24}{seconds:>10.3f}{calls:>8}{request_bytes:>12}{response_bytes:>14}{peak_rss:>15}')
+    print(f'{"_collect":<24}{total:>10.3f}')
+    print(f'{"api":<24}{"calls":>8}{"sent (B)":>12}{"received (B)":>14}')
+    for api, stats in client.stats().items():
+        print(f'{api:<24}{stats["calls"]:>8}{stats["request_bytes"]:>12}{stats["response_bytes"]:>14}')
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 500,
+         int(sys.argv[3]) if len(sys.argv) > 3 else 4,
+         float(sys.argv[4]) if len(sys.argv) > 4 else 0)
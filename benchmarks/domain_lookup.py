@@ -0,0 +1,29 @@
+""" Compares looking domains up in the allow-list as a list, as `is_valid_domain` used to, with `DomainMatcher`, with
+and without subdomain matching. Half of the looked up domains are allow-listed.
+    python ../../benchmarks/domain_lookup.py [DOMAINS] [LOOKUPS]
+"""
+import random
+import sys
+import timeit
+
+from mailforce.utils.domain_utils import DomainMatcher
+
+
+def main(domain_count: int, lookups: int):
+    rng = random.Random(42)
+    domains = [f'company{i}.com' for i in range(domain_count)]
+    queries = [f'company{rng.randrange(domain_count * 2)}.com' for _ in range(lookups)]
+    exact = DomainMatcher(domains)
+    subdomains = DomainMatcher(domains, match_subdomains=True)
+    timings = {
+        'list': timeit.timeit(lambda: [query in domains for query in queries], number=1),
+        'matcher': timeit.timeit(lambda: [exact.matches(query) for query in queries], number=1),
+        'matcher (subdomains)': timeit.timeit(lambda: [subdomains.matches(query) for query in queries], number=1)
+    }
+    print(f'{lookups} lookups against {domain_count} domains')
+    for name, seconds in timings.items():
+        print(f'{name:<22}{seconds * 1e9 / lookups:>12.0f} ns/lookup')
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000, int(sys.argv[2]) if len(sys.argv) > 2 else 20000)
@@ -0,0 +1,76 @@
+""" Measures rolling up the engagements of a run into domains, 1M by default: one at a time through `Domains`, as the
+`client` domain engine does, and at once through `EngagementColumns`, as the `batch` domain engine does, with NumPy if
+it is installed and in pure Python otherwise. The engagements are built before timing, as they are fetched anyway.
+    python ../../benchmarks/domain_rollup.py [ENGAGEMENTS]
+"""
+import random
+import sys
+import time
+
+from mailforce.models.domain import engagement_columns
+from mailforce.models.domain.domains import Domains
+from mailforce.models.domain.engagement_columns import EngagementColumns
+from mailforce.models.email.engagement.email_engagement import EmailEngagement
+from mailforce.utils.domain_utils import DOMAINS
+
+RELATIONSHIPS: list[str] = ['to', 'from', 'cc']
+
+
+def _engagements(engagements: int) -> list[EmailEngagement]:
+    """ Every address is engaged with by about 5 accounts, in any role. """
+    rng = random.Random(42)
+    addresses = [f'person{i}@{DOMAINS[i % len(DOMAINS)]}' for i in range(max(1, engagements // 5))]
+    emails = []
+    for i in range(engagements):
+        earliest = rng.randrange(1600000000000, 1700000000000)
+        emails.append(EmailEngagement({
+            'key': rng.choice(addresses),
+            'doc_count': rng.randrange(1, 50),
+            'min_date': {'value': earliest},
+            'max_date': {'value': earliest + rng.randrange(10 ** 10)}
+        }, RELATIONSHIPS[i % 3], f'account{i % 1000}'))
+    return emails
+
+
+def _objects(emails: list[EmailEngagement]) -> Domains:
+    domains = Domains()
+    for email in emails:
+        domains.add_email(email)
+    return domains
+
+
+def _columns(emails: list[EmailEngagement]) -> (Domains, float):
+    columns = EngagementColumns()
+    for email in emails:
+        columns.add_email(email)
+    start = time.perf_counter()
+    return columns.rollup(), time.perf_counter() - start
+
+
+def _timed(function, *args) -> (any, float):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main(engagements: int):
+    emails = _engagements(engagements)
+    print(f'{engagements} engagements')
+    print(f'{"path":<24}{"total (s)":>12}{"rollup (s)":>12}')
+    (objects, seconds) = _timed(_objects, emails)
+    print(f'{"objects":<24}{seconds:>12.3f}{"":>12}')
+    numpy = engagement_columns.np
+    for path, np in [('columns (numpy)', numpy), ('columns (pure python)', None)]:
+        if path == 'columns (numpy)' and numpy is None:
+            print(f'{path:<24}{"numpy is not installed":>24}')
+            continue
+        engagement_columns.np = np
+        ((columns, rollup), seconds) = _timed(_columns, emails)
+        print(f'{path:<24}{seconds:>12.3f}{rollup:>12.3f}')
+        assert {name: domain.id() for name, domain in objects.domains.items()} == \
+            {name: domain.id() for name, domain in columns.domains.items()}, 'domains differ'
+    engagement_columns.np = numpy
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
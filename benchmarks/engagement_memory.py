@@ -0,0 +1,89 @@
+""" Measures the memory held per `EmailEngagement` and `EmailMapping`, compared with the plain objects they used to be.
+Buckets are generated the way ES returns them: every account sees a subset of a shared pool of addresses, and every
+bucket holds its own copy of the address and date strings, as if freshly decoded from a JSON response.
+    python ../../benchmarks/engagement_memory.py [ENGAGEMENTS]
+"""
+import random
+import sys
+import tracemalloc
+
+from mailforce.models.email.engagement.email_engagement import EmailEngagement
+from mailforce.models.email.mapping.email_mapping import EmailMapping
+from mailforce.utils.date_utils import to_simple_date_string
+from mailforce.utils.hash_utils import deterministic_id
+
+ACCOUNTS: int = 200
+ADDRESSES: int = 20000
+RELATIONSHIPS: list[str] = ['to', 'from', 'cc']
+
+
+class PlainEmailEngagement:
+    """ `EmailEngagement` as it was before it had slots and interned strings. """
+    def __init__(self, email_json: dict[str, any], relationship: str, account: str):
+        min_date: str = to_simple_date_string(email_json['min_date']['value_as_string'])
+        max_date: str = to_simple_date_string(email_json['max_date']['value_as_string'])
+        self.earliest_engagement_date: str = min_date
+        self.latest_engagement_date: str = max_date
+        self.email_address: str = email_json['key']
+        self.domain: str = self.email_address.split('@')[1]
+        self.count: int = email_json['doc_count']
+        self.relationship: str = relationship
+        self.account: str = account
+        self.id: str = deterministic_id(self.email_address, self.relationship, self.account, min_date, max_date)
+
+
+class PlainEmailMapping:
+    """ `EmailMapping` as it was before it had slots. """
+    def __init__(self, email):
+        self.email_address: str = email.email_address
+        self.first_contact_date: str = email.earliest_engagement_date
+        self.latest_contact_date: str = email.latest_engagement_date
+        self.cc_count: int = email.count if email.relationship == 'cc' else 0
+        self.to_count: int = email.count if email.relationship == 'to' else 0
+        self.from_count: int = email.count if email.relationship == 'from' else 0
+        self.total: int = email.count
+
+
+def _buckets(engagements: int) -> list[tuple[dict[str, any], str, str]]:
+    rng = random.Random(42)
+    buckets = []
+    for i in range(engagements):
+        address = rng.randrange(ADDRESSES)
+        day = rng.randrange(1, 29)
+        buckets.append(({
+            'key': ''.join(['person', str(address), '@domain', str(address % 500), '.com']),
+            'doc_count': rng.randrange(1, 50),
+            'min_date': {'value_as_string': ''.join(['2024-01-', f'{day:02d}', 'T10:00:00.000Z'])},
+            'max_date': {'value_as_string': ''.join(['2024-02-', f'{day:02d}', 'T18:30:00.000Z'])}
+        }, RELATIONSHIPS[i % 3], ''.join(['kunai-', str(i % ACCOUNTS)])))
+    return buckets
+
+
+def _measure(engagement_class, mapping_class, engagements: int) -> (float, float):
+    buckets = _buckets(engagements)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    emails = [engagement_class(email_json, relationship, account) for (email_json, relationship, account) in buckets]
+    # The buckets are released once the engagements have been built, as they are after each search.
+    buckets.clear()
+    after_emails = tracemalloc.get_traced_memory()[0]
+    mappings = {}
+    for email in emails:
+        if email.email_address not in mappings:
+            mappings[email.email_address] = mapping_class(email)
+    after_mappings = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after_emails - before) / len(emails), (after_mappings - after_emails) / len(mappings)
+
+
+def main(engagements: int):
+    print(f'{engagements} engagements over {ACCOUNTS} accounts and {ADDRESSES} addresses')
+    (plain_email, plain_mapping) = _measure(PlainEmailEngagement, PlainEmailMapping, engagements)
+    (email, mapping) = _measure(EmailEngagement, EmailMapping, engagements)
+    print(f'{"":<16}{"plain":>10}{"slotted":>10}{"saved":>8}')
+    print(f'{"EmailEngagement":<16}{plain_email:>10.0f}{email:>10.0f}{1 - email / plain_email:>8.0%}')
+    print(f'{"EmailMapping":<16}{plain_mapping:>10.0f}{mapping:>10.0f}{1 - mapping / plain_mapping:>8.0%}')
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
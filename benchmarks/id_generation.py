@@ -0,0 +1,58 @@
+""" Measures generating the IDs of an account holding 100k engagements with each available ID scheme: building the
+engagements, whose IDs are now only computed when needed, the first call to `EmailAccount.id`, which computes the IDs
+of all of its engagements, and the following calls, which are cached.
+    python ../../benchmarks/id_generation.py [ENGAGEMENTS]
+"""
+import random
+import sys
+import time
+
+from mailforce.models.email.account.email_account import EmailAccount
+from mailforce.utils import hash_utils
+from mailforce.utils.domain_utils import DOMAINS
+
+RELATIONSHIPS: list[str] = ['to', 'from', 'cc']
+
+
+def _buckets(engagements: int) -> dict[str, list[dict[str, any]]]:
+    rng = random.Random(42)
+    buckets = {relationship: [] for relationship in RELATIONSHIPS}
+    for i in range(engagements):
+        earliest = rng.randrange(1600000000000, 1700000000000)
+        buckets[RELATIONSHIPS[i % 3]].append({
+            'key': f'person{i}@{DOMAINS[i % len(DOMAINS)]}',
+            'doc_count': rng.randrange(1, 50),
+            'min_date': {'value': earliest},
+            'max_date': {'value': earliest + rng.randrange(10 ** 10)}
+        })
+    return buckets
+
+
+def _measure(scheme: str, buckets: dict[str, list[dict[str, any]]]) -> (float, float, float):
+    hash_utils.use_id_scheme(scheme)
+    start = time.perf_counter()
+    email_account = EmailAccount(account='kunai-benchmark')
+    for relationship, relationship_buckets in buckets.items():
+        email_account.add_buckets(relationship_buckets, relationship)
+    built = time.perf_counter()
+    email_account.id()
+    first = time.perf_counter()
+    email_account.id()
+    cached = time.perf_counter()
+    return built - start, first - built, cached - first
+
+
+def main(engagements: int):
+    buckets = _buckets(engagements)
+    print(f'Account with {engagements} engagements')
+    print(f'{"scheme":<8}{"build (s)":>12}{"first id (s)":>14}{"cached id (s)":>15}')
+    for scheme in hash_utils.ID_SCHEMES.keys():
+        if scheme == 'v3' and hash_utils.xxhash is None:
+            print(f'{scheme:<8}{"xxhash is not installed":>41}')
+            continue
+        (build, first, cached) = _measure(scheme, buckets)
+        print(f'{scheme:<8}{build:>12.3f}{first:>14.3f}{cached:>15.6f}')
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
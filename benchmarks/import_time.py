@@ -0,0 +1,61 @@
+""" Measures a cold start: importing `mailforce.main` in a new interpreter, which is what a function pays before
+handling its first event, then loading the settings and allow-list and creating the ES client on first use, which it
+pays during its first run. Every step is measured RUNS times, 10 by default, and the median is reported, along with the
+modules that took longest to import themselves, as reported by `-X importtime`.
+    python ../../benchmarks/import_time.py [RUNS]
+"""
+import statistics
+import subprocess
+import sys
+
+""" Prints the seconds taken by each step, in a new interpreter. """
+COLD_START: str = '''
+import time
+start = time.perf_counter()
+import mailforce.main
+imported = time.perf_counter()
+from mailforce import CONFIG
+CONFIG.load()
+configured = time.perf_counter()
+from mailforce.utils.domain_utils import get_matcher
+get_matcher()
+allow_listed = time.perf_counter()
+from mailforce.client_operations.es import get_client
+get_client()
+connected = time.perf_counter()
+print(imported - start, configured - imported, allow_listed - configured, connected - allow_listed)
+'''
+STEPS: list[str] = ['import mailforce.main', 'load settings', 'load allow-list', 'create ES client']
+
+
+def _run(*args: str) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, *args], capture_output=True, text=True, check=True)
+
+
+def _slowest_imports(top: int = 10) -> list[tuple[int, str]]:
+    """
+    :return: Microseconds each of the slowest modules took to import, excluding the modules it imported.
+    """
+    lines = _run('-X', 'importtime', '-c', 'import mailforce.main').stderr.splitlines()
+    imports = []
+    for line in lines:
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        (self_us, _, module) = line[len('import time:'):].split('|')
+        imports.append((int(self_us), module.strip()))
+    return sorted(imports, reverse=True)[:top]
+
+
+def main(runs: int):
+    seconds = [list(map(float, _run('-c', COLD_START).stdout.split()[-len(STEPS):])) for _ in range(runs)]
+    print(f'{runs} cold starts')
+    print(f'{"step":<24}{"median (ms)":>12}')
+    for i, step in enumerate(STEPS):
+        print(f'{step:<24}{statistics.median(map(lambda run: run[i], seconds)) * 1000:>12.1f}')
+    print(f'{"module":<48}{"self (ms)":>12}')
+    for (self_us, module) in _slowest_imports():
+        print(f'{module:<48}{self_us / 1000:>12.1f}')
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
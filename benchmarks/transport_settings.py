@@ -0,0 +1,65 @@
+""" Measures a whole run of `_collect` against the fake ES backend under several transport settings, on the synthetic
+mailboxes of `collect_throughput.py`: ACCOUNTS accounts of MESSAGES messages each, 20 accounts of 500 messages by
+default. Every request takes LATENCY_SECONDS, 0.02 by default, and transfers its body and response at
+BANDWIDTH_BYTES_PER_SECOND per connection, 1 MB/s by default, so that the size of the connection pool and compression
+show in the wall time. Every setting is run on a new fake holding the same documents, and its wall time, requests and
+bytes sent and received are reported.
+    python ../../benchmarks/transport_settings.py [ACCOUNTS] [MESSAGES] [LATENCY_SECONDS] [BANDWIDTH_BYTES_PER_SECOND]
+"""
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(__file__))
+
+import mailforce.main as main_module
+from collect_throughput import _messages
+from mailforce import CONFIG
+from mailforce.client_operations.es import set_client
+from mailforce.client_operations.es.es_index_operations import RUNTIME_STATS_INDEX
+from mailforce.client_operations.es.es_search_operations import INDEX
+from mailforce.client_operations.es.fake_elasticsearch import FakeElasticsearch
+from mailforce.client_operations.es.transport import connections_per_node
+
+""" Fan out of the synthetic messages. """
+FAN_OUT: int = 4
+
+
+def _settings() -> list[tuple[str, int, bool]]:
+    """
+    :return: Name, connections and compression of every setting compared, the first being the defaults of
+    `elastic_transport`, which the client used before its pool was sized to the threads sending requests.
+    """
+    return [('10 connections, plain', 10, False),
+            (f'{connections_per_node()} connections, plain', connections_per_node(), False),
+            (f'{connections_per_node()} connections, gzip', connections_per_node(), True)]
+
+
+def main(accounts: int, messages: int, latency_seconds: float, bandwidth_bytes_per_second: int):
+    CONFIG.accounts_cache_ttl_seconds = 0
+    documents = _messages(accounts, messages, FAN_OUT)
+    print(f'{accounts} accounts x {messages} messages, {latency_seconds}s latency, '
+          f'{bandwidth_bytes_per_second} B/s per connection, {CONFIG.search_workers} search workers, '
+          f'{CONFIG.bulk_threads} bulk threads')
+    print(f'{"setting":<28}{"wall (s)":>10}{"calls":>8}{"sent (B)":>12}{"received (B)":>14}')
+    for (name, connections, http_compress) in _settings():
+        client = FakeElasticsearch(latency_seconds=latency_seconds, connections=connections,
+                                   http_compress=http_compress, bandwidth_bytes_per_second=bandwidth_bytes_per_second)
+        client.add_documents(INDEX, documents)
+        client.indices.create(index=RUNTIME_STATS_INDEX)
+        set_client(client)
+        start = time.perf_counter()
+        main_module._collect(full_rebuild=True)
+        seconds = time.perf_counter() - start
+        stats = client.stats().values()
+        (calls, request_bytes, response_bytes) = (sum(api[key] for api in stats)
+                                                  for key in ['calls', 'request_bytes', 'response_bytes'])
+        print(f'{name:<28}{seconds:>10.3f}{calls:>8}{request_bytes:>12}{response_bytes:>14}')
+    set_client(None)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 500,
+         float(sys.argv[3]) if len(sys.argv) > 3 else 0.02,
+         int(sys.argv[4]) if len(sys.argv) > 4 else 1024 * 1024)
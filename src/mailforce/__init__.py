@@ -1,6 +1,7 @@
 from mailforce.models.configurations.mailforce_configurations import MailforceConfigurations
 
-CONFIG = MailforceConfigurations()
+""" Settings are only read once one of them is first used, so importing Mailforce reads no files. """
+CONFIG = MailforceConfigurations(lazy=True)
 RESOURCES_PATH: str = '../resources'
 CONTENT_JSON: str = 'application/json'
 CONTENT_CSV: str = 'text/csv'
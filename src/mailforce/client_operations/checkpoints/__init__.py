@@ -0,0 +1,18 @@
+from mailforce import CONFIG
+from mailforce.client_operations.checkpoints.checkpoint_store import CheckpointStore
+
+ES_BACKEND: str = 'es'
+JSON_BACKEND: str = 'json'
+
+
+def get_checkpoint_store() -> CheckpointStore:
+    """
+    :return: The checkpoint store selected by `CONFIG.checkpoint_backend`.
+    """
+    if CONFIG.checkpoint_backend == JSON_BACKEND:
+        from mailforce.client_operations.checkpoints.json_checkpoint_store import JsonCheckpointStore
+        return JsonCheckpointStore(CONFIG.checkpoint_path)
+    elif CONFIG.checkpoint_backend == ES_BACKEND:
+        from mailforce.client_operations.checkpoints.es_checkpoint_store import EsCheckpointStore
+        return EsCheckpointStore()
+    raise ValueError(f'Unknown checkpoint backend {CONFIG.checkpoint_backend}')
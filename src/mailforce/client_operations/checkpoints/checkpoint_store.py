@@ -0,0 +1,44 @@
+from abc import ABC, abstractmethod
+
+from mailforce.models.checkpoint.checkpoint import Checkpoint
+
+
+class CheckpointStore(ABC):
+    """ Base class for the backends that persist checkpoints between runs. """
+
+    @abstractmethod
+    def load(self, accounts: list[str], stream: str) -> dict[str, Checkpoint]:
+        """
+        :param accounts: Accounts whose checkpoints are to be loaded.
+        :param stream: Output stream the checkpoints belong to.
+        :return: Checkpoints keyed by account. Accounts that have never been checkpointed are absent.
+        """
+
+    @abstractmethod
+    def save(self, checkpoints: list[Checkpoint]) -> bool:
+        """
+        :param checkpoints: Checkpoints to be persisted, replacing any existing ones for the same account and stream.
+        :return: Whether all checkpoints were persisted.
+        """
+
+
+def checkpoint_doc(checkpoint: Checkpoint) -> dict[str, any]:
+    """
+    :param checkpoint: Checkpoint to be serialized.
+    :return: JSON representation of the checkpoint, as stored by the backends.
+    """
+    return {
+        'account': checkpoint.account,
+        'stream': checkpoint.stream,
+        'date': checkpoint.date,
+        'search_after': checkpoint.search_after
+    }
+
+
+def checkpoint_from_doc(doc: dict[str, any]) -> Checkpoint:
+    """
+    :param doc: JSON representation of a checkpoint.
+    :return: Deserialized checkpoint.
+    """
+    return Checkpoint(account=doc['account'], stream=doc['stream'], date=doc.get('date'),
+                      search_after=doc.get('search_after'))
@@ -0,0 +1,44 @@
+from elasticsearch import helpers
+
+from mailforce.client_operations.checkpoints.checkpoint_store import CheckpointStore, checkpoint_doc, \
+    checkpoint_from_doc
+from mailforce.client_operations.es import get_client
+from mailforce.models.checkpoint.checkpoint import Checkpoint
+
+CHECKPOINTS_INDEX: str = 'search-checkpoints'
+MGET_BATCH_SIZE: int = 1000
+
+
+class EsCheckpointStore(CheckpointStore):
+    """ Keeps checkpoints in an Elasticsearch index, one document per account and stream. """
+
+    def __init__(self, index: str = CHECKPOINTS_INDEX):
+        """
+        :param index: Name of the checkpoints index.
+        """
+        self.index: str = index
+
+    def load(self, accounts: list[str], stream: str) -> dict[str, Checkpoint]:
+        if not get_client().indices.exists(index=self.index):
+            return {}
+        checkpoints: dict[str, Checkpoint] = {}
+        for start in range(0, len(accounts), MGET_BATCH_SIZE):
+            ids = list(map(lambda account: Checkpoint(account, stream).id(), accounts[start:start + MGET_BATCH_SIZE]))
+            response = get_client().mget(index=self.index, ids=ids)
+            for doc in response['docs']:
+                if doc.get('found'):
+                    checkpoint = checkpoint_from_doc(doc['_source'])
+                    checkpoints[checkpoint.account] = checkpoint
+        return checkpoints
+
+    def save(self, checkpoints: list[Checkpoint]) -> bool:
+        actions = map(lambda checkpoint: {
+            '_op_type': 'index',
+            '_index': self.index,
+            '_id': checkpoint.id(),
+            '_source': checkpoint_doc(checkpoint)
+        }, checkpoints)
+        (_, errors) = helpers.bulk(get_client(), actions, raise_on_error=False)
+        for error in errors:
+            print(f'A checkpoint failed to post: {error}')
+        return len(errors) == 0
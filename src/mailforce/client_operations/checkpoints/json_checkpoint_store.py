@@ -0,0 +1,39 @@
+import json
+import os
+
+from mailforce.client_operations.checkpoints.checkpoint_store import CheckpointStore, checkpoint_doc, \
+    checkpoint_from_doc
+from mailforce.models.checkpoint.checkpoint import Checkpoint
+
+
+class JsonCheckpointStore(CheckpointStore):
+    """ Keeps checkpoints in a local JSON file. Meant for local development. """
+
+    def __init__(self, path: str):
+        """
+        :param path: Path of the JSON file. It is created on the first save.
+        """
+        self.path: str = path
+
+    def load(self, accounts: list[str], stream: str) -> dict[str, Checkpoint]:
+        docs = self._read()
+        checkpoints: dict[str, Checkpoint] = {}
+        for account in accounts:
+            doc = docs.get(Checkpoint(account, stream).id())
+            if doc:
+                checkpoints[account] = checkpoint_from_doc(doc)
+        return checkpoints
+
+    def save(self, checkpoints: list[Checkpoint]) -> bool:
+        docs = self._read()
+        for checkpoint in checkpoints:
+            docs[checkpoint.id()] = checkpoint_doc(checkpoint)
+        with open(self.path, 'w') as f:
+            json.dump(docs, f, indent=2)
+        return True
+
+    def _read(self) -> dict[str, dict[str, any]]:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'r') as f:
+            return json.load(f)
@@ -1,7 +1,75 @@
+from threading import Lock
+
 from elasticsearch import Elasticsearch
 
 from mailforce import CONFIG
+from mailforce.client_operations.es.transport import connections_per_node, operation_timeouts, transport_options
+
+ELASTICSEARCH_BACKEND: str = 'elasticsearch'
+FAKE_BACKEND: str = 'fake'
+
+_client: Elasticsearch = None
+""" Views of the client with the timeout of an operation, keyed by operation. """
+_operation_clients: dict[str, Elasticsearch] = {}
+_client_lock: Lock = Lock()
+
+
+def get_client(operation: str = None) -> Elasticsearch:
+    """ The client is created on first use, so that importing the ES operations does not connect to a cluster.
+    :param operation: If present, e.g. `search` or `bulk`, the client uses the timeout configured for it.
+    :return: The client of the backend selected by `CONFIG.es_backend`, shared by all operations.
+    """
+    global _client
+    client = _client
+    if client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _create_client()
+            client = _client
+    if operation is None:
+        return client
+    operation_client = _operation_clients.get(operation)
+    if operation_client is None:
+        timeout = operation_timeouts().get(operation)
+        operation_client = client if timeout is None else client.options(request_timeout=timeout)
+        with _client_lock:
+            if _client is client:
+                _operation_clients[operation] = operation_client
+    return operation_client
+
+
+def set_client(client):
+    """
+    :param client: Client all operations are to use from now on, e.g. a `FakeElasticsearch` already holding
+    documents, or None for one to be created from the configuration again.
+    """
+    global _client
+    with _client_lock:
+        _client = client
+        _operation_clients.clear()
+
+
+def close_client():
+    """ Closes the connections of the client, if one was created, which is created anew on next use. A client is
+    otherwise kept for the life of the process, so that warm invocations reuse its connections. """
+    global _client
+    with _client_lock:
+        (client, _client) = (_client, None)
+        _operation_clients.clear()
+    if client is not None and hasattr(client, 'close'):
+        client.close()
+
 
-CLIENT: Elasticsearch = Elasticsearch(
+def _create_client():
+    if CONFIG.es_backend == FAKE_BACKEND:
+        from mailforce.client_operations.es.fake_elasticsearch import FakeElasticsearch
+        return FakeElasticsearch(latency_seconds=CONFIG.fake_es_latency_seconds,
+                                 connections=connections_per_node(),
+                                 http_compress=CONFIG.es_http_compress,
+                                 bandwidth_bytes_per_second=CONFIG.fake_es_bandwidth_bytes_per_second)
+    elif CONFIG.es_backend == ELASTICSEARCH_BACKEND:
+        return Elasticsearch(
             cloud_id=CONFIG.elastic_cloud_id,
-            basic_auth=('elastic', CONFIG.elastic_password))
+            basic_auth=('elastic', CONFIG.elastic_password),
+            **transport_options())
+    raise ValueError(f'Unknown ES backend {CONFIG.es_backend}')
@@ -0,0 +1,152 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+from typing import Iterable
+
+from elasticsearch import ApiError, helpers
+
+from mailforce import CONFIG
+from mailforce.client_operations.es import get_client
+from mailforce.client_operations.es.transport import BULK_OPERATION
+from mailforce.models.write_stats.write_stats import WriteStats
+from mailforce.utils.metrics_utils import timed_request
+
+CONFLICT_STATUS: int = 409
+TOO_LARGE_STATUS: int = 413
+""" Statuses with which ES rejects documents or requests it is too busy to handle, which are worth sending again. """
+RETRY_STATUSES: set[int] = {429}
+
+
+class _BulkItem:
+    """ A single action, serialized into the lines it takes up in a bulk request. """
+
+    def __init__(self, index: str, doc_id: str, lines: list[bytes]):
+        self.index: str = index
+        self.doc_id: str = doc_id
+        self.lines: list[bytes] = lines
+        self.size: int = sum(map(lambda line: len(line) + 1, lines))
+
+
+def bulk_write(actions: Iterable[dict[str, any]], write_stats: WriteStats = None) -> dict[str, int]:
+    """ Writes the given actions to ES in bulk requests sent from `CONFIG.bulk_threads` threads. Actions are consumed
+    lazily and grouped into chunks of at most `CONFIG.bulk_chunk_docs` documents and `CONFIG.bulk_chunk_bytes` bytes,
+    and at most `CONFIG.bulk_queue_depth` chunks wait for a thread, so memory stays bounded however many actions a
+    generator yields. Documents and requests rejected with a 429 are sent again after an exponentially growing delay,
+    up to `CONFIG.bulk_max_retries` times, and a request rejected as too large is split in two.
+    :param actions: Bulk actions, as taken by the ES bulk helpers.
+    :param write_stats: Collects the number of documents written, failed and retried, and the latency, per index.
+    :return: Status codes of the documents that failed to be written, keyed by document ID.
+    """
+    write_stats = write_stats if write_stats else WriteStats()
+    failures: dict[str, int] = {}
+    failures_lock = Lock()
+    threads = max(1, CONFIG.bulk_threads)
+    in_flight = BoundedSemaphore(threads + max(0, CONFIG.bulk_queue_depth))
+
+    def send(chunk: list[_BulkItem]):
+        try:
+            chunk_failures = _send_chunk(chunk, write_stats)
+        except Exception as e:
+            print(f'A bulk request failed: {str(e)}')
+            chunk_failures = _fail(chunk, None, write_stats)
+        finally:
+            in_flight.release()
+        with failures_lock:
+            failures.update(chunk_failures)
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for chunk in _chunks(actions):
+            in_flight.acquire()
+            executor.submit(send, chunk)
+    return failures
+
+
+def _chunks(actions: Iterable[dict[str, any]]) -> Iterable[list[_BulkItem]]:
+    serializer = get_client().transport.serializers.get_serializer('application/json')
+    chunk: list[_BulkItem] = []
+    chunk_size = 0
+    for action in actions:
+        (operation, data) = helpers.expand_action(action)
+        metadata = next(iter(operation.values()))
+        lines = [serializer.dumps(operation)] + ([serializer.dumps(data)] if data is not None else [])
+        item = _BulkItem(metadata.get('_index'), metadata.get('_id'), lines)
+        if chunk and (len(chunk) >= CONFIG.bulk_chunk_docs or chunk_size + item.size > CONFIG.bulk_chunk_bytes):
+            yield chunk
+            chunk, chunk_size = [], 0
+        chunk.append(item)
+        chunk_size += item.size
+    if chunk:
+        yield chunk
+
+
+def _send_chunk(chunk: list[_BulkItem], write_stats: WriteStats) -> dict[str, int]:
+    """ Sends a chunk, and then any of its documents that were rejected, until all are written or retries run out.
+    :return: Status codes of the documents that failed to be written, keyed by document ID.
+    """
+    failures: dict[str, int] = {}
+    pending: list[_BulkItem] = chunk
+    for attempt in range(CONFIG.bulk_max_retries + 1):
+        if attempt > 0:
+            time.sleep(_backoff(attempt))
+        can_retry = attempt < CONFIG.bulk_max_retries
+        start = time.perf_counter()
+        try:
+            response = timed_request('bulk', sum(map(lambda item: item.size, pending)),
+                                     lambda: get_client(BULK_OPERATION).bulk(operations=[line for item in pending
+                                                                           for line in item.lines]))
+        except ApiError as e:
+            _record_request(pending, time.perf_counter() - start, write_stats)
+            if e.status_code == TOO_LARGE_STATUS and len(pending) > 1:
+                print(f'Splitting a bulk request of {len(pending)} documents that was too large.')
+                middle = len(pending) // 2
+                failures.update(_send_chunk(pending[:middle], write_stats))
+                failures.update(_send_chunk(pending[middle:], write_stats))
+                return failures
+            if e.status_code in RETRY_STATUSES and can_retry:
+                _record_retries(pending, write_stats)
+                continue
+            print(f'A bulk request of {len(pending)} documents failed: {str(e)}')
+            failures.update(_fail(pending, e.status_code, write_stats))
+            return failures
+        _record_request(pending, time.perf_counter() - start, write_stats)
+        retries: list[_BulkItem] = []
+        for item, result in zip(pending, response.body['items']):
+            info = next(iter(result.values()))
+            status = info.get('status', 0)
+            if 200 <= status < 300:
+                write_stats.record(item.index, succeeded=1)
+            elif status in RETRY_STATUSES and can_retry:
+                retries.append(item)
+            else:
+                if status != CONFLICT_STATUS:
+                    print(f'A document failed to post: {info}')
+                failures.update(_fail([item], status, write_stats))
+        _record_retries(retries, write_stats)
+        pending = retries
+        if not pending:
+            break
+    return failures
+
+
+def _backoff(attempt: int) -> float:
+    """
+    :return: Seconds to wait before the given retry, doubling with every attempt.
+    """
+    return min(CONFIG.bulk_max_backoff_seconds, CONFIG.bulk_initial_backoff_seconds * 2 ** (attempt - 1))
+
+
+def _record_request(items: list[_BulkItem], seconds: float, write_stats: WriteStats):
+    """ Records a request, and its latency, for every index it held documents for. """
+    for index in set(map(lambda item: item.index, items)):
+        write_stats.record(index, requests=1, seconds=seconds)
+
+
+def _record_retries(items: list[_BulkItem], write_stats: WriteStats):
+    for item in items:
+        write_stats.record(item.index, retried=1)
+
+
+def _fail(items: list[_BulkItem], status: int, write_stats: WriteStats) -> dict[str, int]:
+    for item in items:
+        write_stats.record(item.index, failed=1)
+    return {item.doc_id: status for item in items}
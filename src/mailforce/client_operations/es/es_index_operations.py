@@ -1,9 +1,8 @@
 import datetime
 
-from elasticsearch import helpers
-
-from mailforce.client_operations.es import CLIENT
-from mailforce.models.domain.domain import Domain
+from mailforce.client_operations.es import get_client
+from mailforce.client_operations.es.es_bulk_operations import CONFLICT_STATUS, bulk_write
+from mailforce.models.domain.domain import Domain, domain_id, domain_stable_id
 from mailforce.models.domain.domains import Domains
 from mailforce.models.email.account.email_account import EmailAccount
 from mailforce.models.email.account.email_accounts import EmailAccounts
@@ -13,14 +12,61 @@ from mailforce.models.message.message_role import MessageRole
 from mailforce.models.message.message_roles import MessageRoles
 from mailforce.models.message.message_roles_container import MessageRolesContainer
 from mailforce.models.runtime_stats.runtime_stats import RuntimeStats
+from mailforce.models.write_stats.write_stats import WriteStats
 from mailforce.utils.date_utils import now
+from mailforce.utils.merge_utils import merge_account_docs, merge_domain_docs
+from mailforce.utils.metrics_utils import json_size, phase, timed_request
 
 ACCOUNTS_STAT_INDEX: str = 'search-accounts_statistics_simple'
 ACCOUNTS_ENGAGEMENTS_INDEX: str = 'search-accounts-engagements'
 DOMAINS_ENGAGEMENTS_INDEX: str = 'search-domains-engagements'
 RUNTIME_STATS_INDEX: str = 'search-runtime-stats'
 MESSAGE_ROLES_INDEX: str = 'search-message-roles'
-RIGHT_NOW: str = now()
+""" Index the workers of a sharded run stage their partial documents in until the reduce step reads them. """
+SHARD_PARTIALS_INDEX: str = 'search-shard-partials'
+DOMAIN_PARTIAL: str = 'domain'
+CHECKPOINT_PARTIAL: str = 'checkpoint'
+NOT_FOUND_STATUS: int = 404
+""" Number of times a document modified concurrently is merged again before giving up. """
+MERGE_ATTEMPTS: int = 3
+MGET_BATCH_SIZE: int = 1000
+""" Outcome of the bulk writes since the last call to `reset_write_stats`. """
+_write_stats: WriteStats = WriteStats()
+""" Date every document written by the current run is stamped with, set by `reset_right_now`. """
+_right_now: str = None
+
+
+def __getattr__(name: str):
+    """ Keeps `RIGHT_NOW` available as a module attribute, as the date of the current run. """
+    if name == 'RIGHT_NOW':
+        return right_now()
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+
+def reset_right_now() -> str:
+    """ Stamps the documents written from now on with the current date, e.g. at the start of a run, so that warm
+    invocations of the same process do not reuse the date of an earlier one.
+    :return: The new date.
+    """
+    global _right_now
+    _right_now = now()
+    return _right_now
+
+
+def right_now() -> str:
+    """
+    :return: Date the documents of the current run are stamped with, which is set on first use if no run was started.
+    """
+    return _right_now if _right_now is not None else reset_right_now()
+
+
+def reset_write_stats() -> WriteStats:
+    """ Starts collecting the outcome of bulk writes anew, e.g. at the start of a run.
+    :return: Write statistics that all following bulk writes are recorded in.
+    """
+    global _write_stats
+    _write_stats = WriteStats()
+    return _write_stats
 
 
 def insert_runtime_stats(runtime_stats: RuntimeStats) -> bool:
@@ -34,15 +80,28 @@ def insert_runtime_stats(runtime_stats: RuntimeStats) -> bool:
         'run_date': runtime_stats.run_date,
         'domains_processed': runtime_stats.domains_processed,
         'email_accounts_processed': runtime_stats.email_accounts_processed,
+        'email_accounts_failed': runtime_stats.email_accounts_failed,
+        'email_accounts_deferred': runtime_stats.email_accounts_deferred,
+        'email_accounts_skipped': runtime_stats.email_accounts_skipped,
         'emails_processed': runtime_stats.emails_processed,
         'to_emails_processed': runtime_stats.to_emails_processed,
         'from_emails_processed': runtime_stats.from_emails_processed,
         'cc_emails_processed': runtime_stats.cc_emails_processed,
         'start_time': datetime.datetime.fromtimestamp(runtime_stats.start_time),
         'end_time': datetime.datetime.fromtimestamp(runtime_stats.end_time),
-        'elapsed_time': runtime_stats.elapsed_time()
+        'elapsed_time': runtime_stats.elapsed_time(),
+        'write_stats': [{'index': index, **stats} for index, stats in runtime_stats.write_stats.to_json().items()],
+        'phases': [{'phase': name, **metrics.to_json()} for name, metrics in runtime_stats.metrics.phases.items()],
+        'requests': [{'operation': operation, **metrics.to_json()}
+                     for operation, metrics in runtime_stats.metrics.requests.items()],
+        'accounts_paged': runtime_stats.metrics.accounts_paged,
+        'pages': runtime_stats.metrics.pages,
+        'max_pages_per_account': runtime_stats.metrics.max_pages_per_account,
+        'peak_rss_kb': runtime_stats.metrics.peak_rss_kb()
     }
-    response = CLIENT.index(index=RUNTIME_STATS_INDEX, document=doc)
+    if runtime_stats.profile:
+        doc['profile'] = runtime_stats.profile.to_json()
+    response = get_client().index(index=RUNTIME_STATS_INDEX, document=doc)
     return True if response and response['result'] == 'created' else False
 
 
@@ -53,23 +112,7 @@ def insert_account_stats(email_accounts: EmailAccounts) -> bool:
     :return: Whether all account statistics have been updated.
     """
     print('Inserting Email Account Statistics.')
-
-    def account_json(email_account: EmailAccount):
-        return {
-            '_op_type': 'index',
-            '_index': ACCOUNTS_STAT_INDEX,
-            '_id': email_account.id(),
-            'doc': {
-                'account': email_account.account,
-                'emails_from_count': email_account.emails_from_count,
-                'emails_to_count': email_account.emails_to_count,
-                'emails_cc_count': email_account.emails_cc_count,
-                'total_emails_count': email_account.total_email_count,
-                'date': RIGHT_NOW
-            }
-        }
-
-    return _perform_bulk_operations(email_accounts.accounts, account_json)
+    return _perform_bulk_operations(email_accounts.accounts, _account_stats_json)
 
 
 def insert_account_interactions(email_accounts: EmailAccounts) -> bool:
@@ -79,39 +122,110 @@ def insert_account_interactions(email_accounts: EmailAccounts) -> bool:
     :return: True if all Email Engagements for all accounts were inserted into ES.
     """
     print('Inserting Email Account Engagement Statistics.')
+    return _perform_bulk_operations(email_accounts.accounts, _account_interactions_json)
 
-    def account_json(account: EmailAccount):
-        def email_engagement_json(email: EmailEngagement):
-            return {
-                'relationship': email.relationship,
-                'email_address': email.email_address,
-                'count': email.count,
-                'earliest_engagement_date': email.earliest_engagement_date,
-                'latest_engagement_date': email.latest_engagement_date
-            }
 
+def insert_accounts(email_accounts: EmailAccounts) -> list[EmailAccount]:
+    """ Inserts both the statistics and the engagements of the given accounts.
+    :param email_accounts: Email Accounts to be inserted.
+    :return: The accounts whose statistics and engagements were both inserted into ES.
+    """
+    print('Inserting Email Account Statistics.')
+    failed_ids = _perform_bulk_operations_with_failures(email_accounts.accounts, _account_stats_json)
+    print('Inserting Email Account Engagement Statistics.')
+    failed_ids |= _perform_bulk_operations_with_failures(email_accounts.accounts, _account_interactions_json)
+    return list(filter(lambda email_account: email_account.id() not in failed_ids, email_accounts.accounts))
+
+
+def merge_accounts(email_accounts: EmailAccounts, replace: bool = False) -> list[EmailAccount]:
+    """ Merges the engagements of the given accounts into the documents already stored for them, which are keyed by
+    account name, and then rewrites each account's statistics from its merged engagements. Only the accounts
+    present in `email_accounts` are touched.
+    :param email_accounts: Email Accounts holding the engagements of this run.
+    :param replace: Whether the stored documents are to be replaced instead, e.g. when rebuilding from scratch.
+    :return: The accounts whose statistics and engagements were both written to ES.
+    """
+    print('Merging Email Account Engagement Statistics.')
+    new_docs = {email_account.stable_id(): _account_interactions_doc(email_account)
+                for email_account in email_accounts.accounts}
+    (merged_docs, failed_ids) = _replace_documents(ACCOUNTS_ENGAGEMENTS_INDEX, new_docs) if replace \
+        else _merge_documents(ACCOUNTS_ENGAGEMENTS_INDEX, new_docs, merge_account_docs)
+    print('Merging Email Account Statistics.')
+    stats_actions = map(lambda doc_id: {
+        '_op_type': 'index',
+        '_index': ACCOUNTS_STAT_INDEX,
+        '_id': doc_id,
+        'doc': _account_stats_doc_from_engagements(merged_docs[doc_id])
+    }, merged_docs.keys())
+    failed_ids |= set(_bulk_failures(stats_actions).keys())
+    return list(filter(lambda email_account: email_account.stable_id() not in failed_ids, email_accounts.accounts))
+
+
+def _account_stats_json(email_account: EmailAccount):
+    return {
+        '_op_type': 'index',
+        '_index': ACCOUNTS_STAT_INDEX,
+        '_id': email_account.id(),
+        'doc': {
+            'account': email_account.account,
+            'emails_from_count': email_account.emails_from_count,
+            'emails_to_count': email_account.emails_to_count,
+            'emails_cc_count': email_account.emails_cc_count,
+            'total_emails_count': email_account.total_email_count,
+            'date': right_now()
+        }
+    }
+
+
+def _account_stats_doc_from_engagements(engagements_doc: dict[str, any]) -> dict[str, any]:
+    emails_from_count = len(engagements_doc['emails_from'])
+    emails_to_count = len(engagements_doc['emails_to'])
+    emails_cc_count = len(engagements_doc['emails_cc'])
+    return {
+        'account': engagements_doc['account'],
+        'emails_from_count': emails_from_count,
+        'emails_to_count': emails_to_count,
+        'emails_cc_count': emails_cc_count,
+        'total_emails_count': emails_from_count + emails_to_count + emails_cc_count,
+        'date': right_now()
+    }
+
+
+def _account_interactions_json(account: EmailAccount):
+    return {
+        '_op_type': 'index',
+        '_index': ACCOUNTS_ENGAGEMENTS_INDEX,
+        '_id': account.id(),
+        'doc': _account_interactions_doc(account)
+    }
+
+
+def _account_interactions_doc(account: EmailAccount) -> dict[str, any]:
+    def email_engagement_json(email: EmailEngagement):
         return {
-            '_op_type': 'index',
-            '_index': ACCOUNTS_ENGAGEMENTS_INDEX,
-            '_id': account.id(),
-            'doc': {
-                'account': account.account,
-                'emails_from': list(map(email_engagement_json, account.emails_from)),
-                'emails_to': list(map(email_engagement_json, account.emails_to)),
-                'emails_cc': list(map(email_engagement_json, account.emails_cc)),
-                'date': RIGHT_NOW
-            }
+            'relationship': email.relationship,
+            'email_address': email.email_address,
+            'count': email.count,
+            'earliest_engagement_date': email.earliest_engagement_date,
+            'latest_engagement_date': email.latest_engagement_date
         }
 
-    return _perform_bulk_operations(email_accounts.accounts, account_json)
+    return {
+        'account': account.account,
+        'emails_from': list(map(email_engagement_json, account.emails_from)),
+        'emails_to': list(map(email_engagement_json, account.emails_to)),
+        'emails_cc': list(map(email_engagement_json, account.emails_cc)),
+        'date': right_now()
+    }
 
 
 def insert_message_roles(message_roles_container: MessageRolesContainer):
-    print('Inserting Message Roles')
-    """ Inserts the relationships between associated message Ids and email addresses into ES.
+    """ Inserts the relationships between associated message Ids and email addresses into ES. The message roles are
+    consumed lazily, so a container wrapping a generator is indexed while later results are still being fetched.
     :param message_roles_container: Container holding all of the message roles.
     :return: Whether all message roles were inserted into ES.
     """
+    print('Inserting Message Roles')
 
     def message_roles_json(message_roles: MessageRoles):
         def message_role_json(message_role: MessageRole):
@@ -129,7 +243,7 @@ def insert_message_roles(message_roles_container: MessageRolesContainer):
                 'message_id': message_roles.message_id,
                 'message_roles': list(map(message_role_json, message_roles.roles)),
                 'account': message_roles.account,
-                'date': RIGHT_NOW
+                'date': right_now()
             }
         }
 
@@ -142,46 +256,205 @@ def insert_domains_stats(domains: Domains) -> bool:
     :param domains: Domains to be inserted into ES.
     :return: Whether all domains were inserted.
     """
-    print('Inserting Domain Level Engagement Statistics.')
+    return insert_domains_docs(list(map(domain_doc, domains.domains.values())))
 
-    def domain_json(domain: Domain):
-        def email_mapping_json(email_mapping: EmailMapping):
-            return {
-                'email_address': email_mapping.email_address,
-                'first_contact_date': email_mapping.first_contact_date,
-                'latest_contact_date': email_mapping.latest_contact_date,
-                'from_count': email_mapping.from_count,
-                'to_count': email_mapping.to_count,
-                'cc_count': email_mapping.cc_count,
-                'total_count': email_mapping.total
-            }
 
+def insert_domains_docs(docs: list[dict[str, any]]) -> bool:
+    """ Inserts domain documents as built by `domain_doc`, e.g. once those of the shards of a run have been merged.
+    :param docs: Domain documents to be inserted into ES.
+    :return: Whether all domains were inserted.
+    """
+    print('Inserting Domain Level Engagement Statistics.')
+
+    def domain_json(doc: dict[str, any]):
         return {
             '_op_type': 'index',
             '_index': DOMAINS_ENGAGEMENTS_INDEX,
-            '_id': domain.id(),
-            'doc': {
-                'date': RIGHT_NOW,
-                'domain': domain.domain,
-                'total_cc': domain.total_cc,
-                'total_to': domain.total_to,
-                'total_from': domain.total_from,
-                'total_emails': domain.total_emails,
-                'first_contact_date': domain.first_contact_date,
-                'latest_contact_date': domain.latest_contact_date,
-                'email_engagements': list(map(email_mapping_json, domain.email_mappings.values()))
-            }
+            '_id': domain_id(doc['domain'], doc['first_contact_date'], doc['latest_contact_date'],
+                             doc['total_emails'],
+                             list(map(lambda mapping: mapping['email_address'], doc['email_engagements']))),
+            'doc': doc
         }
 
-    return _perform_bulk_operations(domains.domains.values(), domain_json)
+    return _perform_bulk_operations(docs, domain_json)
+
+
+def merge_domains_stats(domains: Domains, replace: bool = False) -> bool:
+    """ Merges the domain level stats of this run into the documents already stored for the same domains, which are
+    keyed by domain name. Counts are added together and the earliest and latest contact dates are kept, so the
+    stored documents hold running totals. Only the domains present in `domains` are touched.
+    :param domains: Domains holding the engagements of this run.
+    :param replace: Whether the stored documents are to be replaced instead, e.g. when rebuilding from scratch.
+    :return: Whether all domains were written.
+    """
+    return merge_domains_docs(list(map(domain_doc, domains.domains.values())), replace)
+
+
+def merge_domains_docs(docs: list[dict[str, any]], replace: bool = False) -> bool:
+    """ Merges domain documents as built by `domain_doc` into the documents already stored for the same domains.
+    :param docs: Domain documents holding the engagements of this run.
+    :param replace: Whether the stored documents are to be replaced instead, e.g. when rebuilding from scratch.
+    :return: Whether all domains were written.
+    """
+    print('Merging Domain Level Engagement Statistics.')
+    new_docs = {domain_stable_id(doc['domain']): doc for doc in docs}
+    (_, failed_ids) = _replace_documents(DOMAINS_ENGAGEMENTS_INDEX, new_docs) if replace \
+        else _merge_documents(DOMAINS_ENGAGEMENTS_INDEX, new_docs, merge_domain_docs)
+    return len(failed_ids) == 0
+
+
+def domain_doc(domain: Domain) -> dict[str, any]:
+    """
+    :param domain: Domain to be serialized.
+    :return: Document stored for the domain in the domains engagements index.
+    """
+    def email_mapping_json(email_mapping: EmailMapping):
+        return {
+            'email_address': email_mapping.email_address,
+            'first_contact_date': email_mapping.first_contact_date,
+            'latest_contact_date': email_mapping.latest_contact_date,
+            'from_count': email_mapping.from_count,
+            'to_count': email_mapping.to_count,
+            'cc_count': email_mapping.cc_count,
+            'total_count': email_mapping.total
+        }
+
+    return {
+        'date': right_now(),
+        'domain': domain.domain,
+        'total_cc': domain.total_cc,
+        'total_to': domain.total_to,
+        'total_from': domain.total_from,
+        'total_emails': domain.total_emails,
+        'first_contact_date': domain.first_contact_date,
+        'latest_contact_date': domain.latest_contact_date,
+        'email_engagements': list(map(email_mapping_json, domain.email_mappings.values()))
+    }
+
+
+def stage_partials(key: str, kind: str, docs: list[dict[str, any]]) -> bool:
+    """ Stages documents of a shard of a run, one per ES document, for the reduce step to read back with
+    `get_staged_partials`.
+    :param key: Key of the shard and invocation, as returned by `ShardResult.staging_key`.
+    :param kind: Kind of the documents, e.g. `DOMAIN_PARTIAL`.
+    :param docs: Documents to be staged, e.g. domain documents as built by `domain_doc`.
+    :return: Whether all documents were staged.
+    """
+    return _perform_bulk_operations(enumerate(docs), lambda position_doc: {
+        '_op_type': 'index',
+        '_index': SHARD_PARTIALS_INDEX,
+        '_id': _partial_id(key, kind, position_doc[0]),
+        'doc': position_doc[1]
+    })
+
+
+def get_staged_partials(key: str, kind: str, count: int) -> list[dict[str, any]]:
+    """
+    :param key: Key of the shard and invocation, as returned by `ShardResult.staging_key`.
+    :param kind: Kind of the documents.
+    :param count: Number of documents that were staged.
+    :return: The staged documents, or None if any of them is missing.
+    """
+    documents = _get_documents(SHARD_PARTIALS_INDEX, [_partial_id(key, kind, position) for position in range(count)])
+    if any(document is None for document in documents.values()):
+        return None
+    return [document['_source']['doc'] for document in documents.values()]
+
+
+def delete_staged_partials(key: str, kind: str, count: int) -> bool:
+    """ Deletes the documents staged by `stage_partials`, once the reduce step has written what they hold.
+    :return: Whether all documents were deleted, or did not exist anymore.
+    """
+    failures = _bulk_failures(map(lambda position: {
+        '_op_type': 'delete',
+        '_index': SHARD_PARTIALS_INDEX,
+        '_id': _partial_id(key, kind, position)
+    }, range(count)))
+    return all(status == NOT_FOUND_STATUS for status in failures.values())
+
+
+def _partial_id(key: str, kind: str, position: int) -> str:
+    return f'{key}.{kind}.{position}'
+
+
+def _merge_documents(index: str, new_docs: dict[str, dict[str, any]], merge_function) \
+        -> (dict[str, dict[str, any]], set[str]):
+    """ Read-merge-writes documents. Existing documents are merged with `merge_function` and written back only if
+    they have not changed in the meantime; documents that did not exist are created. Documents that were changed
+    or created concurrently are merged again, up to `MERGE_ATTEMPTS` times.
+    :return: The merged documents that were written, keyed by ID, and the IDs of the documents that could not be.
+    """
+    written: dict[str, dict[str, any]] = {}
+    failed_ids: set[str] = set()
+    pending: dict[str, dict[str, any]] = new_docs
+    for attempt in range(MERGE_ATTEMPTS):
+        merged_docs: dict[str, dict[str, any]] = {}
+        actions: list[dict[str, any]] = []
+        for doc_id, existing in _get_documents(index, list(pending.keys())).items():
+            action = {'_index': index, '_id': doc_id}
+            if existing:
+                merged_docs[doc_id] = merge_function(existing['_source']['doc'], pending[doc_id])
+                action.update({'_op_type': 'index', 'if_seq_no': existing['_seq_no'],
+                               'if_primary_term': existing['_primary_term']})
+            else:
+                merged_docs[doc_id] = pending[doc_id]
+                action['_op_type'] = 'create'
+            action['doc'] = merged_docs[doc_id]
+            actions.append(action)
+        failures = _bulk_failures(actions)
+        conflicts = {doc_id: pending[doc_id] for doc_id, status in failures.items() if status == CONFLICT_STATUS}
+        failed_ids |= set(failures.keys()) - set(conflicts.keys())
+        written.update({doc_id: doc for doc_id, doc in merged_docs.items() if doc_id not in failures})
+        pending = conflicts
+        if len(pending) == 0:
+            break
+        print(f'Retrying {len(pending)} documents in {index} that were modified concurrently.')
+    failed_ids |= set(pending.keys())
+    return written, failed_ids
+
+
+def _replace_documents(index: str, new_docs: dict[str, dict[str, any]]) -> (dict[str, dict[str, any]], set[str]):
+    """ Overwrites documents, which needs neither reading the stored ones nor guarding against concurrent changes.
+    :return: The documents that were written, keyed by ID, and the IDs of the documents that could not be.
+    """
+    failures = _bulk_failures(map(lambda doc_id: {
+        '_op_type': 'index',
+        '_index': index,
+        '_id': doc_id,
+        'doc': new_docs[doc_id]
+    }, new_docs.keys()))
+    return {doc_id: doc for doc_id, doc in new_docs.items() if doc_id not in failures}, set(failures.keys())
+
+
+def _get_documents(index: str, ids: list[str]) -> dict[str, dict[str, any]]:
+    """
+    :return: The stored documents, keyed by ID. Documents that do not exist map to None.
+    """
+    documents: dict[str, dict[str, any]] = {}
+    if not get_client().indices.exists(index=index):
+        return {doc_id: None for doc_id in ids}
+    for start in range(0, len(ids), MGET_BATCH_SIZE):
+        batch = ids[start:start + MGET_BATCH_SIZE]
+        response = timed_request('mget', json_size({'ids': batch}), lambda: get_client().mget(index=index, ids=batch))
+        for doc in response['docs']:
+            documents[doc['_id']] = doc if doc.get('found') else None
+    return documents
 
 
 def _perform_bulk_operations(json_list, mapping_function) -> bool:
-    actions = list(map(mapping_function, json_list))
-    response = helpers.parallel_bulk(CLIENT, actions=actions)
-    failures = 0
-    for success, info in response:
-        if not success:
-            print(f'A document failed to post: {info}')
-            failures += 1
-    return failures == 0
+    return len(_perform_bulk_operations_with_failures(json_list, mapping_function)) == 0
+
+
+def _perform_bulk_operations_with_failures(json_list, mapping_function) -> set[str]:
+    """
+    :return: IDs of the documents that failed to post.
+    """
+    return set(_bulk_failures(map(mapping_function, json_list)).keys())
+
+
+def _bulk_failures(actions) -> dict[str, int]:
+    """
+    :return: Status codes of the documents that failed to post, keyed by document ID.
+    """
+    with phase('bulk_write'):
+        return bulk_write(actions, _write_stats)
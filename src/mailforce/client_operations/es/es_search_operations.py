@@ -1,13 +1,53 @@
-from mailforce.client_operations.es import CLIENT
+import time
+from contextlib import closing
+from threading import Lock
+from typing import Iterator
+
+from mailforce import CONFIG
+from mailforce.client_operations.es import get_client
+from mailforce.client_operations.es.transport import SEARCH_OPERATION
+from mailforce.models.account_summary.account_summary import AccountSummary
+from mailforce.models.checkpoint.checkpoint import Checkpoint
+from mailforce.models.deadline.deadline import Deadline
+from mailforce.models.domain.domains import Domains
 from mailforce.models.email.account.email_account import EmailAccount
+from mailforce.models.email.engagement.email_engagement import EmailEngagement
 from mailforce.models.message.message_roles import MessageRoles
 from mailforce.utils.date_utils import now
+from mailforce.utils.domain_utils import get_domains, is_valid_domain, normalize_domain
+from mailforce.utils.iter_utils import prefetch
+from mailforce.utils.metrics_utils import json_size, phase, record_pages, timed_request
 
 INDEX: str = 'search-shinobi-email'
 RUNTIME_STATS_INDEX: str = 'search-runtime-stats'
 MIN_DATE: str = '2023-01-01'
 MAX_DATE: str = '2023-12-30'
 BATCH_SIZE: int = 2500
+COMPOSITE_PAGE_SIZE: int = 1000
+""" Maximum number of values in a `terms` query, as limited by ES by default. """
+MAX_TERMS: int = 65536
+""" Maximum number of accounts rolled up by a single query. Every account adds its own date range clauses, which must
+stay well within `indices.query.bool.max_clause_count`. """
+ROLLUP_ACCOUNTS_PER_QUERY: int = 250
+""" Composite aggregation names mapped to the address field they group by and the resulting engagement relationship. """
+ENGAGEMENT_AGGREGATIONS: dict[str, tuple[str, str]] = {
+    'group_by_from': ('from.address', 'from'),
+    'group_by_to': ('to.address', 'to'),
+    'group_by_cc': ('cc.address', 'cc')
+}
+""" Runtime field script emitting the addresses of `params.field` whose domain is allow-listed, or all of them if
+`params.domains` is empty. The domain is taken and normalized the same way as by `EmailEngagement` and
+`normalize_domain`, so that the allow-list is applied on the cluster exactly as it is in Python. """
+ALLOWED_ADDRESS_SCRIPT: str = """
+for (def address : doc[params.field]) {
+  int at = address.indexOf('@');
+  if (at < 0) { continue; }
+  int end = address.indexOf('@', at + 1);
+  String domain = (end < 0 ? address.substring(at + 1) : address.substring(at + 1, end)).trim().toLowerCase();
+  while (domain.endsWith('.')) { domain = domain.substring(0, domain.length() - 1); }
+  if (params.domains.isEmpty() || params.domains.containsKey(domain)) { emit(address); }
+}
+"""
 
 
 def get_emails_by_account(account: str, from_date_inclusive: str = None, to_date_inclusive: str = None) \
@@ -44,42 +84,175 @@ def get_last_runtime_date():
         return None
 
 
-def get_aggregated_emails_by_account(account: str, last_runtime_date: str = None) -> EmailAccount:
+def get_aggregated_emails_by_account(account: str, last_runtime_date: str = None, up_to: str = None) -> EmailAccount:
     """ Gets all the aggregated `to`, `from` and `cc` email addresses for the account in question.
-    If no results are returned, then an alternate index will be searched.
+    The addresses are paged through with composite aggregations, so every unique address is fetched exactly once
+    and no individual email documents are returned.
     :param account:
     :param last_runtime_date: Last runtime date. If present, then all results posted after this date will be gotten.
     If not present, then all results in the index up until the present date will be fetched.
-    :return: EmailAccount
+    :param up_to: If present, only results posted up to this date (inclusive) will be gotten.
+    :return: EmailAccount, or None if the account has no emails in the requested date range.
     """
-    results = _search_aggregated_emails_by_account(account=account,
-                                                   last_runtime_date=last_runtime_date)
-    hits = results['hits']['hits']
-    # noinspection PyTypeChecker
-    master_email_account: EmailAccount = None
-    while len(hits) > 0:
-        print(f'Processing {len(hits)} email search results for account {account}')
-        for agg in results['aggregations'].keys():
-            remaining_docs = results['aggregations'][agg]['sum_other_doc_count']
-            if remaining_docs and remaining_docs > 0:
-                print(
-                    f'Warning - still {remaining_docs} more results for {agg} in account {account} for aggregation {agg}')
-        if master_email_account is None:
-            master_email_account = EmailAccount(results, account)
-        else:
-            email_account = EmailAccount(results, account)
-            master_email_account.append_emails(email_account)
-        last_index = len(hits) - 1
-        search_after = hits[last_index]['sort'][0]
-        results = _search_aggregated_emails_by_account(account=account,
-                                                       last_runtime_date=last_runtime_date,
-                                                       search_after=search_after)
-        hits = results['hits']['hits']
-    return master_email_account
+    after_keys: dict[str, dict[str, any]] = {aggregation: None for aggregation in ENGAGEMENT_AGGREGATIONS}
+    results = _search_composite_emails_by_account(account=account,
+                                                  last_runtime_date=last_runtime_date,
+                                                  after_keys=after_keys,
+                                                  up_to=up_to)
+    if results['hits']['total']['value'] == 0:
+        return None
+    email_account: EmailAccount = EmailAccount(account=account)
+    email_account.latest_date = results['aggregations']['latest_date'].get('value_as_string')
+    _add_page(email_account, results, after_keys)
+    pages = 1
+    while len(after_keys) > 0:
+        results = _search_composite_emails_by_account(account=account,
+                                                      last_runtime_date=last_runtime_date,
+                                                      after_keys=after_keys,
+                                                      up_to=up_to)
+        _add_page(email_account, results, after_keys)
+        pages += 1
+    record_pages(pages)
+    return email_account
 
 
-def search_accounts():
+def get_aggregated_emails_by_accounts(accounts: dict[str, str]) -> (dict[str, EmailAccount], dict[str, Exception]):
+    """ Does the same as `get_aggregated_emails_by_account` for several accounts at once: the page of every account
+    is packed into a single msearch request, followed by the next pages of those accounts with more addresses, so
+    small accounts take a fraction of a round trip each. An account whose search fails does not affect the others.
+    :param accounts: Accounts, each mapped to the last runtime date from which its emails are to be fetched, or None.
+    :return: EmailAccount of every account that has emails in the requested date range, and the error of every
+    account whose search failed, both keyed by account.
+    """
+    email_accounts: dict[str, EmailAccount] = {}
+    errors: dict[str, Exception] = {}
+    pages: dict[str, int] = {}
+    pending: dict[str, dict[str, dict[str, any]]] = {account: {aggregation: None
+                                                               for aggregation in ENGAGEMENT_AGGREGATIONS}
+                                                     for account in accounts}
+    while len(pending) > 0:
+        searches = []
+        for account, after_keys in pending.items():
+            searches += [{'index': INDEX}, _composite_emails_by_account_query(account, accounts[account], after_keys)]
+        responses = timed_request('msearch', sum(map(lambda search: json_size(search) + 1, searches)),
+                                  lambda: get_client(SEARCH_OPERATION).msearch(searches=searches))['responses']
+        for (account, after_keys), results in zip(list(pending.items()), responses):
+            if 'error' in results:
+                errors[account] = RuntimeError(f'{results.get("status")} {results["error"]}')
+                email_accounts.pop(account, None)
+                del pending[account]
+                continue
+            if account not in email_accounts:
+                if results['hits']['total']['value'] == 0:
+                    del pending[account]
+                    continue
+                email_accounts[account] = EmailAccount(account=account)
+                email_accounts[account].latest_date = results['aggregations']['latest_date'].get('value_as_string')
+            _add_page(email_accounts[account], results, after_keys)
+            pages[account] = pages.get(account, 0) + 1
+            if len(after_keys) == 0:
+                del pending[account]
+    for account in email_accounts:
+        record_pages(pages[account])
+    return email_accounts, errors
+
+
+def get_domain_rollups(account_ranges: dict[str, tuple[str, str]]) -> Domains:
+    """ Computes the domain statistics of the given accounts on the cluster instead of from their engagements. Every
+    address of an allow-listed domain is rolled up per role with composite aggregations, over the emails of up to
+    `ROLLUP_ACCOUNTS_PER_QUERY` accounts at once, and the resulting buckets are added to `Domains` just like the
+    engagements of each account would have been, so the domain documents are the same.
+    :param account_ranges: For every account, the date after which and the date up to which (inclusive) its emails
+    are rolled up. The first one may be None to roll up all of its emails, the second one to roll up to the present.
+    :return: Domains of the emails of these accounts.
+    """
+    domains: Domains = Domains()
+    accounts = list(account_ranges.keys())
+    for i in range(0, len(accounts), ROLLUP_ACCOUNTS_PER_QUERY):
+        _add_domain_rollups(domains, {account: account_ranges[account]
+                                      for account in accounts[i:i + ROLLUP_ACCOUNTS_PER_QUERY]})
+    print(f'Rolled up {len(domains.domains)} domains for {len(account_ranges)} accounts')
+    return domains
+
+
+def _add_domain_rollups(domains: Domains, account_ranges: dict[str, tuple[str, str]]):
+    """ Adds the buckets of every page of the rollups of the given accounts to `domains`. The same address may be
+    rolled up for several groups of accounts, in which case it is added once per group, as it would be per account. """
+    after_keys: dict[str, dict[str, any]] = {aggregation: None for aggregation in ENGAGEMENT_AGGREGATIONS}
+    while len(after_keys) > 0:
+        results = _search(_domain_rollups_query(account_ranges, after_keys), INDEX)
+        for aggregation in list(after_keys.keys()):
+            composite = results['aggregations'][aggregation]
+            buckets = _address_buckets(composite['buckets'])
+            (_, relationship) = ENGAGEMENT_AGGREGATIONS[aggregation]
+            for bucket in buckets:
+                email = EmailEngagement(email_json=bucket, relationship=relationship, account=None)
+                if is_valid_domain(email.domain):
+                    domains.add_email(email)
+            if len(buckets) < COMPOSITE_PAGE_SIZE or 'after_key' not in composite:
+                del after_keys[aggregation]
+            else:
+                after_keys[aggregation] = composite['after_key']
+
+
+_accounts_cache: dict[bool, tuple[float, list[AccountSummary]]] = {}
+_accounts_cache_lock: Lock = Lock()
+
+
+def discover_accounts(include_latest_date: bool = False, refresh: bool = False) -> list[AccountSummary]:
+    """ Pages through every distinct account of the email index with a composite aggregation, however many there are.
+    Results are cached for `CONFIG.accounts_cache_ttl_seconds`, so that repeat invocations of a warm process skip the
+    query.
+    :param include_latest_date: Whether the date of the latest email of every account is fetched in the same pass.
+    :param refresh: Whether the cache is bypassed and refreshed.
+    :return: All accounts, in the order of their names.
+    """
+    with _accounts_cache_lock:
+        # Summaries holding latest dates serve requests that do not need them as well.
+        for cached_key in sorted({include_latest_date, True}, reverse=True):
+            cached = _accounts_cache.get(cached_key)
+            if not refresh and cached and time.monotonic() - cached[0] < CONFIG.accounts_cache_ttl_seconds:
+                return list(cached[1])
+    summaries: list[AccountSummary] = []
+    after_key = None
+    while True:
+        composite = _search_accounts_composite(include_latest_date, after_key)['aggregations']['accounts']
+        summaries += map(AccountSummary, composite['buckets'])
+        if len(composite['buckets']) < COMPOSITE_PAGE_SIZE or 'after_key' not in composite:
+            break
+        after_key = composite['after_key']
+    print(f'Discovered {len(summaries)} accounts')
+    with _accounts_cache_lock:
+        _accounts_cache[include_latest_date] = (time.monotonic(), summaries)
+    return list(summaries)
+
+
+def get_latest_timestamps(accounts: list[str], after: str = None) -> dict[str, int]:
+    """ Probes which accounts have new emails with a single aggregation over all of them, which is much cheaper than
+    aggregating the engagements of every account.
+    :param accounts: Accounts to be probed.
+    :param after: If present, only emails after this date are considered.
+    :return: Epoch milliseconds of the latest email of every account that has any, keyed by account.
     """
+    latest_timestamps: dict[str, int] = {}
+    date_filter = [{'range': {'date': {'format': 'strict_date_optional_time', 'gt': after}}}] if after else []
+    for i in range(0, len(accounts), MAX_TERMS):
+        query = {'bool': {'filter': [{'terms': {'account': accounts[i:i + MAX_TERMS]}}] + date_filter}}
+        after_key = None
+        while True:
+            composite = _search_accounts_composite(True, after_key, query)['aggregations']['accounts']
+            for bucket in composite['buckets']:
+                if bucket['latest_date'].get('value') is not None:
+                    latest_timestamps[bucket['key']['account']] = int(bucket['latest_date']['value'])
+            if len(composite['buckets']) < COMPOSITE_PAGE_SIZE or 'after_key' not in composite:
+                break
+            after_key = composite['after_key']
+    return latest_timestamps
+
+
+def search_accounts():
+    """ Only the first 10000 accounts are aggregated, and only the first hits are returned, so use `discover_accounts`
+    to find all of them.
     :return: All email accounts present in this index
     """
     query = {
@@ -90,44 +263,114 @@ def search_accounts():
         "fields": ["account"],
         "_source": 'false'
     }
-    return CLIENT.search(index=INDEX, body=query)
+    return get_client(SEARCH_OPERATION).search(index=INDEX, body=query)
 
 
-def get_message_roles(last_runtime_date: str = None) -> list[MessageRoles]:
+def get_message_roles(last_runtime_date: str = None, accounts: list[str] = None,
+                      excluded_accounts: list[str] = None) -> list[MessageRoles]:
     """
     :param last_runtime_date: Last runtime date. If present, then all results posted after this date will be gotten.
     If not present, then all results in the index up until the present date will be fetched.
+    :param accounts: If present, only messages belonging to these accounts will be fetched.
+    :param excluded_accounts: If present, messages belonging to these accounts will not be fetched.
     :return: All message roles across accounts.
     """
-    response = _search_message_roles(last_runtime_date=last_runtime_date)
+    return list(iter_message_roles(last_runtime_date=last_runtime_date, accounts=accounts,
+                                   excluded_accounts=excluded_accounts))
+
+
+def iter_message_roles(last_runtime_date: str = None, accounts: list[str] = None,
+                       excluded_accounts: list[str] = None, checkpoint: Checkpoint = None,
+                       deadline: Deadline = None) -> Iterator[MessageRoles]:
+    """ Lazily yields message roles one search page at a time, so only the current and the next page are held in
+    memory. The next page is fetched in the background while the current one is being consumed.
+    :param last_runtime_date: Last runtime date. If present, then all results posted after this date will be gotten.
+    If not present, then all results in the index up until the present date will be fetched.
+    :param accounts: If present, only messages belonging to these accounts will be fetched.
+    :param excluded_accounts: If present, messages belonging to these accounts will not be fetched.
+    :param checkpoint: If present, it is advanced past each page once all of that page's message roles have been
+    consumed. If it holds the sort values of a hit, the extraction resumes right after that hit instead of after
+    `last_runtime_date`, so that no message sharing its date is skipped.
+    :param deadline: If present, no further pages are fetched or yielded once it has expired.
+    :return: Iterator over all message roles across accounts.
+    """
+    processed = 0
+    (start_date, search_after) = (checkpoint.date, checkpoint.search_after) if checkpoint and checkpoint.has_cursor() \
+        else (last_runtime_date, None)
+    # Closing the pages stops the page being prefetched when the deadline or the consumer cuts the extraction short.
+    with closing(prefetch(_message_role_pages(start_date, accounts, excluded_accounts, deadline,
+                                              search_after))) as pages:
+        for hits in pages:
+            if deadline and deadline.expired():
+                print('Stopping message roles extraction as the deadline is near.')
+                break
+            print(f'Processing {len(hits)} message roles search results')
+            processed += len(hits)
+            with phase('message_roles'):
+                message_roles = [MessageRoles(hit['fields']) for hit in hits]
+            yield from message_roles
+            if checkpoint:
+                last_hit = hits[len(hits) - 1]
+                checkpoint.advance(last_hit['fields']['date'][0], last_hit['sort'])
+    print(f'Processed {processed} results.')
+
+
+def _message_role_pages(last_runtime_date, accounts, excluded_accounts, deadline=None, search_after=None):
+    response = _search_message_roles(last_runtime_date=last_runtime_date, accounts=accounts,
+                                     excluded_accounts=excluded_accounts, search_after=search_after)
     hits = response['hits']['hits']
-    all_hits = []
     while len(hits) > 0:
-        all_hits += hits
-        print(f'Processing {len(hits)} message roles search results')
+        yield hits
+        if deadline and deadline.expired():
+            return
         last_index = len(hits) - 1
-        search_after = hits[last_index]['sort'][0]
-        response = _search_message_roles(last_runtime_date=last_runtime_date, search_after=search_after)
+        search_after = hits[last_index]['sort']
+        response = _search_message_roles(last_runtime_date=last_runtime_date, accounts=accounts,
+                                         excluded_accounts=excluded_accounts, search_after=search_after)
         hits = response['hits']['hits']
-    print(f'Processed {len(all_hits)} results.')
-    return list(map(lambda message_role_json: MessageRoles(message_role_json['fields']), all_hits))
 
 
-def _search_message_roles(last_runtime_date, search_after=None):
+def _search_message_roles(last_runtime_date, accounts=None, excluded_accounts=None, search_after=None):
+    return _search(_message_roles_query(last_runtime_date, accounts, excluded_accounts, search_after), INDEX)
+
+
+def _message_roles_query(last_runtime_date: str = None, accounts: list[str] = None,
+                         excluded_accounts: list[str] = None, search_after: list = None) -> dict[str, any]:
+    """
+    :param last_runtime_date: If present, only messages posted after this date are searched, otherwise all of them up
+    until the present date, as in a full rebuild.
+    :param accounts: If present, only messages belonging to these accounts are searched.
+    :param excluded_accounts: If present, messages belonging to these accounts are not searched.
+    :param search_after: If present, sort values of the hit after which the page starts. Messages posted on
+    `last_runtime_date` are then searched as well, as only the sort values tell those already extracted apart.
+    :return: Query of a page of message roles, sorted by date and then by message ID, which tells apart messages
+    sharing a date.
+    """
+    date_range = _date_aggs(last_runtime_date)
+    if search_after and 'gt' in date_range:
+        date_range['gte'] = date_range.pop('gt')
+    bool_query = {
+        "must": [{"range": {"date": date_range}}]
+    }
+    if accounts:
+        bool_query["filter"] = [{"terms": {"account": accounts}}]
+    if excluded_accounts:
+        bool_query["must_not"] = [{"terms": {"account": excluded_accounts}}]
     query = {
         "size": BATCH_SIZE,
         "query": {
-            "bool": {
-                "must": [{"range": {"date": _date_aggs(last_runtime_date)}}]
-            }
+            "bool": bool_query
         },
         "sort": [
-            {"date": {"order": "asc"}}
+            {"date": {"order": "asc"}},
+            {"messageId": {"order": "asc"}}
         ],
-        "fields": ["account", "messageId", "cc.address", "to.address", "from.address"],
+        "fields": ["account", "messageId", "date", "cc.address", "to.address", "from.address"],
         "_source": "false"
     }
-    return _search(query, INDEX, search_after)
+    if search_after:
+        query["search_after"] = search_after
+    return query
 
 
 def _search_emails_by_account(account, from_date_inclusive=None, to_date_inclusive=None, search_after=None):
@@ -160,53 +403,144 @@ def _search_emails_by_account(account, from_date_inclusive=None, to_date_inclusi
     return _search(query, INDEX, search_after)
 
 
-def _search_aggregated_emails_by_account(account, last_runtime_date, search_after=None):
-    def group_by_aggs(field):
+def _add_page(email_account: EmailAccount, results, after_keys: dict[str, dict[str, any]]):
+    """ Adds a page of engagements to the account, and moves the after key of every aggregation to the next page.
+    Aggregations that have no more pages are removed from `after_keys`. """
+    for aggregation in list(after_keys.keys()):
+        composite = results['aggregations'][aggregation]
+        buckets = _address_buckets(composite['buckets'])
+        (_, relationship) = ENGAGEMENT_AGGREGATIONS[aggregation]
+        print(f'Processing {len(buckets)} {relationship} engagements for account {email_account.account}')
+        email_account.add_buckets(buckets, relationship)
+        if len(buckets) < COMPOSITE_PAGE_SIZE or 'after_key' not in composite:
+            del after_keys[aggregation]
+        else:
+            after_keys[aggregation] = composite['after_key']
+
+
+def _search_composite_emails_by_account(account, last_runtime_date, after_keys, up_to=None):
+    return _search(_composite_emails_by_account_query(account, last_runtime_date, after_keys, up_to), INDEX)
+
+
+def _composite_emails_by_account_query(account, last_runtime_date, after_keys, up_to=None):
+    def composite_aggs(field, after_key):
+        composite = {
+            'size': COMPOSITE_PAGE_SIZE,
+            'sources': [{'address': {'terms': {'field': field}}}]
+        }
+        if after_key:
+            composite['after'] = after_key
         return {
-            'terms': {'field': field, 'size': 10000},
+            'composite': composite,
             'aggs': {
                 'max_date': {'max': {'field': 'date'}},
                 'min_date': {'min': {'field': 'date'}}
             }
         }
 
+    aggs = {aggregation: composite_aggs(ENGAGEMENT_AGGREGATIONS[aggregation][0], after_key)
+            for aggregation, after_key in after_keys.items()}
+    aggs['latest_date'] = {'max': {'field': 'date'}}
     query = {
-        'size': BATCH_SIZE,
-        'aggs': {
-            'group_by_from': group_by_aggs('from.address'),
-            'group_by_to': group_by_aggs('to.address'),
-            'group_by_cc': group_by_aggs('cc.address')
-        },
+        'size': 0,
+        'aggs': aggs,
         'query': {
             'bool': {
                 'must': [
                     {'term': {'account': account}},
-                    {'range': {'date': _date_aggs(last_runtime_date)}}
+                    {'range': {'date': _date_aggs(last_runtime_date, up_to)}}
                 ]
             }
-        },
-        "sort": [
-            {"date": {
-                "order": "asc"
-            }}
-        ],
-        '_source': 'false'
+        }
     }
-    return _search(query, INDEX, search_after)
+    return query
+
+
+def _domain_rollups_query(account_ranges: dict[str, tuple[str, str]], after_keys: dict[str, dict[str, any]]) \
+        -> dict[str, any]:
+    # Subdomains can only be matched in Python, so every address is then emitted and filtered afterwards.
+    allowed_domains = {} if CONFIG.match_subdomains \
+        else {domain: True for domain in filter(None, map(normalize_domain, get_domains()))}
+
+    def runtime_field(field):
+        return {
+            'type': 'keyword',
+            'script': {'source': ALLOWED_ADDRESS_SCRIPT, 'params': {'field': field, 'domains': allowed_domains}}
+        }
+
+    def composite_aggs(role, after_key):
+        composite = {
+            'size': COMPOSITE_PAGE_SIZE,
+            'sources': [{'address': {'terms': {'field': f'allowed_{role}_address'}}}]
+        }
+        if after_key:
+            composite['after'] = after_key
+        return {
+            'composite': composite,
+            'aggs': {
+                'max_date': {'max': {'field': 'date'}},
+                'min_date': {'min': {'field': 'date'}}
+            }
+        }
+
+    def account_range(account, date_range):
+        (after, up_to) = date_range
+        date_aggregation = {'format': 'strict_date_optional_time', 'lte': up_to if up_to else now()}
+        if after:
+            date_aggregation['gt'] = after
+        return {'bool': {'filter': [{'term': {'account': account}}, {'range': {'date': date_aggregation}}]}}
+
+    return {
+        'size': 0,
+        'runtime_mappings': {f'allowed_{role}_address': runtime_field(field)
+                             for (field, role) in ENGAGEMENT_AGGREGATIONS.values()},
+        'aggs': {aggregation: composite_aggs(ENGAGEMENT_AGGREGATIONS[aggregation][1], after_key)
+                 for aggregation, after_key in after_keys.items()},
+        'query': {
+            'bool': {
+                'should': [account_range(account, date_range) for account, date_range in account_ranges.items()],
+                'minimum_should_match': 1
+            }
+        }
+    }
+
+
+def _search_accounts_composite(include_latest_date: bool, after_key: dict[str, any], query: dict[str, any] = None):
+    composite = {'size': COMPOSITE_PAGE_SIZE, 'sources': [{'account': {'terms': {'field': 'account'}}}]}
+    if after_key:
+        composite['after'] = after_key
+    aggregation = {'composite': composite}
+    if include_latest_date:
+        aggregation['aggs'] = {'latest_date': {'max': {'field': 'date'}}}
+    search = {'size': 0, 'aggs': {'accounts': aggregation}}
+    if query:
+        search['query'] = query
+    return _search(search, INDEX)
+
+
+def _address_buckets(buckets):
+    """ Flattens the `key` of each composite bucket to the bare email address, which is the shape that
+    `EmailEngagement` expects from a `terms` bucket. """
+    for bucket in buckets:
+        bucket['key'] = bucket['key']['address']
+    return buckets
 
 
 def _search(query, index, search_after=None):
     if search_after:
         query['search_after'] = [search_after]
-    return CLIENT.search(index=index, body=query)
+    return timed_request('search', json_size(query),
+                         lambda: get_client(SEARCH_OPERATION).search(index=index, body=query))
 
 
-def _date_aggs(last_runtime_date=None):
+def _date_aggs(last_runtime_date=None, up_to=None):
     date_aggregation = {
         'format': "strict_date_optional_time"
     }
     if last_runtime_date:
         date_aggregation['gt'] = last_runtime_date
-    else:
+    if up_to:
+        date_aggregation['lte'] = up_to
+    elif not last_runtime_date:
         date_aggregation['lte'] = now()
     return date_aggregation
@@ -0,0 +1,489 @@
+import gzip
+import itertools
+import json
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from threading import BoundedSemaphore, Lock
+
+from elastic_transport import ApiResponseMeta, HttpHeaders, NodeConfig, SerializerCollection
+from elasticsearch import ApiError, BadRequestError, NotFoundError
+
+from mailforce.utils.date_utils import EPOCH
+
+""" Operations of a bulk request that are followed by a document line. """
+_DOCUMENT_OPERATIONS: set[str] = {'index', 'create', 'update'}
+
+
+class FakeElasticsearch:
+    """ Stands in for `Elasticsearch` in the same process, e.g. to benchmark a run without a cluster. It implements
+    the subset of the API that Mailforce uses, on documents held in memory:
+        * `search` and `msearch`, with `match_all`, `bool`, `term`, `terms`, `range`, `exists` and `field:*`
+          `query_string` queries, `size`, `sort` and `search_after` on one or more fields, `fields`, and `min`, `max`,
+          `terms` and `composite` aggregations, which may hold `min` and `max` sub-aggregations;
+        * `index`, `bulk` with `index`, `create`, `update` and `delete` operations and optimistic concurrency, `mget`,
+          `indices.exists` and `indices.create`.
+    Runtime fields are not supported. Every request waits `latency_seconds` before it is handled, outside of any lock,
+    so that concurrent requests overlap as they would against a cluster. Requests, and the bytes of their bodies and
+    responses once serialized to JSON, are counted per API.
+    A transport can be simulated as well: at most `connections` requests are in flight at once, the others waiting for
+    a connection as they would in the pool of a real client, and bodies and responses take their size over
+    `bandwidth_bytes_per_second` to transfer. With `http_compress`, they are gzipped, which is what is counted, and the
+    time this takes stands in for that of the client and the cluster.
+    """
+
+    def __init__(self, latency_seconds: float = 0, measure_bytes: bool = True, connections: int = None,
+                 http_compress: bool = False, bandwidth_bytes_per_second: int = 0):
+        """
+        :param latency_seconds: Seconds every request takes on top of handling it.
+        :param measure_bytes: Whether the bytes of requests and responses are counted, which takes as long as
+        serializing them. Always the case if `http_compress` or `bandwidth_bytes_per_second` is set.
+        :param connections: Number of requests that may be in flight at once, or None for no limit.
+        :param http_compress: Whether bodies and responses are gzipped.
+        :param bandwidth_bytes_per_second: Bytes transferred per second by every connection, or 0 for no limit.
+        """
+        self.latency_seconds: float = latency_seconds
+        self.http_compress: bool = http_compress
+        self.bandwidth_bytes_per_second: int = bandwidth_bytes_per_second
+        self.measure_bytes: bool = measure_bytes or http_compress or bandwidth_bytes_per_second > 0
+        self.connections: int = connections
+        self._connections: BoundedSemaphore = BoundedSemaphore(connections) if connections else None
+        """ Documents keyed by index and ID, each with its sequence number. """
+        self.documents: dict[str, dict[str, tuple[int, dict[str, any]]]] = {}
+        self.calls: Counter = Counter()
+        self.request_bytes: Counter = Counter()
+        self.response_bytes: Counter = Counter()
+        self.indices: _FakeIndices = _FakeIndices(self)
+        self.transport: _FakeTransport = _FakeTransport()
+        self._lock: Lock = Lock()
+        self._seq_no = itertools.count()
+
+    def options(self, **kwargs):
+        """ Options only matter to the transport of a real client, so this client is returned as is. """
+        return self
+
+    def add_documents(self, index: str, documents: list[dict[str, any]]):
+        """ Loads documents without going through, or being counted as, a request.
+        :param index: Name of the index, which is created if needed.
+        :param documents: Sources of the documents, which are given random IDs.
+        """
+        with self._lock:
+            stored = self.documents.setdefault(index, {})
+            for document in documents:
+                stored[uuid.uuid4().hex] = (next(self._seq_no), document)
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """
+        :return: Requests made, and bytes sent and received, per API.
+        """
+        with self._lock:
+            return {api: {'calls': self.calls[api], 'request_bytes': self.request_bytes[api],
+                          'response_bytes': self.response_bytes[api]} for api in sorted(self.calls.keys())}
+
+    def search(self, index: str = None, body: dict[str, any] = None, **kwargs):
+        request = {**(body or {}), **kwargs}
+        return self._request('search', request, lambda: _Response(self._search(index, request)))
+
+    def msearch(self, searches: list[dict[str, any]] = None, body: list[dict[str, any]] = None, index: str = None):
+        searches = searches if searches is not None else body
+
+        def handle():
+            responses = []
+            for header, request in zip(searches[0::2], searches[1::2]):
+                try:
+                    responses.append({**self._search(header.get('index', index), request), 'status': 200})
+                except ApiError as e:
+                    responses.append({'error': e.body, 'status': e.status_code})
+            return _Response({'took': 0, 'responses': responses})
+
+        return self._request('msearch', searches, handle)
+
+    def index(self, index: str, document: dict[str, any] = None, id: str = None, body: dict[str, any] = None,
+              **kwargs):
+        document = document if document is not None else body
+
+        def handle():
+            with self._lock:
+                (status, result) = self._write(index, 'index', id or uuid.uuid4().hex, document, {})
+            return _Response({'_index': index, '_id': result['_id'], 'result': result['result']})
+
+        return self._request('index', document, handle)
+
+    def bulk(self, operations: list = None, body: list = None, **kwargs):
+        lines = [json.loads(line) if isinstance(line, (bytes, str)) else line
+                 for line in (operations if operations is not None else body)]
+
+        def handle():
+            items = []
+            i = 0
+            with self._lock:
+                while i < len(lines):
+                    ((operation, metadata),) = lines[i].items()
+                    document = lines[i + 1] if operation in _DOCUMENT_OPERATIONS else None
+                    i += 2 if operation in _DOCUMENT_OPERATIONS else 1
+                    (status, result) = self._write(metadata['_index'], operation,
+                                                   metadata.get('_id') or uuid.uuid4().hex, document, metadata)
+                    items.append({operation: {'_index': metadata['_index'], **result, 'status': status}})
+            return _Response({'took': 0, 'errors': any(not 200 <= next(iter(item.values()))['status'] < 300
+                                                       for item in items), 'items': items})
+
+        return self._request('bulk', lines, handle)
+
+    def mget(self, index: str, ids: list[str] = None, body: dict[str, any] = None, **kwargs):
+        ids = ids if ids is not None else body['ids']
+
+        def handle():
+            docs = []
+            with self._lock:
+                stored = self.documents.get(index, {})
+                for doc_id in ids:
+                    if doc_id in stored:
+                        (seq_no, source) = stored[doc_id]
+                        docs.append({'_index': index, '_id': doc_id, 'found': True, '_seq_no': seq_no,
+                                     '_primary_term': 1, '_source': source})
+                    else:
+                        docs.append({'_index': index, '_id': doc_id, 'found': False})
+            return _Response({'docs': docs})
+
+        return self._request('mget', {'ids': ids}, handle)
+
+    def _request(self, api: str, request, handle):
+        if self._connections is None:
+            return self._send(api, request, handle)
+        with self._connections:
+            return self._send(api, request, handle)
+
+    def _send(self, api: str, request, handle):
+        if self.latency_seconds > 0:
+            time.sleep(self.latency_seconds)
+        request_bytes = self._size(request) if self.measure_bytes else 0
+        with self._lock:
+            self.calls[api] += 1
+            self.request_bytes[api] += request_bytes
+        self._transfer(request_bytes)
+        response = handle()
+        headers = HttpHeaders()
+        if self.measure_bytes:
+            response_bytes = self._size(response.body)
+            headers['content-length'] = str(response_bytes)
+            with self._lock:
+                self.response_bytes[api] += response_bytes
+            self._transfer(response_bytes)
+        response.meta = _meta(200, headers)
+        return response
+
+    def _size(self, body) -> int:
+        """
+        :return: Bytes of the body once serialized to JSON, and gzipped if `http_compress` is set.
+        """
+        serialized = json.dumps(body, default=str).encode()
+        return len(gzip.compress(serialized)) if self.http_compress else len(serialized)
+
+    def _transfer(self, size: int):
+        if self.bandwidth_bytes_per_second > 0:
+            time.sleep(size / self.bandwidth_bytes_per_second)
+
+    def _write(self, index: str, operation: str, doc_id: str, document: dict[str, any],
+               metadata: dict[str, any]) -> (int, dict[str, any]):
+        """ Must be called holding the lock.
+        :return: Status and result of the operation, as in a bulk response item.
+        """
+        stored = self.documents.setdefault(index, {})
+        existing = stored.get(doc_id)
+        if operation == 'delete':
+            if existing is None:
+                return 404, {'_id': doc_id, 'result': 'not_found'}
+            del stored[doc_id]
+            return 200, {'_id': doc_id, 'result': 'deleted'}
+        if operation == 'create' and existing is not None:
+            return 409, {'_id': doc_id, 'error': {'type': 'version_conflict_engine_exception'}}
+        if 'if_seq_no' in metadata and (existing is None or existing[0] != metadata['if_seq_no']):
+            return 409, {'_id': doc_id, 'error': {'type': 'version_conflict_engine_exception'}}
+        if operation == 'update':
+            if existing is None and not document.get('doc_as_upsert') and 'upsert' not in document:
+                return 404, {'_id': doc_id, 'error': {'type': 'document_missing_exception'}}
+            source = {**existing[1], **document.get('doc', {})} if existing is not None \
+                else document.get('upsert', document.get('doc', {}))
+        else:
+            source = document
+        stored[doc_id] = (next(self._seq_no), source)
+        return (200 if existing is not None else 201), {'_id': doc_id,
+                                                        'result': 'updated' if existing is not None else 'created'}
+
+    def _search(self, index: str, request: dict[str, any]) -> dict[str, any]:
+        if 'runtime_mappings' in request:
+            raise _api_error(BadRequestError, 400, 'runtime fields are not supported by the fake')
+        predicate = _predicate(request.get('query', {'match_all': {}}))
+        with self._lock:
+            if index not in self.documents:
+                raise _api_error(NotFoundError, 404, f'no such index [{index}]')
+            matches = [(doc_id, source) for doc_id, (_, source) in self.documents[index].items() if predicate(source)]
+        response = {'took': 0, 'timed_out': False,
+                    'hits': {'total': {'value': len(matches), 'relation': 'eq'},
+                             'hits': _hits(index, matches, request)}}
+        if 'aggs' in request or 'aggregations' in request:
+            response['aggregations'] = _aggregations(request.get('aggs', request.get('aggregations')),
+                                                     [source for (_, source) in matches])
+        return response
+
+
+class _FakeIndices:
+    def __init__(self, client: FakeElasticsearch):
+        self.client: FakeElasticsearch = client
+
+    def exists(self, index: str, **kwargs) -> bool:
+        return self.client._request('indices.exists', {'index': index},
+                                    lambda: _Response(index in self.client.documents)).body
+
+    def create(self, index: str, **kwargs):
+        def handle():
+            with self.client._lock:
+                self.client.documents.setdefault(index, {})
+            return _Response({'acknowledged': True, 'index': index})
+
+        return self.client._request('indices.create', kwargs, handle)
+
+
+class _FakeTransport:
+    """ Only the serializers of the transport are used outside of the client, to size bulk requests. """
+
+    def __init__(self):
+        self.serializers: SerializerCollection = SerializerCollection()
+
+
+class _Response(dict):
+    """ Like the responses of the client, can be read as a dict or through `body`, and has the `meta` of the
+    response. """
+
+    def __init__(self, body):
+        super().__init__(body if isinstance(body, dict) else {})
+        self._body = body
+        self.meta: ApiResponseMeta = None
+
+    @property
+    def body(self):
+        return self._body
+
+    def __bool__(self):
+        return bool(self._body)
+
+
+def _api_error(error_class, status: int, message: str) -> ApiError:
+    return error_class(message, _meta(status, HttpHeaders()), {'type': 'fake_exception', 'reason': message})
+
+
+def _meta(status: int, headers: HttpHeaders) -> ApiResponseMeta:
+    return ApiResponseMeta(status=status, http_version='1.1', headers=headers, duration=0.0,
+                           node=NodeConfig('http', 'localhost', 9200))
+
+
+def _values(source, path: str) -> list:
+    """
+    :return: All values of a dotted field path, flattening arrays of values and objects.
+    """
+    if '.' not in path:
+        value = source.get(path)
+        return [] if value is None else [item for item in value if item is not None] if isinstance(value, list) \
+            else [value]
+    values = [source]
+    for name in path.split('.'):
+        found = []
+        for value in values:
+            for item in value if isinstance(value, list) else [value]:
+                if isinstance(item, dict) and name in item:
+                    found.append(item[name])
+        values = found
+    return [item for value in values for item in (value if isinstance(value, list) else [value]) if item is not None]
+
+
+@lru_cache(maxsize=65536)
+def _millis(value) -> float:
+    """ Dates are compared as epoch milliseconds, whether given as numbers or as ISO dates, in UTC if no offset is
+    given. """
+    if isinstance(value, (int, float)):
+        return value
+    date = datetime.fromisoformat(value)
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return (date - EPOCH) // timedelta(milliseconds=1)
+
+
+def _comparable(value, date: bool):
+    return _millis(value) if date else value
+
+
+def _is_date(values: list) -> bool:
+    if not values or not all(isinstance(value, str) for value in values):
+        return False
+    try:
+        list(map(_millis, values))
+        return True
+    except ValueError:
+        return False
+
+
+def _predicate(query: dict[str, any]):
+    """ Queries are compiled once per search rather than interpreted for every document.
+    :return: Function telling whether a document source matches the query.
+    """
+    ((kind, clause),) = query.items()
+    if kind == 'match_all':
+        return lambda source: True
+    if kind == 'bool':
+        required = list(map(_predicate, _clauses(clause.get('must')) + _clauses(clause.get('filter'))))
+        excluded = list(map(_predicate, _clauses(clause.get('must_not'))))
+        should = list(map(_predicate, _clauses(clause.get('should'))))
+        minimum_should_match = clause.get('minimum_should_match', 0 if required else 1 if should else 0)
+        return lambda source: all(predicate(source) for predicate in required) \
+            and not any(predicate(source) for predicate in excluded) \
+            and sum(1 for predicate in should if predicate(source)) >= minimum_should_match
+    if kind == 'term':
+        ((field, value),) = clause.items()
+        value = value['value'] if isinstance(value, dict) else value
+        return lambda source: value in _values(source, field)
+    if kind == 'terms':
+        ((field, values),) = clause.items()
+        values = set(values)
+        return lambda source: not values.isdisjoint(_values(source, field))
+    if kind == 'exists':
+        return lambda source: len(_values(source, clause['field'])) > 0
+    if kind == 'query_string' and clause['query'].endswith(':*'):
+        return lambda source: len(_values(source, clause['query'][:-2])) > 0
+    if kind == 'range':
+        ((field, bounds),) = clause.items()
+        return lambda source: any(_in_range(value, bounds) for value in _values(source, field))
+    raise _api_error(BadRequestError, 400, f'{kind} queries are not supported by the fake')
+
+
+def _clauses(clauses) -> list:
+    return [] if clauses is None else clauses if isinstance(clauses, list) else [clauses]
+
+
+def _in_range(value, bounds: dict[str, any]) -> bool:
+    date = isinstance(value, str)
+    value = _comparable(value, date)
+    return ('gt' not in bounds or value > _comparable(bounds['gt'], date)) \
+        and ('gte' not in bounds or value >= _comparable(bounds['gte'], date)) \
+        and ('lt' not in bounds or value < _comparable(bounds['lt'], date)) \
+        and ('lte' not in bounds or value <= _comparable(bounds['lte'], date))
+
+
+def _hits(index: str, matches: list[tuple[str, dict[str, any]]], request: dict[str, any]) -> list[dict[str, any]]:
+    size = request.get('size', 10)
+    if size == 0:
+        return []
+    if request.get('sort'):
+        sorts = [(field, isinstance(order, dict) and order.get('order') == 'desc' or order == 'desc')
+                 for sort in request['sort'] for field, order in sort.items()]
+        keyed = [([_sort_value(source, field, descending) for field, descending in sorts], doc_id, source)
+                 for doc_id, source in matches]
+        keyed = [item for item in keyed if None not in item[0]]
+        # Sorted by the last field first, as every sort is stable.
+        for i in reversed(range(len(sorts))):
+            keyed.sort(key=lambda item: item[0][i], reverse=sorts[i][1])
+        if request.get('search_after'):
+            keyed = [item for item in keyed if _is_after(item[0], request['search_after'], sorts)]
+        matches = [(doc_id, source, sort_values) for sort_values, doc_id, source in keyed]
+    else:
+        matches = [(doc_id, source, None) for doc_id, source in matches]
+    hits = []
+    for doc_id, source, sort in matches[:size]:
+        hit = {'_index': index, '_id': doc_id}
+        if request.get('_source', True) not in (False, 'false'):
+            hit['_source'] = source
+        if request.get('fields'):
+            fields = {field: _values(source, field) for field in request['fields']}
+            hit['fields'] = {field: values for field, values in fields.items() if values}
+        if sort is not None:
+            hit['sort'] = sort
+        hits.append(hit)
+    return hits
+
+
+def _is_after(sort_values: list, search_after: list, sorts: list[tuple[str, bool]]) -> bool:
+    """
+    :return: Whether a hit with these sort values comes after the hit `search_after` holds the sort values of.
+    """
+    for value, after, (_, descending) in zip(sort_values, search_after, sorts):
+        if value != after:
+            return value < after if descending else value > after
+    return False
+
+
+def _sort_value(source: dict[str, any], field: str, descending: bool):
+    values = _values(source, field)
+    if not values:
+        return None
+    values = list(map(_millis, values)) if _is_date(values) else values
+    return max(values) if descending else min(values)
+
+
+def _aggregations(aggs: dict[str, any], sources: list[dict[str, any]]) -> dict[str, any]:
+    results = {}
+    for name, agg in aggs.items():
+        if 'max' in agg or 'min' in agg:
+            results[name] = _metric(agg, sources)
+        elif 'terms' in agg:
+            counts = Counter(value for source in sources for value in set(_values(source, agg['terms']['field'])))
+            buckets = sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:agg['terms'].get('size', 10)]
+            results[name] = {'doc_count_error_upper_bound': 0,
+                             'sum_other_doc_count': sum(counts.values()) - sum(count for (_, count) in buckets),
+                             'buckets': [_bucket({'key': key, 'doc_count': count}, agg, sources, agg['terms']['field'],
+                                                 key) for key, count in buckets]}
+        elif 'composite' in agg:
+            results[name] = _composite(agg, sources)
+        else:
+            raise _api_error(BadRequestError, 400, f'{list(agg.keys())} aggregations are not supported by the fake')
+    return results
+
+
+def _metric(agg: dict[str, any], sources: list[dict[str, any]]) -> dict[str, any]:
+    (kind, field) = ('max', agg['max']['field']) if 'max' in agg else ('min', agg['min']['field'])
+    values = [value for source in sources for value in _values(source, field)]
+    if not values:
+        return {'value': None}
+    if _is_date(values):
+        millis = (max if kind == 'max' else min)(map(_millis, values))
+        date = EPOCH + timedelta(milliseconds=millis)
+        return {'value': float(millis), 'value_as_string': date.strftime('%Y-%m-%dT%H:%M:%S.') +
+                f'{date.microsecond // 1000:03d}Z'}
+    return {'value': float((max if kind == 'max' else min)(values))}
+
+
+def _bucket(bucket: dict[str, any], agg: dict[str, any], sources: list[dict[str, any]], field: str, key):
+    if 'aggs' in agg:
+        bucket.update(_aggregations(agg['aggs'], [source for source in sources if key in _values(source, field)]))
+    return bucket
+
+
+def _composite(agg: dict[str, any], sources: list[dict[str, any]]) -> dict[str, any]:
+    composite = agg['composite']
+    names = []
+    fields = []
+    for source in composite['sources']:
+        ((name, value_source),) = source.items()
+        if 'terms' not in value_source or 'field' not in value_source['terms']:
+            raise _api_error(BadRequestError, 400, 'only terms sources on fields are supported by the fake')
+        names.append(name)
+        fields.append(value_source['terms']['field'])
+    grouped: dict[tuple, list[dict[str, any]]] = {}
+    for source in sources:
+        for key in itertools.product(*[sorted(set(_values(source, field))) for field in fields]):
+            grouped.setdefault(key, []).append(source)
+    keys = sorted(grouped.keys())
+    if composite.get('after'):
+        after = tuple(composite['after'][name] for name in names)
+        keys = [key for key in keys if key > after]
+    keys = keys[:composite.get('size', 10)]
+    buckets = []
+    for key in keys:
+        bucket = {'key': dict(zip(names, key)), 'doc_count': len(grouped[key])}
+        if 'aggs' in agg:
+            bucket.update(_aggregations(agg['aggs'], grouped[key]))
+        buckets.append(bucket)
+    result = {'buckets': buckets}
+    if buckets:
+        result['after_key'] = buckets[-1]['key']
+    return result
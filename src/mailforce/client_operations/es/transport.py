@@ -0,0 +1,46 @@
+from mailforce import CONFIG
+
+SEARCH_OPERATION: str = 'search'
+BULK_OPERATION: str = 'bulk'
+""" Threads that may send requests besides the search workers and the bulk threads: the one fetching the message
+roles pages and the one writing them. """
+OTHER_REQUEST_THREADS: int = 2
+
+
+def connections_per_node() -> int:
+    """
+    :return: Number of connections kept open to every node, which is `CONFIG.es_connections_per_node` or, if that is
+    0, enough for every thread that may send requests at once, so that none of them waits for a connection.
+    """
+    if CONFIG.es_connections_per_node > 0:
+        return CONFIG.es_connections_per_node
+    return max(1, CONFIG.search_workers) + max(1, CONFIG.bulk_threads) + OTHER_REQUEST_THREADS
+
+
+def transport_options() -> dict[str, any]:
+    """ Sniffing discovers the nodes behind the given address, which the proxy of Elastic Cloud hides, so it is only
+    enabled without a cloud ID.
+    :return: Options of the connection pool, compression, timeouts and retries of the ES client.
+    """
+    options = {
+        'http_compress': CONFIG.es_http_compress,
+        'connections_per_node': connections_per_node(),
+        'request_timeout': CONFIG.es_request_timeout_seconds,
+        'max_retries': CONFIG.es_max_retries,
+        'retry_on_timeout': CONFIG.es_retry_on_timeout,
+        'retry_on_status': tuple(CONFIG.es_retry_on_status)
+    }
+    if CONFIG.es_sniff:
+        if CONFIG.elastic_cloud_id:
+            print('Not sniffing for nodes, as the cluster is reached through Elastic Cloud.')
+        else:
+            options.update({'sniff_on_start': True, 'sniff_on_node_failure': True})
+    return options
+
+
+def operation_timeouts() -> dict[str, float]:
+    """
+    :return: Seconds after which a request is abandoned, and retried if `CONFIG.es_retry_on_timeout` is set, for every
+    operation whose timeout differs from `CONFIG.es_request_timeout_seconds`.
+    """
+    return {SEARCH_OPERATION: CONFIG.es_search_timeout_seconds, BULK_OPERATION: CONFIG.es_bulk_timeout_seconds}
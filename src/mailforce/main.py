@@ -1,17 +1,42 @@
+import multiprocessing
 import os
 import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import closing, nullcontext
+from typing import Iterator
 
-from mailforce import RESOURCES_PATH
-from mailforce.client_operations.es.es_index_operations import insert_account_stats, insert_account_interactions, \
-    insert_domains_stats, insert_message_roles, insert_runtime_stats
-from mailforce.client_operations.es.es_search_operations import get_last_runtime_date, get_message_roles, \
-    get_aggregated_emails_by_account, search_accounts
-from mailforce.models.domain.domains import Domains
+from mailforce import CONFIG, RESOURCES_PATH
+from mailforce.client_operations.checkpoints import get_checkpoint_store
+from mailforce.client_operations.checkpoints.checkpoint_store import CheckpointStore, checkpoint_doc, \
+    checkpoint_from_doc
+from mailforce.client_operations.es.es_index_operations import CHECKPOINT_PARTIAL, DOMAIN_PARTIAL, \
+    delete_staged_partials, domain_doc, get_staged_partials, insert_accounts, insert_domains_docs, \
+    insert_domains_stats, insert_message_roles, insert_runtime_stats, merge_accounts, merge_domains_docs, \
+    merge_domains_stats, reset_right_now, reset_write_stats, stage_partials
+from mailforce.client_operations.es.es_search_operations import get_last_runtime_date, iter_message_roles, \
+    get_aggregated_emails_by_account, get_aggregated_emails_by_accounts, get_domain_rollups, get_latest_timestamps, \
+    discover_accounts
+from mailforce.models.checkpoint.checkpoint import ACCOUNTS_STREAM, ALL_ACCOUNTS, DOMAINS_STREAM, \
+    MESSAGE_ROLES_STREAM, Checkpoint
+from mailforce.models.continuation.continuation import Continuation
+from mailforce.models.deadline.deadline import Deadline
+from mailforce.models.domain.domains import Domains, merge_domains
+from mailforce.models.domain.engagement_columns import EngagementColumns, engagement_rows, rollup_rows
 from mailforce.models.email.account.email_account import EmailAccount
 from mailforce.models.email.account.email_accounts import EmailAccounts
 from mailforce.models.message.message_roles_container import MessageRolesContainer
+from mailforce.models.run_metrics.run_metrics import RunMetrics
 from mailforce.models.runtime_stats.runtime_stats import RuntimeStats
-from mailforce.utils.date_utils import now
+from mailforce.models.shard.shard_result import ShardResult
+from mailforce.models.write_stats.write_stats import WriteStats
+from mailforce.utils.date_utils import now, parse_timestamp
+from mailforce.utils.iter_utils import Stage, prefetch
+from mailforce.utils.merge_utils import merge_domain_docs
+from mailforce.utils.metrics_utils import phase, reset_run_metrics, write_trace
+from mailforce.utils.profile_utils import Profiler
+from mailforce.utils.shard_utils import accounts_in_shard
 
 ACCOUNTS_PATH: str = f'{RESOURCES_PATH}/accounts'
 DOMAINS_PATH: str = f'{RESOURCES_PATH}/domains'
@@ -22,18 +47,66 @@ WRITE_LOCAL_FILES: bool = False
 FROM_DATE_KEY: str = 'from_date'
 ACCOUNTS_TO_BACKFILL_KEY: str = 'backfill_accounts'
 ACCOUNTS_TO_EXCLUDE_KEY: str = 'exclude_accounts'
+FULL_REBUILD_KEY: str = 'full_rebuild'
+CONTINUATION_KEY: str = 'continuation'
+MERGE_WRITE_MODE: str = 'merge'
+BATCH_DOMAIN_ENGINE: str = 'batch'
+PROCESS_DOMAIN_ENGINE: str = 'process'
+SERVER_DOMAIN_ENGINE: str = 'server'
+""" Event key selecting how the invocation takes part in a sharded run. Without it, the invocation is a worker, which
+processes every account unless the event also holds a shard. """
+MODE_KEY: str = 'mode'
+COORDINATOR_MODE: str = 'coordinate'
+REDUCER_MODE: str = 'reduce'
+SHARD_KEY: str = 'shard'
+SHARDS_KEY: str = 'shards'
+""" Event key identifying a sharded run, under which its workers stage their partial documents. """
+RUN_ID_KEY: str = 'run_id'
+SHARD_RESULTS_KEY: str = 'shard_results'
+""" Event key selecting a profile of the run: `cpu` or `alloc`. """
+PROFILE_KEY: str = 'profile'
 
 
 def main(event, context):
     response = _get_response(event, context)
     try:
+        mode = event.get(MODE_KEY)
+        if mode == COORDINATOR_MODE:
+            response['shard_events'] = _shard_events(event, event.get(SHARDS_KEY, CONFIG.shards))
+            return response
+        if mode == REDUCER_MODE:
+            runtime_stats = _reduce(shard_results=list(map(ShardResult, event[SHARD_RESULTS_KEY])),
+                                    full_rebuild=event.get(FULL_REBUILD_KEY, False))
+            response['runtime_stats'] = str(runtime_stats)
+            return response
         from_date = event.get(FROM_DATE_KEY)
         backfill_accounts = event.get(ACCOUNTS_TO_BACKFILL_KEY)
         excluded_accounts = event.get(ACCOUNTS_TO_EXCLUDE_KEY)
-        runtime_stats = _collect(from_date=from_date,
-                                 backfill_accounts=backfill_accounts,
-                                 excluded_accounts=excluded_accounts)
+        full_rebuild = event.get(FULL_REBUILD_KEY, False)
+        continuation = Continuation(event[CONTINUATION_KEY]) if CONTINUATION_KEY in event else None
+        deadline = Deadline(context.deadline, CONFIG.deadline_margin_seconds)
+        profiler = Profiler(event[PROFILE_KEY], CONFIG.profile_top) if event.get(PROFILE_KEY) else None
+        if profiler:
+            profiler.start()
+        try:
+            runtime_stats = _collect(from_date=from_date,
+                                     backfill_accounts=backfill_accounts,
+                                     excluded_accounts=excluded_accounts,
+                                     full_rebuild=full_rebuild,
+                                     deadline=deadline,
+                                     continuation=continuation,
+                                     shard=event.get(SHARD_KEY),
+                                     shards=event.get(SHARDS_KEY),
+                                     run_id=event.get(RUN_ID_KEY),
+                                     profiler=profiler)
+        finally:
+            if profiler:
+                response['profile'] = profiler.stop().to_json()
         response['runtime_stats'] = str(runtime_stats)
+        if runtime_stats.continuation:
+            response['continuation'] = {**event, CONTINUATION_KEY: runtime_stats.continuation.to_json()}
+        if runtime_stats.shard_result:
+            response['shard_result'] = runtime_stats.shard_result.to_json()
     except Exception as e:
         response['error'] = str(e)
     finally:
@@ -60,34 +133,470 @@ def _get_response(event, context):
 
 def _collect(from_date: str = None,
              backfill_accounts: list[str] = None,
-             excluded_accounts: list[str] = None):
+             excluded_accounts: list[str] = None,
+             full_rebuild: bool = False,
+             deadline: Deadline = None,
+             continuation: Continuation = None,
+             shard: int = None,
+             shards: int = None,
+             run_id: str = None,
+             profiler: Profiler = None):
+    """ Collects the engagements and message roles of all the requested accounts and writes them to ES.
+    Accounts are processed starting with the ones that were checkpointed the longest time ago. If the deadline
+    draws near, no further accounts or message role pages are fetched, the work completed so far is written and
+    the returned statistics hold a continuation for the next invocation.
+    :param from_date: Date after which emails are collected. Defaults to the last runtime date.
+    :param backfill_accounts: If present, only these accounts are collected, from their very first email.
+    :param excluded_accounts: If present, these accounts are not collected.
+    :param full_rebuild: Whether to ignore the last runtime date and collect every email up until the present date.
+    :param deadline: Deadline of the current invocation. If this is not present, the run is not time limited.
+    :param continuation: Where a previous invocation of the same run stopped. If present, only its remaining
+    work is done.
+    :param shard: Index of the shard of accounts to be processed, starting at 0. If this is present, the domains are
+    not written and the runtime statistics are not inserted: the domains and their checkpoints are staged for the
+    reduce step, and the statistics are handed over to it in the `shard_result` of the returned statistics instead.
+    Message roles are only extracted by the first shard.
+    :param shards: Total number of shards.
+    :param run_id: ID of the sharded run, as given to its workers by the coordinator. Defaults to a new one.
+    :param profiler: If present, the profiler started for this run, which is stopped before the runtime statistics
+    are inserted so that they hold its profile.
+    :return: Statistics for this run.
+    """
     start_time = time.time()
-    last_runtime_date = None if backfill_accounts else from_date if from_date else get_last_runtime_date()
+    reset_right_now()
+    write_stats = reset_write_stats()
+    run_metrics = reset_run_metrics(trace=bool(CONFIG.trace_path))
+    deadline = deadline if deadline else Deadline()
+    sharded = shard is not None and shards is not None
+    extract_message_roles = not sharded or shard == 0
+    resume_from_checkpoints = not backfill_accounts and not full_rebuild and not from_date
+    last_runtime_date = None if backfill_accounts or full_rebuild \
+        else from_date if from_date \
+        else get_last_runtime_date()
     print(f'Using last runtime date of {last_runtime_date}')
-    accounts = backfill_accounts if backfill_accounts \
+    accounts = continuation.accounts if continuation \
+        else backfill_accounts if backfill_accounts \
         else _get_accounts_from_file() if USE_ACCOUNTS_FILE \
         else _get_accounts_from_es()
     filtered_accounts = list(filter(lambda account: account not in excluded_accounts, accounts)) if excluded_accounts \
         else accounts
-    email_accounts = _get_email_accounts(last_runtime_date, filtered_accounts)
-    domains = _get_domains(email_accounts)
-    message_roles = get_message_roles()
+    if sharded:
+        filtered_accounts = accounts_in_shard(filtered_accounts, shard, shards)
+        print(f'Processing {len(filtered_accounts)} accounts in shard {shard} of {shards}')
+    checkpoint_store = get_checkpoint_store()
+    account_checkpoints = checkpoint_store.load(filtered_accounts, ACCOUNTS_STREAM) if resume_from_checkpoints \
+        else {}
+    merge = CONFIG.write_mode == MERGE_WRITE_MODE
+    (caught_up_domains, caught_up_checkpoints, failed_catch_ups) = Domains(), [], []
+    if merge and resume_from_checkpoints:
+        (caught_up_domains, account_checkpoints, caught_up_checkpoints, failed_catch_ups) = _catch_up(
+            last_runtime_date, filtered_accounts, account_checkpoints,
+            checkpoint_store.load(filtered_accounts, DOMAINS_STREAM), checkpoint_store)
+        filtered_accounts = list(filter(lambda account: account not in failed_catch_ups, filtered_accounts))
+    message_roles_checkpoint = _get_message_roles_checkpoint(checkpoint_store, resume_from_checkpoints)
+    if continuation and continuation.message_roles_date:
+        message_roles_checkpoint.advance(continuation.message_roles_date, continuation.message_roles_search_after)
+    message_roles = iter([]) if (continuation and continuation.message_roles_done) or not extract_message_roles \
+        else iter_message_roles(last_runtime_date=message_roles_checkpoint.date or last_runtime_date,
+                                accounts=backfill_accounts,
+                                excluded_accounts=excluded_accounts,
+                                checkpoint=message_roles_checkpoint,
+                                deadline=deadline)
+    if WRITE_LOCAL_FILES:
+        message_roles = list(message_roles)
     message_roles_container = MessageRolesContainer(message_roles)
+    # Message roles are fetched and written alongside the accounts.
+    with ThreadPoolExecutor(max_workers=1) as message_roles_executor:
+        message_roles_future = message_roles_executor.submit(insert_message_roles, message_roles_container)
+        (email_accounts, domains, written_accounts) = _process_accounts(
+            last_runtime_date, _prioritize(filtered_accounts, account_checkpoints), account_checkpoints, deadline,
+            full_rebuild, checkpoint_store)
+        message_roles_written = message_roles_future.result()
+    email_accounts.failed_accounts += failed_catch_ups
+    domains.merge(caught_up_domains)
     _write_to_local(email_accounts, domains, message_roles_container)
-    runtime_stats = RuntimeStats(run_date=None if backfill_accounts else now(),
+    # Taken before the domains are written, so that emails arriving meanwhile are not skipped by the next run.
+    collected_date = now()
+    # In the `merge` write mode, the account documents were checkpointed as soon as they were merged, and the domains
+    # of every account whose emails they hold are checkpointed on their own. Otherwise, an account is checkpointed once
+    # its documents and the domains were all written.
+    domain_checkpoints = {checkpoint.account: checkpoint for checkpoint in caught_up_checkpoints}
+    domain_checkpoints.update({checkpoint.account: checkpoint
+                               for checkpoint in _account_checkpoints(email_accounts.accounts, DOMAINS_STREAM)})
+    checkpoints = list(domain_checkpoints.values()) if merge else _account_checkpoints(written_accounts)
+    # Message roles of only some accounts cannot move the checkpoint shared by all accounts.
+    shared_checkpoint = None if backfill_accounts else message_roles_checkpoint
+    domains_written = _write_to_es(domains, checkpoints, message_roles_written, checkpoint_store, shared_checkpoint,
+                                   full_rebuild, write_domains=not sharded)
+    shard_result = ShardResult({'shard': shard, 'shards': shards, 'run_id': run_id if run_id else uuid.uuid4().hex,
+                                'part': uuid.uuid4().hex}) if sharded else None
+    if shard_result:
+        domains_written = _stage_partials(shard_result, domains, checkpoints)
+    written = set(map(lambda email_account: email_account.account, written_accounts))
+    unwritten_accounts = [email_account.account for email_account in email_accounts.accounts
+                          if email_account.account not in written]
+    if email_accounts.failed_accounts:
+        print(f'Runtime date will not be recorded as these accounts failed: {email_accounts.failed_accounts}')
+    if unwritten_accounts:
+        print(f'Runtime date will not be recorded as these accounts could not be written: {unwritten_accounts}')
+    if not domains_written:
+        print('Runtime date will not be recorded as the domains could not be written.')
+    # A continued run records the run date of the invocation that started it, unless that one could not. Accounts
+    # whose documents or domains were not written are left without a checkpoint, so the last runtime date must not
+    # move past them.
+    can_record_run_date = not backfill_accounts and not email_accounts.failed_accounts and not unwritten_accounts \
+        and domains_written and (not continuation or continuation.run_date)
+    run_date = None if not can_record_run_date else continuation.run_date if continuation else collected_date
+    if not message_roles_written:
+        print('Message roles will be extracted again by the next invocation as they could not all be written.')
+    # The deadline may have cut the message roles short while they were being written. Message roles that failed to
+    # be written are resumed from where the previous invocation left them.
+    next_continuation = Continuation({
+        'accounts': email_accounts.deferred_accounts,
+        'message_roles_done': (continuation and continuation.message_roles_done) or not extract_message_roles
+                              or (message_roles_written and not deadline.expired()),
+        'message_roles_date': message_roles_checkpoint.date if message_roles_written
+                              else continuation.message_roles_date if continuation
+                              else None,
+        'message_roles_search_after': message_roles_checkpoint.search_after if message_roles_written
+                                      else continuation.message_roles_search_after if continuation
+                                      else None,
+        'run_date': run_date
+    })
+    if not next_continuation.is_complete():
+        print(f'Runtime date will not be recorded as the run is not complete, with '
+              f'{len(next_continuation.accounts)} accounts remaining.')
+    record_run_date = run_date and next_continuation.is_complete()
+    runtime_stats = RuntimeStats(run_date=run_date if record_run_date else None,
                                  email_accounts=email_accounts, domains=domains,
                                  start_time=start_time, end_time=time.time())
-    _write_to_es(email_accounts, domains, message_roles_container,runtime_stats)
+    runtime_stats.continuation = None if next_continuation.is_complete() else next_continuation
+    runtime_stats.write_stats = write_stats
+    runtime_stats.metrics = run_metrics
+    runtime_stats.profile = profiler.stop() if profiler else None
+    if shard_result:
+        shard_result.counts = runtime_stats.counts_json()
+        shard_result.write_stats = write_stats.to_json()
+        shard_result.metrics = run_metrics.to_json()
+        shard_result.run_date = run_date
+        shard_result.complete = next_continuation.is_complete()
+        shard_result.start_time = start_time
+        runtime_stats.shard_result = shard_result
+    else:
+        insert_runtime_stats(runtime_stats)
+    if CONFIG.trace_path:
+        write_trace(f'{CONFIG.trace_path}.{shard}' if sharded else CONFIG.trace_path, run_metrics,
+                    runtime_stats.counts_json())
     print('Done')
     return runtime_stats
 
 
-def _get_email_accounts(last_runtime_date: str, accounts: list[str]) -> EmailAccounts:
+def _shard_events(event: dict[str, any], shards: int) -> list[dict[str, any]]:
+    """
+    :param event: Event the coordinator was invoked with.
+    :param shards: Number of shards the accounts are split into.
+    :return: One worker event per shard, each holding the options of the given event.
+    """
+    worker_event = {key: value for key, value in event.items() if key != MODE_KEY}
+    run_id = uuid.uuid4().hex
+    return [{**worker_event, SHARD_KEY: shard, SHARDS_KEY: shards, RUN_ID_KEY: run_id} for shard in range(shards)]
+
+
+def _stage_partials(shard_result: ShardResult, domains: Domains, checkpoints: list[Checkpoint]) -> bool:
+    """ Stages the partial domain documents of a shard and the checkpoints covering them for the reduce step, and
+    records how many there are in the shard result.
+    :return: Whether all of them were staged.
+    """
+    domain_docs = list(map(domain_doc, domains.domains.values()))
+    checkpoint_docs = list(map(checkpoint_doc, checkpoints))
+    (shard_result.domains, shard_result.checkpoints) = (len(domain_docs), len(checkpoint_docs))
+    shard_result.staged = stage_partials(shard_result.staging_key(), DOMAIN_PARTIAL, domain_docs) \
+        and stage_partials(shard_result.staging_key(), CHECKPOINT_PARTIAL, checkpoint_docs)
+    if not shard_result.staged:
+        print(f'The domains of shard {shard_result.shard} could not all be staged for the reduce step.')
+    return shard_result.staged
+
+
+def _reduce(shard_results: list[ShardResult], full_rebuild: bool = False) -> RuntimeStats:
+    """ Combines the results of the workers of a sharded run. The partial domain documents the shards staged are read
+    back, merged and written, after which the checkpoints covering them are advanced, i.e. those of the accounts of
+    the shards, or their domain checkpoints in the `merge` write mode, the staged documents are deleted and one
+    runtime statistics document covering the whole run is inserted. The run date is only recorded once every shard has
+    been completed without failed accounts and all staged documents could be read, and is then the earliest one of
+    the shards.
+    :param shard_results: Results of the workers, including those of any continuations.
+    :param full_rebuild: Whether the run is a full rebuild, in which case domains written in the `merge` write mode
+    are replaced.
+    :return: Statistics for the whole run.
+    """
+    reset_right_now()
+    write_stats = reset_write_stats()
+    run_metrics = reset_run_metrics()
+    domain_docs: dict[str, dict[str, any]] = {}
+    checkpoints: list[Checkpoint] = []
+    staged_results: list[ShardResult] = []
+    for shard_result in shard_results:
+        # The checkpoints of a part whose documents were not all staged are not advanced, so that its accounts are
+        # collected again by the next run.
+        staged_domains = get_staged_partials(shard_result.staging_key(), DOMAIN_PARTIAL, shard_result.domains) \
+            if shard_result.staged else None
+        staged_checkpoints = get_staged_partials(shard_result.staging_key(), CHECKPOINT_PARTIAL,
+                                                 shard_result.checkpoints) if shard_result.staged else None
+        if staged_domains is None or staged_checkpoints is None:
+            print(f'The staged documents of shard {shard_result.shard} could not all be read.')
+            continue
+        for doc in staged_domains:
+            name = doc['domain']
+            domain_docs[name] = merge_domain_docs(domain_docs[name], doc) if name in domain_docs else doc
+        checkpoints += list(map(checkpoint_from_doc, staged_checkpoints))
+        staged_results.append(shard_result)
+    docs = list(domain_docs.values())
+    domains_written = merge_domains_docs(docs, replace=full_rebuild) if CONFIG.write_mode == MERGE_WRITE_MODE \
+        else insert_domains_docs(docs)
+    if domains_written:
+        get_checkpoint_store().save(checkpoints)
+        for shard_result in staged_results:
+            delete_staged_partials(shard_result.staging_key(), DOMAIN_PARTIAL, shard_result.domains)
+            delete_staged_partials(shard_result.staging_key(), CHECKPOINT_PARTIAL, shard_result.checkpoints)
+    shards = max(map(lambda shard_result: shard_result.shards, shard_results), default=0)
+    completed = list(filter(lambda shard_result: shard_result.complete, shard_results))
+    run_dates = list(map(lambda shard_result: shard_result.run_date, completed))
+    record_run_date = domains_written and len(staged_results) == len(shard_results) and len(run_dates) > 0 \
+        and all(run_dates) and len(set(map(lambda shard_result: shard_result.shard, completed))) == shards
+    if not record_run_date:
+        print('Runtime date will not be recorded as not every shard completed successfully.')
+    start_times = list(filter(None, map(lambda shard_result: shard_result.start_time, shard_results)))
+    runtime_stats = RuntimeStats(run_date=min(run_dates) if record_run_date else None,
+                                 email_accounts=EmailAccounts(), domains=Domains(),
+                                 start_time=min(start_times, default=time.time()), end_time=time.time())
+    for shard_result in shard_results:
+        runtime_stats.add_counts(shard_result.counts)
+        write_stats.add(WriteStats(shard_result.write_stats))
+        run_metrics.add(RunMetrics(shard_result.metrics))
+    runtime_stats.write_stats = write_stats
+    runtime_stats.metrics = run_metrics
+    runtime_stats.domains_processed = len(docs)
+    insert_runtime_stats(runtime_stats)
+    print('Done')
+    return runtime_stats
+
+
+def _prioritize(accounts: list[str], checkpoints: dict[str, Checkpoint]) -> list[str]:
+    """
+    :return: The accounts ordered so that those never checkpointed come first, followed by those checkpointed the
+    longest time ago.
+    """
+    def checkpoint_date(account: str) -> str:
+        checkpoint = checkpoints.get(account)
+        return checkpoint.date if checkpoint and checkpoint.date else ''
+
+    return sorted(accounts, key=checkpoint_date)
+
+
+def _process_accounts(last_runtime_date: str, accounts: list[str], checkpoints: dict[str, Checkpoint] = None,
+                      deadline: Deadline = None, full_rebuild: bool = False, checkpoint_store: CheckpointStore = None) \
+        -> (EmailAccounts, Domains, list[EmailAccount]):
+    """ Runs the accounts through a pipeline whose stages are connected by bounded queues: their emails are fetched
+    in the background, every batch of `CONFIG.pipeline_batch_size` accounts is then aggregated into the domains, and
+    the statistics and engagements of the batch are written to ES while the next ones are being fetched and
+    aggregated. Once written and aggregated, the emails of an account are released, unless they are still needed to
+    write local files, so only the accounts in flight are held in memory.
+    With the `batch` domain engine, the engagements are only appended to columns, which are rolled up into the
+    domains at once when all accounts are fetched. With the `process` domain engine, the engagements of every batch
+    are rolled up into partial domains by a pool of processes, which are only handed rows of plain values and return
+    the domains as compact columns, so that the parent only merges the partial domains once all accounts are fetched.
+    With the `server` domain engine, the domains are instead rolled up on the cluster, over exactly the emails each
+    account was fetched with.
+    In the `merge` write mode, the checkpoint of an account is saved to `checkpoint_store`, if present, as soon as its
+    documents were merged, as merging the same emails again would count them twice. Its domains are checkpointed
+    apart, once they are written.
+    :return: All processed accounts, including the failed and deferred ones, the domains of their emails, and the
+    accounts whose documents were written.
+    """
     email_accounts = EmailAccounts()
+    domains = Domains()
+    engagement_columns = EngagementColumns()
+    written_accounts: list[EmailAccount] = []
+    depth = CONFIG.pipeline_queue_depth
+
+    def write(batch: EmailAccounts):
+        if CONFIG.write_mode == MERGE_WRITE_MODE:
+            merged_accounts = merge_accounts(batch, replace=full_rebuild)
+            if checkpoint_store:
+                checkpoint_store.save(_account_checkpoints(merged_accounts))
+            written_accounts.extend(merged_accounts)
+        else:
+            written_accounts.extend(insert_accounts(batch))
+        if not WRITE_LOCAL_FILES:
+            for email_account in batch.accounts:
+                email_account.release_emails()
+
+    write_stage = Stage(write, depth)
+
+    if CONFIG.probe_changes:
+        with phase('probe_changes'):
+            accounts = _changed_accounts(last_runtime_date, accounts, checkpoints, email_accounts)
+    engine = CONFIG.domain_engine
+    partial_domains: list[Future] = []
+
+    def aggregate(batch: EmailAccounts):
+        with phase('build_domains'):
+            if engine == BATCH_DOMAIN_ENGINE:
+                for email_account in batch.accounts:
+                    engagement_columns.add_account(email_account)
+            elif engine == PROCESS_DOMAIN_ENGINE:
+                # Taken before the batch is written, which releases its emails.
+                partial_domains.append(domain_processes.submit(rollup_rows, engagement_rows(batch.accounts)))
+            elif engine != SERVER_DOMAIN_ENGINE:
+                for email_account in batch.accounts:
+                    domains.add_account(email_account)
+        write_stage.put(batch)
+
+    # Workers are spawned rather than forked, as the fetch and write threads are already running.
+    with ProcessPoolExecutor(max_workers=CONFIG.domain_processes or os.cpu_count(),
+                             mp_context=multiprocessing.get_context('spawn')) \
+            if engine == PROCESS_DOMAIN_ENGINE else nullcontext() as domain_processes:
+        aggregate_stage = Stage(aggregate, depth)
+        try:
+            batch = EmailAccounts()
+            with closing(prefetch(_iter_email_accounts(last_runtime_date, accounts, email_accounts, checkpoints,
+                                                       deadline), depth)) as fetched_accounts:
+                for email_account in fetched_accounts:
+                    email_accounts.add_account(email_account)
+                    batch.add_account(email_account)
+                    if len(batch.accounts) >= CONFIG.pipeline_batch_size:
+                        aggregate_stage.put(batch)
+                        batch = EmailAccounts()
+            if batch.accounts:
+                aggregate_stage.put(batch)
+        except BaseException:
+            # Nothing waiting is written once the pipeline failed, and the stages do not outlive the invocation.
+            aggregate_stage.cancel()
+            write_stage.cancel()
+            raise
+        try:
+            aggregate_stage.close()
+        except BaseException:
+            write_stage.cancel()
+            raise
+        write_stage.close()
+        if engine == PROCESS_DOMAIN_ENGINE:
+            with phase('build_domains'):
+                domains = merge_domains([partial.result() for partial in partial_domains])
+    if engine == BATCH_DOMAIN_ENGINE:
+        with phase('build_domains'):
+            domains = engagement_columns.rollup()
+    elif engine == SERVER_DOMAIN_ENGINE:
+        with phase('build_domains'):
+            domains = get_domain_rollups({email_account.account: (_start_date(email_account.account,
+                                                                              last_runtime_date, checkpoints),
+                                                                  email_account.latest_date)
+                                          for email_account in email_accounts.accounts})
+    return email_accounts, domains, written_accounts
+
+
+def _iter_email_accounts(last_runtime_date: str, accounts: list[str], email_accounts: EmailAccounts,
+                         checkpoints: dict[str, Checkpoint] = None, deadline: Deadline = None) \
+        -> Iterator[EmailAccount]:
+    """ Fetches the aggregated emails of every account using at most `CONFIG.search_workers` concurrent searches,
+    each of which fetches `CONFIG.msearch_batch_size` accounts at once.
+    Results are yielded in the order the accounts were given, and an account whose search fails is recorded as
+    failed in `email_accounts` rather than aborting the others.
+    Accounts that have a checkpoint are resumed from its date, all others from the last runtime date.
+    Once the deadline has expired no further searches are started, and the remaining accounts are deferred.
+    """
+    workers = max(1, CONFIG.search_workers)
+    batch_size = max(1, CONFIG.msearch_batch_size)
+    in_flight: deque = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for i in range(0, len(accounts), batch_size):
+            if deadline and deadline.expired():
+                print(f'Deferring {len(accounts) - i} accounts as the deadline is near.')
+                email_accounts.deferred_accounts += accounts[i:]
+                break
+            batch = accounts[i:i + batch_size]
+            in_flight.append((batch, executor.submit(_fetch_accounts, batch, last_runtime_date, checkpoints)))
+            # Keeps one search queued per worker, so that workers never wait on the accounts being consumed.
+            if len(in_flight) >= 2 * workers:
+                yield from _completed_accounts(in_flight.popleft(), email_accounts)
+        while in_flight:
+            yield from _completed_accounts(in_flight.popleft(), email_accounts)
+
+
+def _fetch_accounts(accounts: list[str], last_runtime_date: str, checkpoints: dict[str, Checkpoint] = None) \
+        -> (dict[str, EmailAccount], dict[str, Exception]):
+    """ Fetches a single account with its own searches, and several at once with msearch.
+    :return: The accounts that have emails, and the errors of those whose search failed, keyed by account.
+    """
+    with phase('fetch_accounts'):
+        if len(accounts) == 1:
+            email_account = get_aggregated_emails_by_account(account=accounts[0], last_runtime_date=_start_date(
+                accounts[0], last_runtime_date, checkpoints))
+            return {accounts[0]: email_account} if email_account else {}, {}
+        return get_aggregated_emails_by_accounts({account: _start_date(account, last_runtime_date, checkpoints)
+                                                  for account in accounts})
+
+
+def _changed_accounts(last_runtime_date: str, accounts: list[str], checkpoints: dict[str, Checkpoint],
+                      email_accounts: EmailAccounts) -> list[str]:
+    """ Probes, with a single aggregation over all the accounts, which of them have emails after the date they would
+    be resumed from, and records the others as skipped in `email_accounts`. If the probe fails, or a start date cannot
+    be compared, the accounts are processed as if they had changed.
+    :return: The accounts that changed, in the order they were given.
+    """
+    if not accounts:
+        return accounts
+
+    def start_timestamp(start_date: str) -> int:
+        try:
+            return parse_timestamp(start_date) if start_date else None
+        except ValueError:
+            return None
+
+    start_dates = {account: _start_date(account, last_runtime_date, checkpoints) for account in accounts}
+    start_timestamps = {account: start_timestamp(start_date) for account, start_date in start_dates.items()}
+    # Only emails after the earliest start date can show that any of the accounts changed.
+    earliest_start = None if None in start_timestamps.values() \
+        else start_dates[min(accounts, key=start_timestamps.get)]
+    try:
+        latest_timestamps = get_latest_timestamps(accounts, earliest_start)
+    except Exception as e:
+        print(f'Could not probe accounts for new emails, processing all of them: {str(e)}')
+        return accounts
+    changed_accounts = [account for account in accounts if account in latest_timestamps
+                        and (start_timestamps[account] is None
+                             or latest_timestamps[account] > start_timestamps[account])]
+    changed = set(changed_accounts)
+    email_accounts.skipped_accounts += [account for account in accounts if account not in changed]
+    print(f'Skipping {len(accounts) - len(changed_accounts)} accounts without new emails.')
+    return changed_accounts
+
+
+def _start_date(account: str, last_runtime_date: str, checkpoints: dict[str, Checkpoint] = None) -> str:
+    """
+    :return: Date after which the emails of the account are fetched: that of its checkpoint, if it has one.
+    """
+    checkpoint = checkpoints.get(account) if checkpoints else None
+    return checkpoint.date if checkpoint and checkpoint.date else last_runtime_date
+
+
+def _completed_accounts(search: (list[str], Future), email_accounts: EmailAccounts) -> Iterator[EmailAccount]:
+    (accounts, future) = search
+    try:
+        (found_accounts, errors) = future.result()
+    except Exception as e:
+        (found_accounts, errors) = {}, {account: e for account in accounts}
     for account in accounts:
-        email_account = get_aggregated_emails_by_account(account=account, last_runtime_date=last_runtime_date)
-        email_accounts.add_account(email_account)
-    return email_accounts
+        if account in errors:
+            print(f'Could not retrieve emails for account {account}: {str(errors[account])}')
+            email_accounts.add_failed_account(account)
+        elif account in found_accounts:
+            yield found_accounts[account]
+
+
+def _get_message_roles_checkpoint(checkpoint_store: CheckpointStore, resume: bool) -> Checkpoint:
+    checkpoints = checkpoint_store.load([ALL_ACCOUNTS], MESSAGE_ROLES_STREAM) if resume else {}
+    return checkpoints.get(ALL_ACCOUNTS, Checkpoint(ALL_ACCOUNTS, MESSAGE_ROLES_STREAM))
 
 
 def _get_accounts_from_file():
@@ -97,8 +606,8 @@ def _get_accounts_from_file():
 
 
 def _get_accounts_from_es():
-    query_result = search_accounts()
-    return list(map(lambda hit: hit['fields']['account'][0], query_result['hits']['hits']))
+    with phase('discover_accounts'):
+        return list(map(lambda summary: summary.account, discover_accounts()))
 
 
 def _write_to_local(email_accounts: EmailAccounts, domains: Domains, message_roles_container: MessageRolesContainer):
@@ -110,13 +619,85 @@ def _write_to_local(email_accounts: EmailAccounts, domains: Domains, message_rol
         _write_message_roles(message_roles_container)
 
 
-def _write_to_es(email_accounts: EmailAccounts, domains: Domains, message_roles_container: MessageRolesContainer,
-                 runtime_stats: RuntimeStats):
-    insert_account_stats(email_accounts)
-    insert_account_interactions(email_accounts)
-    insert_domains_stats(domains)
-    insert_message_roles(message_roles_container)
-    insert_runtime_stats(runtime_stats)
+def _write_to_es(domains: Domains, checkpoints: list[Checkpoint], message_roles_written: bool,
+                 checkpoint_store: CheckpointStore,
+                 message_roles_checkpoint: Checkpoint = None, full_rebuild: bool = False,
+                 write_domains: bool = True) -> bool:
+    """ Writes the domains to ES, the accounts and message roles having been written while they were processed.
+    Checkpoints are only advanced once the documents they cover have been written: the given ones once the domains
+    were, and the message roles' once all of them were. A full rebuild in the `merge` write mode replaces the running
+    documents instead of adding to them.
+    If the domains are not to be written, which is left to the reduce step of a sharded run, neither are the given
+    checkpoints.
+    :param checkpoints: Checkpoints that cover the domains: those of the accounts whose documents were written, or in
+    the `merge` write mode, the domain checkpoints of the accounts.
+    :return: Whether the domains were written, which they are taken to be if they are left to the reduce step.
+    """
+    domains_written = True
+    if write_domains:
+        merge = CONFIG.write_mode == MERGE_WRITE_MODE
+        domains_written = merge_domains_stats(domains, replace=full_rebuild) if merge else insert_domains_stats(domains)
+        if domains_written:
+            checkpoint_store.save(checkpoints)
+    if message_roles_written and message_roles_checkpoint and message_roles_checkpoint.date:
+        checkpoint_store.save([message_roles_checkpoint])
+    return domains_written
+
+
+def _account_checkpoints(email_accounts: list[EmailAccount], stream: str = ACCOUNTS_STREAM) -> list[Checkpoint]:
+    """
+    :return: Checkpoints of the stream at the latest email of every account that has any.
+    """
+    return list(map(lambda email_account: Checkpoint(email_account.account, stream, email_account.latest_date),
+                    filter(lambda email_account: email_account.latest_date, email_accounts)))
+
+
+def _catch_up(last_runtime_date: str, accounts: list[str], account_checkpoints: dict[str, Checkpoint],
+              domain_checkpoints: dict[str, Checkpoint], checkpoint_store: CheckpointStore) \
+        -> (Domains, dict[str, Checkpoint], list[Checkpoint], list[str]):
+    """ In the `merge` write mode, the documents and the domains of an account are each checkpointed once their own
+    write succeeded, so one of them lags behind the other after a failed write. The emails between the two checkpoints
+    are then fetched again and merged into the lagging ones only: right away into the documents of the account, and
+    into the returned domains, which are written along with those of the run, for its domains.
+    :return: Domains of the emails that the domains lag behind on, the checkpoints the accounts are then resumed from,
+    the domain checkpoints to be saved once the domains are written, and the accounts that could not be caught up.
+    """
+    domains = Domains()
+    resume_checkpoints = dict(account_checkpoints)
+    caught_up_checkpoints: list[Checkpoint] = []
+    failed_accounts: list[str] = []
+
+    def timestamp(date: str) -> int:
+        # Without a date, all emails are taken, which comes before any date.
+        return parse_timestamp(date) if date else -2 ** 63
+
+    for account in accounts:
+        try:
+            (documents_start, domains_start) = (_start_date(account, last_runtime_date, account_checkpoints),
+                                                _start_date(account, last_runtime_date, domain_checkpoints))
+            if timestamp(documents_start) == timestamp(domains_start):
+                continue
+            domains_lag = timestamp(domains_start) < timestamp(documents_start)
+            (after, up_to) = (domains_start, documents_start) if domains_lag else (documents_start, domains_start)
+            print(f'Catching up the {"domains" if domains_lag else "documents"} of account {account} from {after} '
+                  f'to {up_to}')
+            email_account = get_aggregated_emails_by_account(account=account, last_runtime_date=after, up_to=up_to)
+            if domains_lag:
+                if email_account:
+                    domains.add_account(email_account)
+                caught_up_checkpoints.append(Checkpoint(account, DOMAINS_STREAM, up_to))
+            else:
+                if email_account:
+                    batch = EmailAccounts()
+                    batch.add_account(email_account)
+                    if not merge_accounts(batch):
+                        raise RuntimeError('its documents could not be merged')
+                checkpoint_store.save([Checkpoint(account, ACCOUNTS_STREAM, up_to)])
+            resume_checkpoints[account] = Checkpoint(account, ACCOUNTS_STREAM, up_to)
+        except Exception as e:
+            print(f'Could not catch up account {account}: {str(e)}')
+            failed_accounts.append(account)
+    return domains, resume_checkpoints, caught_up_checkpoints, failed_accounts
 
 
 def _write_account(account: str, email_account: EmailAccount):
@@ -127,15 +708,6 @@ def _write_account(account: str, email_account: EmailAccount):
             f.writelines(list(map(lambda row: f'{row}\n', email_account.to_csv_rows())))
 
 
-def _get_domains(email_accounts: EmailAccounts):
-    domains = Domains()
-    for email_account in email_accounts.accounts:
-        all_rows = email_account.emails_cc + email_account.emails_to + email_account.emails_from
-        for email in all_rows:
-            domains.add_email(email)
-    return domains
-
-
 def _write_domains_file(domains: Domains):
     for domain in domains.domains.values():
         output_file_path = f'{DOMAINS_PATH}/{domain.domain}.csv'
@@ -0,0 +1,19 @@
+class AccountSummary:
+    """ An account found in the email index, with the number of emails it holds and, if requested, the date of its
+    latest email. """
+
+    def __init__(self, bucket_json: dict[str, any]):
+        """
+        :param bucket_json: Composite aggregation bucket keyed by the account name.
+        """
+        self.account: str = bucket_json['key']['account']
+        self.doc_count: int = bucket_json['doc_count']
+        """ Date of the most recent email of this account, as returned by ES, if it was requested. """
+        self.latest_date: str = bucket_json['latest_date'].get('value_as_string') if 'latest_date' in bucket_json \
+            else None
+
+    def to_json(self) -> dict[str, any]:
+        """
+        :return: JSON representation of this instance.
+        """
+        return {'account': self.account, 'doc_count': self.doc_count, 'latest_date': self.latest_date}
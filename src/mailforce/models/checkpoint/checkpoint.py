@@ -0,0 +1,54 @@
+from mailforce.utils.hash_utils import legacy_id
+
+""" Stream of aggregated email engagements, checkpointed per account. """
+ACCOUNTS_STREAM: str = 'account_engagements'
+""" Stream of the domain engagements of an account's emails. In the `merge` write mode, the account documents and the
+domains are merged into running totals by separate writes, so each is checkpointed on its own. """
+DOMAINS_STREAM: str = 'domain_engagements'
+""" Stream of individual message roles. It is searched across all accounts at once, so it has a single checkpoint. """
+MESSAGE_ROLES_STREAM: str = 'message_roles'
+""" Account name used for checkpoints that are not specific to a single account. """
+ALL_ACCOUNTS: str = '*'
+
+
+class Checkpoint:
+    """ Records how far a single output stream has been processed for an account. """
+
+    def __init__(self, account: str, stream: str, date: str = None, search_after: any = None):
+        """
+        :param account: Name of the account, or `ALL_ACCOUNTS` for streams spanning all accounts.
+        :param stream: Name of the output stream, e.g. `ACCOUNTS_STREAM`.
+        :param date: Date of the latest email that has been processed and written.
+        :param search_after: Sort values of the latest search hit that has been processed and written, if any, which
+        tell it apart from the hits that share its date. Checkpoints saved before the sort had a tiebreaker hold a
+        single sort value instead.
+        """
+        self.account: str = account
+        self.stream: str = stream
+        self.date: str = date
+        self.search_after: any = search_after
+
+    def id(self) -> str:
+        """
+        :return: Deterministic ID based on the account and the stream.
+        """
+        return legacy_id(self.account, self.stream)
+
+    def has_cursor(self) -> bool:
+        """
+        :return: Whether this checkpoint can be resumed from with `search_after`, right after the hit it was advanced
+        to, rather than only after its date.
+        """
+        return self.date is not None and isinstance(self.search_after, list)
+
+    def advance(self, date: str, search_after: any = None):
+        """ Moves this checkpoint forward. A date that is not later than the present one is ignored, unless it is the
+        same date and both checkpoints hold sort values, the new ones being later.
+        :param date: Date of the latest email processed.
+        :param search_after: Sort values of the latest search hit processed.
+        """
+        later_on_same_date = date == self.date and isinstance(search_after, list) \
+            and isinstance(self.search_after, list) and search_after > self.search_after
+        if date and (not self.date or date > self.date or later_on_same_date):
+            self.date = date
+            self.search_after = search_after
@@ -1,11 +1,49 @@
 import json
 import os
+from threading import RLock
+
+LOCAL_SETUP_PATH: str = '../resources/local_setup.json'
 
 
 class MailforceConfigurations:
     """ Holds Mailforce Configurations as stored as environment variables """
 
-    def __init__(self):
+    def __init__(self, lazy: bool = False):
+        """
+        :param lazy: Whether the settings are only loaded once one of them is first read, rather than right away.
+        """
+        self._lock: RLock = RLock()
+        self._loaded: bool = False
+        if not lazy:
+            self.load()
+
+    def __getattr__(self, name: str):
+        """ Only called for attributes that are not set, i.e. for every setting until the settings are loaded. """
+        if name.startswith('_') or self._loaded:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+        self.load()
+        return getattr(self, name)
+
+    def load(self):
+        """ Loads the settings, unless they already are. Settings assigned before, e.g. by tests, are kept. """
+        with self._lock:
+            if self._loaded:
+                return
+            overrides = {name: value for name, value in vars(self).items() if not name.startswith('_')}
+            self._read_settings()
+            vars(self).update(overrides)
+            self._loaded = True
+
+    def reload(self):
+        """ Reads the settings again, e.g. after the setup file or the environment changed, dropping any settings
+        assigned since they were loaded. """
+        with self._lock:
+            for name in [name for name in vars(self) if not name.startswith('_')]:
+                delattr(self, name)
+            self._loaded = False
+            self.load()
+
+    def _read_settings(self):
         """
         This facility will look for a file at '../resources/local_setup.json' first in order to get the settings.
         If it does not find that file, or if the JSON mapping is empty, then it will default to using environment
@@ -13,7 +51,7 @@ class MailforceConfigurations:
         function to work.
         """
         try:
-            with open('../resources/local_setup.json', 'r') as f:
+            with open(LOCAL_SETUP_PATH, 'r') as f:
                 content = f.read()
                 json_mapping = json.loads(content)
                 setup_configs = json_mapping if len(json_mapping) > 0 else os.environ
@@ -24,8 +62,83 @@ class MailforceConfigurations:
 
         def safe_get(key: str, default: str = None):
             value = setup_configs.get(key, default)
-            return value if len(value)> 0 else default
+            return value if value else default
 
         """ Inits using values stored as environment variables """
         self.elastic_password: str = safe_get('ELASTIC_PASSWORD')
         self.elastic_cloud_id: str = safe_get('ELASTIC_CLOUD_ID')
+        """ Which client talks to ES: `elasticsearch` for the cluster, `fake` for an empty in-memory stand-in, e.g.
+        for benchmarks. """
+        self.es_backend: str = safe_get('ES_BACKEND', 'elasticsearch')
+        """ Seconds every request to the `fake` ES backend takes on top of handling it. """
+        self.fake_es_latency_seconds: float = float(safe_get('FAKE_ES_LATENCY_SECONDS', '0'))
+        """ Bytes transferred per second by every connection to the `fake` ES backend, 0 for no limit. """
+        self.fake_es_bandwidth_bytes_per_second: int = int(safe_get('FAKE_ES_BANDWIDTH_BYTES_PER_SECOND', '0'))
+        """ Whether requests to ES and its responses are gzipped. """
+        self.es_http_compress: bool = str(safe_get('ES_HTTP_COMPRESS', 'true')).lower() == 'true'
+        """ Number of connections kept open to every ES node, enough for every thread that sends requests if 0. """
+        self.es_connections_per_node: int = int(safe_get('ES_CONNECTIONS_PER_NODE', '0'))
+        """ Seconds after which a request to ES is abandoned: searches, bulk requests and any other request. """
+        self.es_search_timeout_seconds: float = float(safe_get('ES_SEARCH_TIMEOUT_SECONDS', '60'))
+        self.es_bulk_timeout_seconds: float = float(safe_get('ES_BULK_TIMEOUT_SECONDS', '120'))
+        self.es_request_timeout_seconds: float = float(safe_get('ES_REQUEST_TIMEOUT_SECONDS', '30'))
+        """ Number of times a failed request to ES is sent again, whether it is after a timeout, and the statuses it is
+        after. A 429 is left to the backoff of the bulk writes. """
+        self.es_max_retries: int = int(safe_get('ES_MAX_RETRIES', '3'))
+        self.es_retry_on_timeout: bool = str(safe_get('ES_RETRY_ON_TIMEOUT', 'true')).lower() == 'true'
+        self.es_retry_on_status: list[int] = [int(status) for status in
+                                              str(safe_get('ES_RETRY_ON_STATUS', '502,503,504')).split(',')
+                                              if status.strip()]
+        """ Whether the nodes of the cluster are discovered on start and after a node failed, unless it is reached
+        through Elastic Cloud. """
+        self.es_sniff: bool = str(safe_get('ES_SNIFF', 'false')).lower() == 'true'
+        """ Maximum number of accounts whose aggregations are fetched from ES concurrently. """
+        self.search_workers: int = int(safe_get('SEARCH_WORKERS', '8'))
+        """ Number of accounts whose aggregations are packed into a single msearch request. With 1, every account is
+        searched on its own. """
+        self.msearch_batch_size: int = int(safe_get('MSEARCH_BATCH_SIZE', '1'))
+        """ Where checkpoints are kept between runs: `es` for an Elasticsearch index or `json` for a local file. """
+        self.checkpoint_backend: str = safe_get('CHECKPOINT_BACKEND', 'es')
+        """ Path of the checkpoints file when the `json` checkpoint backend is used. """
+        self.checkpoint_path: str = safe_get('CHECKPOINT_PATH', '../resources/checkpoints.json')
+        """ How account and domain documents are written: `index` replaces them with a new document per run, `merge`
+        adds this run's engagements to a single running document per account and domain. """
+        self.write_mode: str = safe_get('WRITE_MODE', 'index')
+        """ Seconds kept in reserve before the function deadline to write completed work to ES. """
+        self.deadline_margin_seconds: float = float(safe_get('DEADLINE_MARGIN_SECONDS', '60'))
+        """ Number of shards the accounts are split into by the coordinator when the event does not specify it. """
+        self.shards: int = int(safe_get('SHARDS', '1'))
+        """ Whether subdomains of allow-listed domains are allow-listed as well. """
+        self.match_subdomains: bool = str(safe_get('MATCH_SUBDOMAINS', 'false')).lower() == 'true'
+        """ Version of the scheme document IDs are generated with: `v1` (MD5, used by all existing documents), `v2`
+        (BLAKE2b) or `v3` (xxHash, if the `xxhash` package is installed). """
+        self.id_scheme: str = safe_get('ID_SCHEME', 'v1')
+        """ Maximum number of documents and bytes in a single bulk request. """
+        self.bulk_chunk_docs: int = int(safe_get('BULK_CHUNK_DOCS', '500'))
+        self.bulk_chunk_bytes: int = int(safe_get('BULK_CHUNK_BYTES', str(10 * 1024 * 1024)))
+        """ Number of threads sending bulk requests, and number of chunks that may wait for one of them. """
+        self.bulk_threads: int = int(safe_get('BULK_THREADS', '4'))
+        self.bulk_queue_depth: int = int(safe_get('BULK_QUEUE_DEPTH', '4'))
+        """ Number of times documents rejected by a busy cluster are sent again, and the delays in between. """
+        self.bulk_max_retries: int = int(safe_get('BULK_MAX_RETRIES', '5'))
+        self.bulk_initial_backoff_seconds: float = float(safe_get('BULK_INITIAL_BACKOFF_SECONDS', '1'))
+        self.bulk_max_backoff_seconds: float = float(safe_get('BULK_MAX_BACKOFF_SECONDS', '60'))
+        """ Number of accounts written to ES at once, and number of batches that may wait between pipeline stages. """
+        self.pipeline_batch_size: int = int(safe_get('PIPELINE_BATCH_SIZE', '50'))
+        self.pipeline_queue_depth: int = int(safe_get('PIPELINE_QUEUE_DEPTH', '2'))
+        """ How domain statistics are computed: `client` aggregates the engagements of the fetched accounts one at a
+        time, `batch` rolls them up at once from columns, `process` rolls up the columns of every batch of accounts in
+        a pool of processes, `server` rolls them up on the cluster with composite aggregations. """
+        self.domain_engine: str = safe_get('DOMAIN_ENGINE', 'client')
+        """ Number of processes of the `process` domain engine, all available cores if 0. """
+        self.domain_processes: int = int(safe_get('DOMAIN_PROCESSES', '0'))
+        """ Seconds for which the accounts discovered in ES are reused by later invocations of the same process. """
+        self.accounts_cache_ttl_seconds: float = float(safe_get('ACCOUNTS_CACHE_TTL_SECONDS', '300'))
+        """ Whether accounts are probed for new emails with a single aggregation first, so that only those that changed
+        are aggregated. """
+        self.probe_changes: bool = str(safe_get('PROBE_CHANGES', 'true')).lower() == 'true'
+        """ If present, every phase and ES request of a run is traced, and the trace is written to this path in the
+        OpenTelemetry JSON encoding, suffixed with the shard if the run is sharded. """
+        self.trace_path: str = safe_get('TRACE_PATH')
+        """ Number of functions or allocation sites reported by a profiled run. """
+        self.profile_top: int = int(safe_get('PROFILE_TOP', '20'))
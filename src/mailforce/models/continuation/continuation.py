@@ -0,0 +1,33 @@
+class Continuation:
+    """ Records where an invocation that ran out of time stopped, so that the next invocation resumes from there. """
+
+    def __init__(self, continuation_json: dict[str, any] = None):
+        """
+        :param continuation_json: JSON dict as returned by `to_json`. If this is not present, nothing is left over.
+        """
+        continuation_json = continuation_json if continuation_json else {}
+        self.accounts: list[str] = continuation_json.get('accounts', [])
+        self.message_roles_done: bool = continuation_json.get('message_roles_done', True)
+        self.message_roles_date: str = continuation_json.get('message_roles_date')
+        """ Sort values of the last message role extracted, which tell it apart from those sharing its date. """
+        self.message_roles_search_after: list = continuation_json.get('message_roles_search_after')
+        """ Run date of the invocation that started the run, recorded once the last continuation completes. """
+        self.run_date: str = continuation_json.get('run_date')
+
+    def is_complete(self) -> bool:
+        """
+        :return: Whether there is no work left over.
+        """
+        return len(self.accounts) == 0 and self.message_roles_done
+
+    def to_json(self) -> dict[str, any]:
+        """
+        :return: JSON representation of this instance.
+        """
+        return {
+            'accounts': self.accounts,
+            'message_roles_done': self.message_roles_done,
+            'message_roles_date': self.message_roles_date,
+            'message_roles_search_after': self.message_roles_search_after,
+            'run_date': self.run_date
+        }
@@ -0,0 +1,28 @@
+import time
+
+
+class Deadline:
+    """ Keeps track of the time left before the function running this process is terminated. """
+
+    def __init__(self, deadline_millis: float = None, margin_seconds: float = 0):
+        """
+        :param deadline_millis: Epoch time in milliseconds at which the function is terminated, as given by its
+        context. If this is not present, the deadline never expires.
+        :param margin_seconds: Time that is kept in reserve before the deadline, e.g. to write completed work to ES.
+        """
+        self.deadline_millis: float = deadline_millis
+        self.margin_seconds: float = margin_seconds
+
+    def remaining(self) -> float:
+        """
+        :return: Seconds left before the deadline, or infinity if there is none.
+        """
+        if not self.deadline_millis:
+            return float('inf')
+        return self.deadline_millis / 1000 - time.time()
+
+    def expired(self) -> bool:
+        """
+        :return: Whether the time left is within the reserved margin, meaning no new work should be started.
+        """
+        return self.remaining() <= self.margin_seconds
@@ -1,7 +1,7 @@
 from mailforce.models.email.engagement.email_engagement import EmailEngagement
 from mailforce.models.email.mapping.email_mapping import EmailMapping
-from mailforce.utils.date_utils import get_earliest_date, get_latest_date
-from mailforce.utils.hash_utils import deterministic_id
+from mailforce.utils.date_utils import format_timestamp, max_timestamp, min_timestamp
+from mailforce.utils.hash_utils import deterministic_id, legacy_id
 
 DOMAIN_CSV_HEADER: str = ('email_address,cc Email Count,from Email Count,to Email Count,First Contact Date,'
                           'Last Contact Date,Total Emails')
@@ -21,8 +21,24 @@ class Domain:
         self.total_from: int = 0
         self.total_to: int = 0
         self.total_emails: int = 0
-        self.first_contact_date: str = None
-        self.latest_contact_date: str = None
+        """ Epoch milliseconds of the first and latest contact. """
+        self.first_contact_timestamp: int = None
+        self.latest_contact_timestamp: int = None
+        self._id: str = None
+
+    @property
+    def first_contact_date(self) -> str:
+        """
+        :return: First contact date in `YYYY-mm-dd HH:MM` format.
+        """
+        return format_timestamp(self.first_contact_timestamp)
+
+    @property
+    def latest_contact_date(self) -> str:
+        """
+        :return: Latest contact date in `YYYY-mm-dd HH:MM` format.
+        """
+        return format_timestamp(self.latest_contact_timestamp)
 
     def id(self) -> str:
         """
@@ -32,10 +48,19 @@ class Domain:
          - the last contact date
          - the total number of emails associated with this domain
          - a concatenation of all the email addresses associated with this domain
+        It is computed once and cached until another email is added.
         """
-        email_mappings: str = '+'.join(sorted(self.email_mappings.keys()))
-        return deterministic_id(self.domain, self.first_contact_date, self.latest_contact_date, self.total_emails,
-                                 email_mappings)
+        if self._id is None:
+            self._id = domain_id(self.domain, self.first_contact_date, self.latest_contact_date, self.total_emails,
+                                 list(self.email_mappings.keys()))
+        return self._id
+
+    def stable_id(self) -> str:
+        """
+        :return: Deterministic ID based only on the domain name, so that it stays the same across runs. Used when
+        the engagements of each run are merged into a single document per domain.
+        """
+        return domain_stable_id(self.domain)
 
     def add_email(self, email: EmailEngagement):
         """ Adds an Email to this domain and updates the following:
@@ -48,15 +73,39 @@ class Domain:
         :param email: Email to be added.
         """
         if self.domain == email.domain:
+            self._id = None
             self._adjust_counts(email)
             self._add_email_mapping(email)
             self._adjust_dates(email)
         else:
             print(f'Domain mismatch between present:added {self.domain}:{email.domain}')
 
+    def merge(self, other):
+        """ Adds the emails of another instance of the same domain to this one. Merging is associative, so domains
+        built from any partition of the emails merge into the same domain. Email mappings that only the other domain
+        holds are taken over rather than copied, so it is not to be used afterwards.
+        :param other: Domain to be merged into this one.
+        """
+        if self.domain == other.domain:
+            self._id = None
+            self.total_cc += other.total_cc
+            self.total_to += other.total_to
+            self.total_from += other.total_from
+            self.total_emails += other.total_emails
+            self.first_contact_timestamp = min_timestamp(self.first_contact_timestamp, other.first_contact_timestamp)
+            self.latest_contact_timestamp = max_timestamp(self.latest_contact_timestamp,
+                                                          other.latest_contact_timestamp)
+            for email_address, email_mapping in other.email_mappings.items():
+                if email_address not in self.email_mappings:
+                    self.email_mappings[email_address] = email_mapping
+                else:
+                    self.email_mappings[email_address].merge(email_mapping)
+        else:
+            print(f'Domain mismatch between present:merged {self.domain}:{other.domain}')
+
     def _adjust_dates(self, email: EmailEngagement):
-        self.first_contact_date = get_earliest_date(self.first_contact_date, email.earliest_engagement_date)
-        self.latest_contact_date = get_latest_date(self.latest_contact_date, email.latest_engagement_date)
+        self.first_contact_timestamp = min_timestamp(self.first_contact_timestamp, email.earliest_timestamp)
+        self.latest_contact_timestamp = max_timestamp(self.latest_contact_timestamp, email.latest_timestamp)
 
     def _add_email_mapping(self, email: EmailEngagement):
         email_address: str = email.email_address
@@ -82,3 +131,19 @@ class Domain:
         rows: map = map(lambda email_mapping: email_mapping.to_csv_row(), self.email_mappings.values())
         return list(map(lambda row: f'{row}\n', [DOMAIN_CSV_HEADER, first_row] + list(rows)))
 
+
+def domain_id(domain: str, first_contact_date: str, latest_contact_date: str, total_emails: int,
+              email_addresses: list[str]) -> str:
+    """
+    :return: Deterministic ID of a domain document, as described in `Domain.id`. This is also used for domain documents
+    that were merged without going through a `Domain`, e.g. when combining the shards of a run.
+    """
+    return deterministic_id(domain, first_contact_date, latest_contact_date, total_emails,
+                            '+'.join(sorted(email_addresses)))
+
+
+def domain_stable_id(domain: str) -> str:
+    """
+    :return: Deterministic ID of a domain document based only on the domain name, as described in `Domain.stable_id`.
+    """
+    return legacy_id(domain)
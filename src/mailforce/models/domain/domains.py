@@ -1,5 +1,16 @@
+import gc
+from array import array
+
 from mailforce.models.domain.domain import Domain
+from mailforce.models.email.account.email_account import EmailAccount
 from mailforce.models.email.engagement.email_engagement import EmailEngagement
+from mailforce.models.email.mapping.email_mapping import EmailMapping
+
+""" Stands in for a missing timestamp in the columns that domains are pickled into. """
+NO_TIMESTAMP: int = -2 ** 63
+""" Number of columns pickled per domain and per email mapping. """
+_DOMAIN_COLUMNS: int = 6
+_MAPPING_COLUMNS: int = 7
 
 
 class Domains:
@@ -17,3 +28,106 @@ class Domains:
         if domain not in self.domains:
             self.domains[domain] = Domain(domain)
         self.domains[domain].add_email(email)
+
+    def merge(self, other):
+        """ Adds the domains of another instance to this one, e.g. those built from another partition of the accounts.
+        Domains that only the other instance holds are taken over rather than copied, so it is not to be used
+        afterwards.
+        :param other: Domains to be merged into this instance.
+        """
+        for name, domain in other.domains.items():
+            if name not in self.domains:
+                self.domains[name] = domain
+            else:
+                self.domains[name].merge(domain)
+
+    def __reduce__(self):
+        """ Partial domains are sent between processes in this form, which pickles into a few typed arrays and the
+        names of the domains and email addresses, rather than into an object per domain and email mapping. """
+        names: list[str] = []
+        domain_columns: array = array('q')
+        addresses: list[str] = []
+        mapping_columns: array = array('q')
+        for code, domain in enumerate(self.domains.values()):
+            names.append(domain.domain)
+            domain_columns.extend((domain.total_cc, domain.total_to, domain.total_from, domain.total_emails,
+                                   _column(domain.first_contact_timestamp), _column(domain.latest_contact_timestamp)))
+            for email_mapping in domain.email_mappings.values():
+                addresses.append(email_mapping.email_address)
+                mapping_columns.extend((code, email_mapping.cc_count, email_mapping.to_count, email_mapping.from_count,
+                                        email_mapping.total, _column(email_mapping.first_contact_timestamp),
+                                        _column(email_mapping.latest_contact_timestamp)))
+        return _domains_from_columns, (names, domain_columns, addresses, mapping_columns)
+
+    def add_account(self, email_account: EmailAccount):
+        """ Adds all the emails of an account to this Domains instance.
+        :param email_account: Account whose emails are to be added.
+        """
+        for email in email_account.emails_cc + email_account.emails_to + email_account.emails_from:
+            self.add_email(email)
+
+
+def _column(timestamp: int) -> int:
+    return NO_TIMESTAMP if timestamp is None else timestamp
+
+
+def _timestamp(column: int) -> int:
+    return None if column == NO_TIMESTAMP else column
+
+
+def _domains_from_columns(names: list[str], domain_columns: array, addresses: list[str],
+                          mapping_columns: array) -> Domains:
+    """
+    :return: Domains unpickled from the columns built by `Domains.__reduce__`.
+    """
+    domains = Domains()
+    domains_by_code: list[Domain] = []
+    # Only acyclic objects are allocated, as when domains are rolled up from columns.
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        for name, (total_cc, total_to, total_from, total_emails, first_contact, latest_contact) in \
+                zip(names, zip(*[iter(domain_columns)] * _DOMAIN_COLUMNS)):
+            domain = domains.domains[name] = Domain(name)
+            domain.total_cc = total_cc
+            domain.total_to = total_to
+            domain.total_from = total_from
+            domain.total_emails = total_emails
+            domain.first_contact_timestamp = _timestamp(first_contact)
+            domain.latest_contact_timestamp = _timestamp(latest_contact)
+            domains_by_code.append(domain)
+        for email_address, (code, cc_count, to_count, from_count, total, first_contact, latest_contact) in \
+                zip(addresses, zip(*[iter(mapping_columns)] * _MAPPING_COLUMNS)):
+            email_mapping = EmailMapping()
+            email_mapping.email_address = email_address
+            email_mapping.cc_count = cc_count
+            email_mapping.to_count = to_count
+            email_mapping.from_count = from_count
+            email_mapping.total = total
+            email_mapping.first_contact_timestamp = _timestamp(first_contact)
+            email_mapping.latest_contact_timestamp = _timestamp(latest_contact)
+            domains_by_code[code].email_mappings[email_address] = email_mapping
+    finally:
+        if collecting:
+            gc.enable()
+    return domains
+
+
+def merge_domains(partial_domains: list[Domains]) -> Domains:
+    """ Merges partial results pairwise, level by level, as a tree rather than folding them into the first one after
+    the other, so that the merges of every level are independent of each other.
+    :param partial_domains: Domains built from disjoint parts of the emails of a run.
+    :return: Domains of all the emails.
+    """
+    partial_domains = list(partial_domains)
+    if not partial_domains:
+        return Domains()
+    while len(partial_domains) > 1:
+        merged = []
+        for i in range(0, len(partial_domains) - 1, 2):
+            partial_domains[i].merge(partial_domains[i + 1])
+            merged.append(partial_domains[i])
+        if len(partial_domains) % 2:
+            merged.append(partial_domains[-1])
+        partial_domains = merged
+    return partial_domains[0]
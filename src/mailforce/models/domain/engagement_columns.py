@@ -0,0 +1,202 @@
+import gc
+from array import array
+from operator import attrgetter
+
+from mailforce.models.domain.domain import Domain
+from mailforce.models.domain.domains import Domains
+from mailforce.models.email.account.email_account import EmailAccount
+from mailforce.models.email.engagement.email_engagement import EmailEngagement
+from mailforce.models.email.mapping.email_mapping import EmailMapping
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+""" Column index of the count of each relationship. Any relationship other than `cc` and `to` is counted as `from`, as
+by `Domain` and `EmailMapping`. """
+ROLE_CODES: dict[str, int] = {'cc': 0, 'to': 1, 'from': 2}
+FROM_CODE: int = ROLE_CODES['from']
+""" Stand in for missing timestamps, so that they never win a minimum or a maximum. """
+NO_MIN_TIMESTAMP: int = 2 ** 63 - 1
+NO_MAX_TIMESTAMP: int = -2 ** 63
+""" Fields of an engagement that its domain is rolled up from, in the order `EngagementColumns.add_rows` takes them. """
+ENGAGEMENT_ROW: attrgetter = attrgetter('email_address', 'domain', 'relationship', 'count', 'earliest_timestamp',
+                                        'latest_timestamp')
+
+
+class EngagementColumns:
+    """ Holds the engagements of a run as columns rather than objects: one code per email address and per domain, in
+    the order they were first seen, and typed arrays for the role, count and timestamps of every engagement. Once all
+    engagements are added, `rollup` computes the domains in a single pass over the columns, with NumPy when it is
+    installed, instead of updating a `Domain` and an `EmailMapping` one engagement at a time. """
+
+    def __init__(self):
+        """ Codes of the email addresses and domains, and the domain code of every email address. """
+        self.address_codes: dict[str, int] = {}
+        self.domain_codes: dict[str, int] = {}
+        self.address_domains: array = array('q')
+        """ One entry per engagement. """
+        self.addresses: array = array('q')
+        self.roles: array = array('b')
+        self.counts: array = array('q')
+        self.min_timestamps: array = array('q')
+        self.max_timestamps: array = array('q')
+
+    def __len__(self) -> int:
+        return len(self.addresses)
+
+    def add_email(self, email: EmailEngagement):
+        """
+        :param email: Email to be added.
+        """
+        address = self.address_codes.get(email.email_address)
+        if address is None:
+            address = self.address_codes[email.email_address] = len(self.address_codes)
+            domain = self.domain_codes.get(email.domain)
+            if domain is None:
+                domain = self.domain_codes[email.domain] = len(self.domain_codes)
+            self.address_domains.append(domain)
+        self.addresses.append(address)
+        self.roles.append(ROLE_CODES.get(email.relationship, FROM_CODE))
+        self.counts.append(email.count)
+        self.min_timestamps.append(NO_MIN_TIMESTAMP if email.earliest_timestamp is None else email.earliest_timestamp)
+        self.max_timestamps.append(NO_MAX_TIMESTAMP if email.latest_timestamp is None else email.latest_timestamp)
+
+    def add_rows(self, rows: list[tuple]):
+        """ Adds engagements given as their `ENGAGEMENT_ROW`, e.g. as sent to another process, the same as `add_email`.
+        :param rows: Fields of every engagement to be added.
+        """
+        for (email_address, domain, relationship, count, earliest_timestamp, latest_timestamp) in rows:
+            address = self.address_codes.get(email_address)
+            if address is None:
+                address = self.address_codes[email_address] = len(self.address_codes)
+                domain_code = self.domain_codes.get(domain)
+                if domain_code is None:
+                    domain_code = self.domain_codes[domain] = len(self.domain_codes)
+                self.address_domains.append(domain_code)
+            self.addresses.append(address)
+            self.roles.append(ROLE_CODES.get(relationship, FROM_CODE))
+            self.counts.append(count)
+            self.min_timestamps.append(NO_MIN_TIMESTAMP if earliest_timestamp is None else earliest_timestamp)
+            self.max_timestamps.append(NO_MAX_TIMESTAMP if latest_timestamp is None else latest_timestamp)
+
+    def add_account(self, email_account: EmailAccount):
+        """ Adds all the emails of an account, in the same order as `Domains.add_account`.
+        :param email_account: Account whose emails are to be added.
+        """
+        for email in email_account.emails_cc + email_account.emails_to + email_account.emails_from:
+            self.add_email(email)
+
+    def rollup(self) -> Domains:
+        """
+        :return: Domains of all the added emails, the same as if each had been added to `Domains`.
+        """
+        reduce = _reduce_numpy if np is not None else _reduce_python
+        address_totals = reduce(self, self.addresses, len(self.address_codes))
+        if np is not None:
+            domains = np.frombuffer(self.address_domains, dtype=np.int64)[np.frombuffer(self.addresses, dtype=np.int64)]
+        else:
+            domains = map(self.address_domains.__getitem__, self.addresses)
+        domain_totals = reduce(self, domains, len(self.domain_codes))
+        # Only acyclic objects are allocated from here on, so collecting cycles would be wasted work, which with the
+        # engagements of a whole run still alive takes longer than building the domains.
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            return _materialize(self, address_totals, domain_totals)
+        finally:
+            if collecting:
+                gc.enable()
+
+
+def engagement_rows(email_accounts: list[EmailAccount]) -> list[tuple]:
+    """ Takes the fields of every engagement without a Python call per engagement, so that handing the engagements of
+    a batch of accounts over to another process costs little more than pickling them.
+    :return: The `ENGAGEMENT_ROW` of every email of the accounts, in the same order as `EngagementColumns.add_account`.
+    """
+    rows: list[tuple] = []
+    for email_account in email_accounts:
+        for emails in (email_account.emails_cc, email_account.emails_to, email_account.emails_from):
+            rows.extend(map(ENGAGEMENT_ROW, emails))
+    return rows
+
+
+def rollup_rows(rows: list[tuple]) -> Domains:
+    """ Rolls up a partition of the engagements of a run, e.g. in a worker process, which returns the domains in the
+    compact form they are pickled into.
+    :param rows: `ENGAGEMENT_ROW` of every engagement, as returned by `engagement_rows`.
+    :return: Domains of these engagements.
+    """
+    columns = EngagementColumns()
+    columns.add_rows(rows)
+    return columns.rollup()
+
+
+def _reduce_numpy(columns: EngagementColumns, keys, size: int) -> (list, list, list, list, list):
+    """ Keys are dense codes, so the engagements are reduced straight into one slot per key, without sorting them.
+    :param keys: Code of the address or domain of every engagement.
+    :param size: Number of codes.
+    :return: For every code, the `cc`, `to` and `from` counts, and the earliest and latest timestamps, as flat lists
+    of integers, which unlike nested lists are not tracked by the garbage collector.
+    """
+    keys = np.frombuffer(keys, dtype=np.int64) if isinstance(keys, array) else keys
+    role_counts = np.zeros(size * len(ROLE_CODES), dtype=np.int64)
+    np.add.at(role_counts, keys * len(ROLE_CODES) + np.frombuffer(columns.roles, dtype=np.int8),
+              np.frombuffer(columns.counts, dtype=np.int64))
+    min_timestamps = np.full(size, NO_MIN_TIMESTAMP, dtype=np.int64)
+    np.minimum.at(min_timestamps, keys, np.frombuffer(columns.min_timestamps, dtype=np.int64))
+    max_timestamps = np.full(size, NO_MAX_TIMESTAMP, dtype=np.int64)
+    np.maximum.at(max_timestamps, keys, np.frombuffer(columns.max_timestamps, dtype=np.int64))
+    role_counts = role_counts.reshape(size, len(ROLE_CODES))
+    return (role_counts[:, ROLE_CODES['cc']].tolist(), role_counts[:, ROLE_CODES['to']].tolist(),
+            role_counts[:, ROLE_CODES['from']].tolist(), min_timestamps.tolist(), max_timestamps.tolist())
+
+
+def _reduce_python(columns: EngagementColumns, keys, size: int) -> (list, list, list, list, list):
+    """ Same as `_reduce_numpy`, in a single pass over the columns. """
+    role_counts = [[0] * size for _ in ROLE_CODES]
+    min_timestamps = [NO_MIN_TIMESTAMP] * size
+    max_timestamps = [NO_MAX_TIMESTAMP] * size
+    for key, role, count, min_timestamp, max_timestamp in zip(keys, columns.roles, columns.counts,
+                                                               columns.min_timestamps, columns.max_timestamps):
+        role_counts[role][key] += count
+        if min_timestamp < min_timestamps[key]:
+            min_timestamps[key] = min_timestamp
+        if max_timestamp > max_timestamps[key]:
+            max_timestamps[key] = max_timestamp
+    return (role_counts[ROLE_CODES['cc']], role_counts[ROLE_CODES['to']], role_counts[ROLE_CODES['from']],
+            min_timestamps, max_timestamps)
+
+
+def _materialize(columns: EngagementColumns, address_totals: tuple, domain_totals: tuple) -> Domains:
+    """ Builds the domains and their email mappings from their totals, in the order in which they were first seen, so
+    that the documents are the same as those built one email at a time. """
+    domains = Domains()
+    domains_by_code: list[Domain] = []
+    (cc_counts, to_counts, from_counts, min_timestamps, max_timestamps) = domain_totals
+    for code, name in enumerate(columns.domain_codes.keys()):
+        domain = domains.domains[name] = Domain(name)
+        domain.total_cc = cc_counts[code]
+        domain.total_to = to_counts[code]
+        domain.total_from = from_counts[code]
+        domain.total_emails = domain.total_cc + domain.total_to + domain.total_from
+        domain.first_contact_timestamp = _timestamp(min_timestamps[code], NO_MIN_TIMESTAMP)
+        domain.latest_contact_timestamp = _timestamp(max_timestamps[code], NO_MAX_TIMESTAMP)
+        domains_by_code.append(domain)
+    (cc_counts, to_counts, from_counts, min_timestamps, max_timestamps) = address_totals
+    for code, email_address in enumerate(columns.address_codes.keys()):
+        email_mapping = EmailMapping()
+        email_mapping.email_address = email_address
+        email_mapping.cc_count = cc_counts[code]
+        email_mapping.to_count = to_counts[code]
+        email_mapping.from_count = from_counts[code]
+        email_mapping.total = email_mapping.cc_count + email_mapping.to_count + email_mapping.from_count
+        email_mapping.first_contact_timestamp = _timestamp(min_timestamps[code], NO_MIN_TIMESTAMP)
+        email_mapping.latest_contact_timestamp = _timestamp(max_timestamps[code], NO_MAX_TIMESTAMP)
+        domains_by_code[columns.address_domains[code]].email_mappings[email_address] = email_mapping
+    return domains
+
+
+def _timestamp(timestamp: int, missing: int) -> int:
+    return None if timestamp == missing else timestamp
@@ -1,41 +1,39 @@
 from mailforce.models import EMAIL_CSV_HEADER
 from mailforce.models.email.engagement.email_engagement import EmailEngagement
 from mailforce.utils.domain_utils import is_valid_domain
-from mailforce.utils.hash_utils import deterministic_id
+from mailforce.utils.hash_utils import deterministic_id, legacy_id
 
 
 class EmailAccount:
     """ This class holds all the emails for an individual account. """
 
-    def __init__(self, results_json: dict[str, any], account: str):
+    def __init__(self, results_json: dict[str, any] = None, account: str = None):
         """
-        :param results_json: JSON dict holding email data.
+        :param results_json: JSON dict holding email data. If this is not present, the account starts without emails
+        and they can be added with `add_buckets`.
         :param account: account name.
         """
-
-        def _process_emails(email_list: list, relationship: str) -> list[EmailEngagement]:
-            unfiltered: list = list(map(lambda email: EmailEngagement(email_json=email, relationship=relationship,
-                                                                      account=account), email_list))
-            return list(filter(lambda email: is_valid_domain(email.domain), unfiltered))
-
-        aggregations: dict[str, any] = results_json['aggregations']
-        cc_emails: list[dict[str, any]] = aggregations['group_by_cc']['buckets']
-        to_emails: list[dict[str, any]] = aggregations['group_by_to']['buckets']
-        from_emails: list[dict[str, any]] = aggregations['group_by_from']['buckets']
         self.account: str = account
-        self.emails_cc: list[EmailEngagement] = _process_emails(cc_emails, 'cc')
-        self.emails_to: list[EmailEngagement] = _process_emails(to_emails, 'to')
-        self.emails_from: list[EmailEngagement] = _process_emails(from_emails, 'from')
-        self.emails_to_count: int = len(self.emails_to)
-        self.emails_from_count: int = len(self.emails_from)
-        self.emails_cc_count: int = len(self.emails_cc)
-        self.total_email_count: len = self.emails_to_count + self.emails_cc_count + self.emails_from_count
+        """ Date of the most recent email found for this account, as returned by ES. """
+        self.latest_date: str = None
+        self.emails_cc: list[EmailEngagement] = []
+        self.emails_to: list[EmailEngagement] = []
+        self.emails_from: list[EmailEngagement] = []
+        self._id: str = None
+        self._update_counts()
+        if results_json:
+            aggregations: dict[str, any] = results_json['aggregations']
+            self.add_buckets(aggregations['group_by_cc']['buckets'], 'cc')
+            self.add_buckets(aggregations['group_by_to']['buckets'], 'to')
+            self.add_buckets(aggregations['group_by_from']['buckets'], 'from')
 
     def id(self):
         """
         :return: Deterministic ID based on the IDs of all the underlying Email Engagements and the
-        account name
+        account name. It is computed once and cached until emails are added.
         """
+        if self._id is not None:
+            return self._id
 
         def emails_set_str(emails: list[EmailEngagement]) -> str:
             return ''.join(list(sorted(set(map(lambda engagement: engagement.id, emails)))))
@@ -43,7 +41,15 @@ class EmailAccount:
         all_emails: str = (f'{emails_set_str(self.emails_to)}'
                            f'{emails_set_str(self.emails_from)}'
                            f'{emails_set_str(self.emails_cc)}')
-        return deterministic_id(self.account, all_emails)
+        self._id = deterministic_id(self.account, all_emails)
+        return self._id
+
+    def stable_id(self) -> str:
+        """
+        :return: Deterministic ID based only on the account name, so that it stays the same across runs. Used when
+        the engagements of each run are merged into a single document per account.
+        """
+        return legacy_id(self.account)
 
     def to_csv_rows(self, include_account: bool = None) -> list[str]:
         """
@@ -70,3 +76,37 @@ class EmailAccount:
             self.emails_cc += emails.emails_cc
             self.emails_to += emails.emails_to
             self.emails_from += emails.emails_from
+            self._update_counts()
+
+    def add_buckets(self, buckets: list[dict[str, any]], relationship: str):
+        """ Adds the aggregation buckets for a single relationship to this account. Buckets whose email address
+        belongs to a domain that is not allow-listed are dropped.
+        :param buckets: Aggregation buckets, each keyed by an email address.
+        :param relationship: Whether these emails were sent to, from or received as a cc.
+        """
+        emails: list[EmailEngagement] = [EmailEngagement(email_json=bucket, relationship=relationship,
+                                                         account=self.account) for bucket in buckets]
+        valid_emails: list[EmailEngagement] = list(filter(lambda email: is_valid_domain(email.domain), emails))
+        if relationship == 'cc':
+            self.emails_cc += valid_emails
+        elif relationship == 'to':
+            self.emails_to += valid_emails
+        else:
+            self.emails_from += valid_emails
+        self._update_counts()
+
+    def release_emails(self):
+        """ Drops the emails of this account once they have been written and aggregated into domains, so that they
+        can be freed. The counts and the ID are kept as they were.
+        """
+        self.id()
+        self.emails_cc = []
+        self.emails_to = []
+        self.emails_from = []
+
+    def _update_counts(self):
+        self._id = None
+        self.emails_to_count: int = len(self.emails_to)
+        self.emails_from_count: int = len(self.emails_from)
+        self.emails_cc_count: int = len(self.emails_cc)
+        self.total_email_count: int = self.emails_to_count + self.emails_cc_count + self.emails_from_count
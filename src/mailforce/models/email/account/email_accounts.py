@@ -6,6 +6,11 @@ class EmailAccounts:
     """ Holds multiple accounts for processing. """
     def __init__(self):
         self.accounts: list[EmailAccount] = []
+        self.failed_accounts: list[str] = []
+        """ Accounts that were not processed because the run ran out of time. """
+        self.deferred_accounts: list[str] = []
+        """ Accounts that were not processed because they had no new emails. """
+        self.skipped_accounts: list[str] = []
 
     def add_account(self, account: EmailAccount):
         """ Adds an account to the internal list
@@ -14,6 +19,12 @@ class EmailAccounts:
         if account:
             self.accounts.append(account)
 
+    def add_failed_account(self, account: str):
+        """ Records an account whose emails could not be retrieved.
+        :param account: Name of the account that failed.
+        """
+        self.failed_accounts.append(account)
+
     def to_csv_rows(self) -> list[str]:
         """
         :return: CSV Row for all accounts.
@@ -1,26 +1,58 @@
-from mailforce.utils.date_utils import to_simple_date_string
+from sys import intern
+
+from mailforce.utils.date_utils import format_timestamp, to_timestamp
+from mailforce.utils.domain_utils import normalize_domain
 from mailforce.utils.hash_utils import deterministic_id
 
 
 class EmailEngagement:
-    """ This class holds all the data for a specific email engagement. """
+    """ This class holds all the data for a specific email engagement. Hundreds of thousands of these are held at
+    once, so instances have no `__dict__`, and the strings that repeat across engagements (addresses, domains,
+    relationships and accounts) are interned so that each distinct value is only stored once. Dates are kept as
+    integer timestamps, and only formatted when they are output. The ID is only computed when it is first needed. """
+    __slots__ = ('earliest_timestamp', 'latest_timestamp', 'email_address', 'domain', 'count', 'relationship',
+                 'account', '_id')
+
     def __init__(self, email_json: dict[str, any], relationship: str, account: str):
         """
         :param email_json: JSON dict holding email data.
         :param relationship: Whether this email was sent to, from or received as a cc.
         :param account: Name of account.
         """
-        min_date: str = to_simple_date_string(email_json['min_date']['value_as_string'])
-        max_date: str = to_simple_date_string(email_json['max_date']['value_as_string'])
-        self.earliest_engagement_date: str = min_date
-        self.latest_engagement_date: str = max_date
-        self.email_address: str = email_json['key']
-        self.domain: str = self.email_address.split('@')[1]
+        """ Epoch milliseconds of the earliest and latest engagement. """
+        self.earliest_timestamp: int = to_timestamp(email_json['min_date'])
+        self.latest_timestamp: int = to_timestamp(email_json['max_date'])
+        self.email_address: str = intern(email_json['key'])
+        """ Normalized as the allow-list is matched, so that addresses differing in case share a domain. """
+        self.domain: str = intern(normalize_domain(self.email_address.split('@')[1]))
         self.count: int = email_json['doc_count']
-        self.relationship: str = relationship
-        self.account: str = account
-        self.id: str = deterministic_id(self.email_address, self.relationship, self.account,
-                                        min_date, max_date)
+        self.relationship: str = intern(relationship)
+        self.account: str = intern(account) if account else account
+        self._id: str = None
+
+    @property
+    def id(self) -> str:
+        """
+        :return: Deterministic ID based on the email address, relationship, account and engagement dates.
+        """
+        if self._id is None:
+            self._id = deterministic_id(self.email_address, self.relationship, self.account,
+                                        self.earliest_engagement_date, self.latest_engagement_date)
+        return self._id
+
+    @property
+    def earliest_engagement_date(self) -> str:
+        """
+        :return: Earliest engagement date in `YYYY-mm-dd HH:MM` format.
+        """
+        return format_timestamp(self.earliest_timestamp)
+
+    @property
+    def latest_engagement_date(self) -> str:
+        """
+        :return: Latest engagement date in `YYYY-mm-dd HH:MM` format.
+        """
+        return format_timestamp(self.latest_timestamp)
 
     def to_csv_row(self, add_account: bool = False) -> str:
         """
@@ -1,20 +1,39 @@
 from mailforce.models.email.engagement.email_engagement import EmailEngagement
-from mailforce.utils.date_utils import get_earliest_date, get_latest_date
+from mailforce.utils.date_utils import format_timestamp, max_timestamp, min_timestamp
 
 
 class EmailMapping:
-    """ This class holds all the engagement data for a single email address across all registered accounts. """
-    def __init__(self, email: EmailEngagement):
+    """ This class holds all the engagement data for a single email address across all registered accounts. Like
+    `EmailEngagement`, instances have no `__dict__` to keep their footprint small, and dates are kept as timestamps. """
+    __slots__ = ('email_address', 'first_contact_timestamp', 'latest_contact_timestamp', 'cc_count', 'to_count',
+                 'from_count', 'total')
+
+    def __init__(self, email: EmailEngagement = None):
+        """
+        :param email: Email instance that serves as a base for this mapping. If this is not present, the mapping starts
+        without an address or engagements, e.g. to be filled from totals computed elsewhere.
+        """
+        self.email_address: str = email.email_address if email else None
+        self.first_contact_timestamp: int = email.earliest_timestamp if email else None
+        self.latest_contact_timestamp: int = email.latest_timestamp if email else None
+        self.cc_count: int = email.count if email and email.relationship == 'cc' else 0
+        self.to_count: int = email.count if email and email.relationship == 'to' else 0
+        self.from_count: int = email.count if email and email.relationship == 'from' else 0
+        self.total: int = email.count if email else 0
+
+    @property
+    def first_contact_date(self) -> str:
+        """
+        :return: First contact date in `YYYY-mm-dd HH:MM` format.
         """
-        :param email: Email instance that serves as a base for this mapping.
+        return format_timestamp(self.first_contact_timestamp)
+
+    @property
+    def latest_contact_date(self) -> str:
+        """
+        :return: Latest contact date in `YYYY-mm-dd HH:MM` format.
         """
-        self.email_address: str = email.email_address
-        self.first_contact_date: str = email.earliest_engagement_date
-        self.latest_contact_date: str = email.latest_engagement_date
-        self.cc_count: int = email.count if email.relationship == 'cc' else 0
-        self.to_count: int = email.count if email.relationship == 'to' else 0
-        self.from_count: int = email.count if email.relationship == 'from' else 0
-        self.total: int = email.count
+        return format_timestamp(self.latest_contact_timestamp)
 
     def add_email(self, email: EmailEngagement):
         """ Adds an Email to this Email Mapping and updates the following:
@@ -32,9 +51,25 @@ class EmailMapping:
         else:
             print(f'Email mismatch between present:added {self.email_address}:{email.email_address}')
 
+    def merge(self, other):
+        """ Adds the engagements of another mapping of the same email address to this one. Merging is associative, so
+        mappings built from any partition of the emails merge into the same mapping.
+        :param other: Email mapping to be merged into this one.
+        """
+        if other.email_address == self.email_address:
+            self.cc_count += other.cc_count
+            self.to_count += other.to_count
+            self.from_count += other.from_count
+            self.total += other.total
+            self.first_contact_timestamp = min_timestamp(self.first_contact_timestamp, other.first_contact_timestamp)
+            self.latest_contact_timestamp = max_timestamp(self.latest_contact_timestamp,
+                                                          other.latest_contact_timestamp)
+        else:
+            print(f'Email mismatch between present:merged {self.email_address}:{other.email_address}')
+
     def _adjust_dates(self, email):
-        self.first_contact_date = get_earliest_date(self.first_contact_date, email.earliest_engagement_date)
-        self.latest_contact_date = get_latest_date(self.latest_contact_date, email.latest_engagement_date)
+        self.first_contact_timestamp = min_timestamp(self.first_contact_timestamp, email.earliest_timestamp)
+        self.latest_contact_timestamp = max_timestamp(self.latest_contact_timestamp, email.latest_timestamp)
 
     def _adjust_counts(self, email):
         self.total += email.count
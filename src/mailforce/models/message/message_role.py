@@ -1,3 +1,6 @@
+from mailforce.utils.domain_utils import normalize_domain
+
+
 class MessageRole:
     """ Holds the relationships between a given message ID in a specified account and an email address. """
     def __init__(self, account: str, message_id: str, email_address: str, role: str):
@@ -12,7 +15,7 @@ class MessageRole:
         self.message_id: str = message_id
         self.email_address: str = email_address
         self.role: str = role
-        self.domain: str = self.email_address.split('@')[1]
+        self.domain: str = normalize_domain(self.email_address.split('@')[1])
 
     def to_csv_row(self):
         """
@@ -1,3 +1,5 @@
+from typing import Iterable
+
 from mailforce.models.message.message_roles import MessageRoles
 
 MESSAGE_ROLES_HEADER: str = 'account,message_id,email_address,role'
@@ -6,9 +8,9 @@ MESSAGE_ROLES_HEADER: str = 'account,message_id,email_address,role'
 class MessageRolesContainer:
     """ Hold multiple message roles. """
 
-    def __init__(self, message_roles: list[MessageRoles]):
+    def __init__(self, message_roles: Iterable[MessageRoles]):
         """
-        :param message_roles: Message Roles list.
+        :param message_roles: Message Roles. This can be a generator, in which case it can only be consumed once.
         """
         self.message_roles = message_roles
 
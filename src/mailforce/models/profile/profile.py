@@ -0,0 +1,28 @@
+class Profile:
+    """ Where a profiled run spent its time or memory: its hottest functions, or the sites holding the most memory
+    when it peaked. """
+
+    def __init__(self, profile_json: dict[str, any] = None):
+        """
+        :param profile_json: JSON dict as returned by `to_json`.
+        """
+        profile_json = profile_json if profile_json else {}
+        """ What was profiled: `cpu` or `alloc`. """
+        self.kind: str = profile_json.get('kind')
+        """ Seconds the run took while being profiled. """
+        self.seconds: float = profile_json.get('seconds', 0.0)
+        """ Peak memory traced during an `alloc` profile, in bytes. """
+        self.peak_bytes: int = profile_json.get('peak_bytes', 0)
+        """ Hottest functions, by the time spent in them excluding their callees, or the allocation sites holding the
+        most memory, most first. """
+        self.entries: list[dict[str, any]] = profile_json.get('entries', [])
+
+    def to_json(self) -> dict[str, any]:
+        """
+        :return: JSON representation of this instance.
+        """
+        return {'kind': self.kind, 'seconds': self.seconds, 'peak_bytes': self.peak_bytes, 'entries': self.entries}
+
+    def __str__(self):
+        return f'{self.kind} profile of {self.seconds:.3f} seconds' + ''.join(map(lambda entry: f'\n  {entry}',
+                                                                                   self.entries))
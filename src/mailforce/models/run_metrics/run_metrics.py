@@ -0,0 +1,190 @@
+from threading import Lock
+
+""" Upper bounds, in milliseconds, of the buckets of the ES request latency histograms. A last bucket counts the
+requests that took longer. """
+LATENCY_BUCKETS_MS: list[float] = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+PHASE_FIELDS: list[str] = ['calls', 'wall_seconds', 'cpu_seconds']
+REQUEST_FIELDS: list[str] = ['requests', 'failed', 'seconds', 'request_bytes', 'response_bytes']
+
+
+class PhaseMetrics:
+    """ Time spent in a phase of a run, summed over all of its calls, which may have run concurrently. """
+
+    def __init__(self, phase_json: dict[str, any] = None):
+        """
+        :param phase_json: JSON dict as returned by `to_json`.
+        """
+        phase_json = phase_json if phase_json else {}
+        self.calls: int = phase_json.get('calls', 0)
+        self.wall_seconds: float = phase_json.get('wall_seconds', 0.0)
+        """ CPU time of the threads running the phase, which excludes waiting on ES and on other threads. """
+        self.cpu_seconds: float = phase_json.get('cpu_seconds', 0.0)
+        """ Peak resident memory of the process, in kilobytes, at the end of any call. """
+        self.peak_rss_kb: int = phase_json.get('peak_rss_kb', 0)
+
+    def add(self, other):
+        """
+        :param other: Phase metrics to be added to these.
+        """
+        for field in PHASE_FIELDS:
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+        self.peak_rss_kb = max(self.peak_rss_kb, other.peak_rss_kb)
+
+    def to_json(self) -> dict[str, any]:
+        """
+        :return: JSON representation of this instance.
+        """
+        return {**{field: getattr(self, field) for field in PHASE_FIELDS}, 'peak_rss_kb': self.peak_rss_kb}
+
+    def __str__(self):
+        return (f'{self.calls} calls, {self.wall_seconds:.3f} seconds, {self.cpu_seconds:.3f} CPU seconds, '
+                f'peak RSS {self.peak_rss_kb} KB')
+
+
+class RequestMetrics:
+    """ Requests of a single kind made to ES, e.g. `search` or `bulk`. """
+
+    def __init__(self, request_json: dict[str, any] = None):
+        """
+        :param request_json: JSON dict as returned by `to_json`.
+        """
+        request_json = request_json if request_json else {}
+        self.requests: int = request_json.get('requests', 0)
+        """ Number of requests that raised an error. """
+        self.failed: int = request_json.get('failed', 0)
+        self.seconds: float = request_json.get('seconds', 0.0)
+        """ Bytes of the request bodies, and of the responses as reported by their `content-length` header. """
+        self.request_bytes: int = request_json.get('request_bytes', 0)
+        self.response_bytes: int = request_json.get('response_bytes', 0)
+        """ Number of requests per bucket of `LATENCY_BUCKETS_MS`. """
+        self.latency_histogram: list[int] = request_json.get('latency_histogram', [0] * (len(LATENCY_BUCKETS_MS) + 1))
+
+    def record(self, seconds: float, request_bytes: int, response_bytes: int, failed: bool):
+        self.requests += 1
+        self.failed += 1 if failed else 0
+        self.seconds += seconds
+        self.request_bytes += request_bytes
+        self.response_bytes += response_bytes
+        self.latency_histogram[_latency_bucket(seconds * 1000)] += 1
+
+    def add(self, other):
+        """
+        :param other: Request metrics to be added to these.
+        """
+        for field in REQUEST_FIELDS:
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+        self.latency_histogram = [count + other_count
+                                  for count, other_count in zip(self.latency_histogram, other.latency_histogram)]
+
+    def to_json(self) -> dict[str, any]:
+        """
+        :return: JSON representation of this instance.
+        """
+        return {**{field: getattr(self, field) for field in REQUEST_FIELDS},
+                'latency_histogram': list(self.latency_histogram)}
+
+    def __str__(self):
+        average = self.seconds / self.requests if self.requests else 0
+        return (f'{self.requests} requests ({self.failed} failed) averaging {average:.3f} seconds, '
+                f'{self.request_bytes} bytes sent, {self.response_bytes} bytes received')
+
+
+class RunMetrics:
+    """ Where the time of a run goes: the wall and CPU time of its phases, the ES requests it made, and the number of
+    search pages fetched per account. When tracing, every phase and request is also kept as a span. This may be
+    updated from several threads at once. """
+
+    def __init__(self, metrics_json: dict[str, any] = None, trace_id: str = None):
+        """
+        :param metrics_json: JSON dict as returned by `to_json`.
+        :param trace_id: If present, phases and requests are kept as spans of this trace.
+        """
+        metrics_json = metrics_json if metrics_json else {}
+        self.phases: dict[str, PhaseMetrics] = {phase: PhaseMetrics(phase_json)
+                                                for phase, phase_json in metrics_json.get('phases', {}).items()}
+        self.requests: dict[str, RequestMetrics] = {operation: RequestMetrics(request_json)
+                                                    for operation, request_json
+                                                    in metrics_json.get('requests', {}).items()}
+        """ Number of accounts whose engagements were fetched, the pages that took, and the most any account took. """
+        self.accounts_paged: int = metrics_json.get('accounts_paged', 0)
+        self.pages: int = metrics_json.get('pages', 0)
+        self.max_pages_per_account: int = metrics_json.get('max_pages_per_account', 0)
+        self.trace_id: str = trace_id
+        """ Spans in the OpenTelemetry JSON encoding, up to `max_spans`, after which they are only counted. """
+        self.spans: list[dict[str, any]] = []
+        self.max_spans: int = 100000
+        self.dropped_spans: int = 0
+        self._lock: Lock = Lock()
+
+    def record_phase(self, phase: str, wall_seconds: float, cpu_seconds: float, peak_rss_kb: int):
+        with self._lock:
+            metrics = self.phases.setdefault(phase, PhaseMetrics())
+            metrics.calls += 1
+            metrics.wall_seconds += wall_seconds
+            metrics.cpu_seconds += cpu_seconds
+            metrics.peak_rss_kb = max(metrics.peak_rss_kb, peak_rss_kb)
+
+    def record_request(self, operation: str, seconds: float, request_bytes: int, response_bytes: int,
+                       failed: bool = False):
+        with self._lock:
+            self.requests.setdefault(operation, RequestMetrics()).record(seconds, request_bytes, response_bytes,
+                                                                         failed)
+
+    def record_pages(self, pages: int):
+        """
+        :param pages: Number of search pages the engagements of an account took.
+        """
+        with self._lock:
+            self.accounts_paged += 1
+            self.pages += pages
+            self.max_pages_per_account = max(self.max_pages_per_account, pages)
+
+    def add_span(self, span: dict[str, any]):
+        with self._lock:
+            if len(self.spans) < self.max_spans:
+                self.spans.append(span)
+            else:
+                self.dropped_spans += 1
+
+    def add(self, other):
+        """
+        :param other: Run metrics to be added to these, e.g. those of another shard.
+        """
+        with self._lock:
+            for phase, metrics in other.phases.items():
+                self.phases.setdefault(phase, PhaseMetrics()).add(metrics)
+            for operation, metrics in other.requests.items():
+                self.requests.setdefault(operation, RequestMetrics()).add(metrics)
+            self.accounts_paged += other.accounts_paged
+            self.pages += other.pages
+            self.max_pages_per_account = max(self.max_pages_per_account, other.max_pages_per_account)
+
+    def peak_rss_kb(self) -> int:
+        """
+        :return: Peak resident memory of the process, in kilobytes, at the end of any phase.
+        """
+        return max(map(lambda metrics: metrics.peak_rss_kb, self.phases.values()), default=0)
+
+    def to_json(self) -> dict[str, any]:
+        """
+        :return: JSON representation of this instance, without its spans.
+        """
+        return {
+            'phases': {phase: metrics.to_json() for phase, metrics in self.phases.items()},
+            'requests': {operation: metrics.to_json() for operation, metrics in self.requests.items()},
+            'accounts_paged': self.accounts_paged,
+            'pages': self.pages,
+            'max_pages_per_account': self.max_pages_per_account
+        }
+
+    def __str__(self):
+        return (''.join(map(lambda item: f'\n  {item[0]}: {item[1]}', sorted(self.phases.items())))
+                + ''.join(map(lambda item: f'\n  ES {item[0]}: {item[1]}', sorted(self.requests.items())))
+                + f'\n  {self.pages} pages for {self.accounts_paged} accounts, at most {self.max_pages_per_account}')
+
+
+def _latency_bucket(milliseconds: float) -> int:
+    for bucket, upper_bound in enumerate(LATENCY_BUCKETS_MS):
+        if milliseconds <= upper_bound:
+            return bucket
+    return len(LATENCY_BUCKETS_MS)
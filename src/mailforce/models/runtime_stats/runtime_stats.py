@@ -1,5 +1,15 @@
+from mailforce.models.continuation.continuation import Continuation
 from mailforce.models.domain.domains import Domains
 from mailforce.models.email.account.email_accounts import EmailAccounts
+from mailforce.models.profile.profile import Profile
+from mailforce.models.run_metrics.run_metrics import RunMetrics
+from mailforce.models.shard.shard_result import ShardResult
+from mailforce.models.write_stats.write_stats import WriteStats
+
+""" Statistics that are counts, and as such can be added together across the shards of a run. """
+COUNT_FIELDS: list[str] = ['email_accounts_processed', 'email_accounts_failed', 'email_accounts_deferred',
+                           'email_accounts_skipped', 'domains_processed', 'cc_emails_processed', 'to_emails_processed',
+                           'from_emails_processed', 'emails_processed']
 
 
 class RuntimeStats:
@@ -15,14 +25,40 @@ class RuntimeStats:
         accounts = email_accounts.accounts
         self.run_date: str = run_date
         self.email_accounts_processed: int = len(email_accounts.accounts)
+        self.email_accounts_failed: int = len(email_accounts.failed_accounts)
+        self.email_accounts_deferred: int = len(email_accounts.deferred_accounts)
+        self.email_accounts_skipped: int = len(email_accounts.skipped_accounts)
+        """ Where the next invocation should resume if this run ran out of time. """
+        self.continuation: Continuation = None
+        """ What this run hands over to the reduce step if it processed a single shard. """
+        self.shard_result: ShardResult = None
+        """ Outcome of the bulk writes of this run, per index. """
+        self.write_stats: WriteStats = WriteStats()
+        """ Time spent in each phase of this run, and the ES requests it made. """
+        self.metrics: RunMetrics = RunMetrics()
+        """ Profile of this run, if it was profiled. """
+        self.profile: Profile = None
         self.domains_processed: int = len(domains.domains)
-        self.cc_emails_processed: int = sum(list(map(lambda account: len(account.emails_cc), accounts)))
-        self.to_emails_processed: int = sum(list(map(lambda account: len(account.emails_to), accounts)))
-        self.from_emails_processed: int = sum(list(map(lambda account: len(account.emails_from), accounts)))
+        self.cc_emails_processed: int = sum(list(map(lambda account: account.emails_cc_count, accounts)))
+        self.to_emails_processed: int = sum(list(map(lambda account: account.emails_to_count, accounts)))
+        self.from_emails_processed: int = sum(list(map(lambda account: account.emails_from_count, accounts)))
         self.start_time: float = start_time
         self.end_time: float = end_time
         self.emails_processed: int = self.to_emails_processed + self.cc_emails_processed + self.from_emails_processed
 
+    def counts_json(self) -> dict[str, int]:
+        """
+        :return: The counts of this run, keyed by statistic.
+        """
+        return {field: getattr(self, field) for field in COUNT_FIELDS}
+
+    def add_counts(self, counts_json: dict[str, int]):
+        """ Adds the counts of another run, e.g. of another shard, to those of this one.
+        :param counts_json: Counts as returned by `counts_json`.
+        """
+        for field in COUNT_FIELDS:
+            setattr(self, field, getattr(self, field) + counts_json.get(field, 0))
+
     def set_times(self, start_time: float, end_time: float):
         self.start_time = start_time
         self.end_time = end_time
@@ -43,7 +79,12 @@ class RuntimeStats:
 
     def __str__(self):
         return (f'Run Date: {self.run_date}\nAccounts: {self.email_accounts_processed}'
+                f'\nFailed Accounts: {self.email_accounts_failed}'
+                f'\nDeferred Accounts: {self.email_accounts_deferred}'
+                f'\nSkipped Accounts: {self.email_accounts_skipped}'
                 f'\nDomains: {self.domains_processed}\nCC Emails: {self.cc_emails_processed}\n'
                 f'To Emails: {self.to_emails_processed}\nFrom Emails: {self.from_emails_processed}\n'
                 f'Start Time: {self.start_time}\nEnd Time:{self.end_time}\n'
-                f'Elapsed Time (Seconds):{self.elapsed_time()}')
+                f'Elapsed Time (Seconds):{self.elapsed_time()}\n'
+                f'Writes:{self.write_stats}\n'
+                f'Metrics:{self.metrics}')
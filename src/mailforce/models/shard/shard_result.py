@@ -0,0 +1,59 @@
+class ShardResult:
+    """ Holds what a worker processing a single shard of a run hands over to the reduce step: its statistics and
+    where it staged the partial domain documents it computed and the checkpoints to advance once those are written,
+    which are too large to be handed over in the result itself. """
+
+    def __init__(self, shard_result_json: dict[str, any] = None):
+        """
+        :param shard_result_json: JSON dict as returned by `to_json`.
+        """
+        shard_result_json = shard_result_json if shard_result_json else {}
+        self.shard: int = shard_result_json.get('shard', 0)
+        self.shards: int = shard_result_json.get('shards', 1)
+        """ ID of the run, shared by all the workers of the run and their continuations. """
+        self.run_id: str = shard_result_json.get('run_id')
+        """ ID of the invocation that processed this part of the shard, e.g. the first one or a continuation. """
+        self.part: str = shard_result_json.get('part')
+        """ Number of staged domain documents, computed from the accounts of this part of the shard only. """
+        self.domains: int = shard_result_json.get('domains', 0)
+        """ Number of staged checkpoints, which are only to be saved once the domains have been written. """
+        self.checkpoints: int = shard_result_json.get('checkpoints', 0)
+        """ Whether all the domain documents and checkpoints were staged. """
+        self.staged: bool = shard_result_json.get('staged', False)
+        """ Counts of the runtime statistics of this shard. """
+        self.counts: dict[str, int] = shard_result_json.get('counts', {})
+        """ Outcome of the bulk writes of this shard, per index, as returned by `WriteStats.to_json`. """
+        self.write_stats: dict[str, dict[str, any]] = shard_result_json.get('write_stats', {})
+        """ Metrics of the phases and ES requests of this shard, as returned by `RunMetrics.to_json`. """
+        self.metrics: dict[str, any] = shard_result_json.get('metrics', {})
+        """ Run date this shard could record, if any. """
+        self.run_date: str = shard_result_json.get('run_date')
+        """ Whether this invocation finished the shard, rather than leaving a continuation. """
+        self.complete: bool = shard_result_json.get('complete', True)
+        self.start_time: float = shard_result_json.get('start_time')
+
+    def to_json(self) -> dict[str, any]:
+        """
+        :return: JSON representation of this instance.
+        """
+        return {
+            'shard': self.shard,
+            'shards': self.shards,
+            'run_id': self.run_id,
+            'part': self.part,
+            'domains': self.domains,
+            'checkpoints': self.checkpoints,
+            'staged': self.staged,
+            'counts': self.counts,
+            'write_stats': self.write_stats,
+            'metrics': self.metrics,
+            'run_date': self.run_date,
+            'complete': self.complete,
+            'start_time': self.start_time
+        }
+
+    def staging_key(self) -> str:
+        """
+        :return: Key the documents staged by this part of the shard are stored under.
+        """
+        return f'{self.run_id}.{self.shard}.{self.part}'
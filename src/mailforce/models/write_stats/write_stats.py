@@ -0,0 +1,83 @@
+from threading import Lock
+
+COUNT_FIELDS: list[str] = ['succeeded', 'failed', 'retried', 'requests']
+
+
+class IndexWriteStats:
+    """ Outcome of the bulk writes to a single index. """
+
+    def __init__(self, stats_json: dict[str, any] = None):
+        """
+        :param stats_json: JSON dict as returned by `to_json`.
+        """
+        stats_json = stats_json if stats_json else {}
+        """ Number of documents written. """
+        self.succeeded: int = stats_json.get('succeeded', 0)
+        """ Number of documents that could not be written, including those that kept being rejected. """
+        self.failed: int = stats_json.get('failed', 0)
+        """ Number of times a document or request was sent again after being rejected. """
+        self.retried: int = stats_json.get('retried', 0)
+        """ Number of bulk requests holding documents for this index. """
+        self.requests: int = stats_json.get('requests', 0)
+        """ Total time spent waiting on those requests. """
+        self.seconds: float = stats_json.get('seconds', 0.0)
+
+    def add(self, other):
+        """
+        :param other: Index write statistics to be added to these.
+        """
+        for field in COUNT_FIELDS:
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+        self.seconds += other.seconds
+
+    def to_json(self) -> dict[str, any]:
+        """
+        :return: JSON representation of this instance.
+        """
+        return {**{field: getattr(self, field) for field in COUNT_FIELDS}, 'seconds': self.seconds}
+
+    def __str__(self):
+        average = self.seconds / self.requests if self.requests else 0
+        return (f'{self.succeeded} written, {self.failed} failed, {self.retried} retried, '
+                f'{self.requests} requests averaging {average:.3f} seconds')
+
+
+class WriteStats:
+    """ Outcome of the bulk writes of a run, per index. This may be updated from several writer threads at once. """
+
+    def __init__(self, write_stats_json: dict[str, dict[str, any]] = None):
+        """
+        :param write_stats_json: JSON dict as returned by `to_json`.
+        """
+        write_stats_json = write_stats_json if write_stats_json else {}
+        self.indices: dict[str, IndexWriteStats] = {index: IndexWriteStats(stats_json)
+                                                    for index, stats_json in write_stats_json.items()}
+        self._lock: Lock = Lock()
+
+    def record(self, index: str, succeeded: int = 0, failed: int = 0, retried: int = 0, requests: int = 0,
+               seconds: float = 0.0):
+        """ Adds the outcome of a bulk request, or part of one, to the statistics of the given index. """
+        with self._lock:
+            stats = self.indices.setdefault(index, IndexWriteStats())
+            stats.succeeded += succeeded
+            stats.failed += failed
+            stats.retried += retried
+            stats.requests += requests
+            stats.seconds += seconds
+
+    def add(self, other):
+        """
+        :param other: Write statistics to be added to these, e.g. those of another shard.
+        """
+        with self._lock:
+            for index, stats in other.indices.items():
+                self.indices.setdefault(index, IndexWriteStats()).add(stats)
+
+    def to_json(self) -> dict[str, dict[str, any]]:
+        """
+        :return: JSON representation of this instance, keyed by index.
+        """
+        return {index: stats.to_json() for index, stats in self.indices.items()}
+
+    def __str__(self):
+        return ''.join(map(lambda item: f'\n  {item[0]}: {item[1]}', sorted(self.indices.items())))
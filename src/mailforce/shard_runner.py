@@ -0,0 +1,80 @@
+""" Runs a sharded run on the local machine, the way the coordinator, the workers and the reduce step are invoked as
+separate functions in production, with every shard processed in its own subprocess:
+    python3 ./shard_runner.py SHARDS [EVENT_JSON]
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from mailforce.main import COORDINATOR_MODE, MODE_KEY, REDUCER_MODE, SHARDS_KEY, SHARD_RESULTS_KEY, main
+
+WORKER_ARGUMENT: str = '--worker'
+
+
+class LocalContext:
+    """ Stands in for the context a function is invoked with. There is no deadline when running locally. """
+
+    def __init__(self):
+        self.activation_id: str = None
+        self.api_host: str = None
+        self.api_key: str = None
+        self.deadline: float = None
+        self.function_name: str = 'local'
+        self.function_version: str = None
+        self.namespace: str = None
+        self.request_id: str = None
+
+
+def run_sharded(shards: int, event: dict[str, any] = None) -> dict[str, any]:
+    """ Invokes the coordinator, runs each of its worker events in a subprocess, following any continuations, and
+    invokes the reduce step with the results of all of them.
+    :param shards: Number of shards the accounts are split into.
+    :param event: Options of the run, as given to `main`.
+    :return: Response of the reduce step.
+    """
+    event = event if event else {}
+    coordinator_response = main({**event, MODE_KEY: COORDINATOR_MODE, SHARDS_KEY: shards}, LocalContext())
+    if 'error' in coordinator_response:
+        raise RuntimeError(coordinator_response['error'])
+    with tempfile.TemporaryDirectory() as directory:
+        pending = [(_start_worker(worker_event, directory, i), worker_event)
+                   for i, worker_event in enumerate(coordinator_response['shard_events'])]
+        shard_results = []
+        while pending:
+            (process, output_path), worker_event = pending.pop(0)
+            if process.wait() != 0:
+                raise RuntimeError(f'Worker for shard {worker_event.get("shard")} exited with {process.returncode}')
+            with open(output_path, 'r') as f:
+                response = json.load(f)
+            if 'error' in response:
+                raise RuntimeError(f'Worker for shard {worker_event.get("shard")} failed: {response["error"]}')
+            shard_results.append(response['shard_result'])
+            if 'continuation' in response:
+                pending.append((_start_worker(response['continuation'], directory, len(shard_results) + shards),
+                                response['continuation']))
+    return main({**event, MODE_KEY: REDUCER_MODE, SHARD_RESULTS_KEY: shard_results}, LocalContext())
+
+
+def _start_worker(worker_event: dict[str, any], directory: str, i: int) -> (subprocess.Popen, str):
+    output_path = os.path.join(directory, f'worker-{i}.json')
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), WORKER_ARGUMENT, output_path],
+                               stdin=subprocess.PIPE, text=True)
+    process.stdin.write(json.dumps(worker_event))
+    process.stdin.close()
+    return process, output_path
+
+
+def _run_worker(output_path: str):
+    response = main(json.load(sys.stdin), LocalContext())
+    with open(output_path, 'w') as f:
+        json.dump(response, f)
+
+
+if __name__ == "__main__":
+    if sys.argv[1] == WORKER_ARGUMENT:
+        _run_worker(sys.argv[2])
+    else:
+        reduce_response = run_sharded(int(sys.argv[1]), json.loads(sys.argv[2]) if len(sys.argv) > 2 else None)
+        print(reduce_response.get('runtime_stats', reduce_response.get('error')))
@@ -1,7 +1,68 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+from functools import lru_cache
 
 DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
 ALT_DATE_FORMAT = '%Y-%m-%d %H:%M'
+EPOCH: datetime = datetime(1970, 1, 1)
+MILLIS_PER_MINUTE: int = 60000
+MINUTES_PER_DAY: int = 1440
+_TIMES_OF_DAY: list[str] = [f'{minute // 60:02d}:{minute % 60:02d}' for minute in range(MINUTES_PER_DAY)]
+
+
+def to_timestamp(date_json: dict[str, any]) -> int:
+    """ Converts the value of a date aggregation, as returned by ES, into an integer timestamp once when it is
+    ingested, so that dates can be compared without parsing them.
+    :param date_json: JSON dict holding the epoch milliseconds under `value` and/or the date under `value_as_string`,
+    formatted like `1969-08-03T15:15:15.000Z`.
+    :return: Epoch milliseconds.
+    """
+    value = date_json.get('value')
+    if value is not None:
+        return int(value)
+    stripped_string = date_json['value_as_string'].split('.')[0]
+    return (datetime.strptime(stripped_string, DATE_FORMAT) - EPOCH) // timedelta(milliseconds=1)
+
+
+def parse_timestamp(date_str: str) -> int:
+    """ Unlike `to_timestamp`, keeps the milliseconds of the date, so that it can be compared with the exact dates
+    returned by ES, e.g. those recorded in checkpoints.
+    :param date_str: UTC date formatted like `1969-08-03T15:15:15.123Z` or `1969-08-03T15:15:15`.
+    :return: Epoch milliseconds.
+    """
+    (seconds, _, fraction) = date_str.rstrip('Z').partition('.')
+    millis = int(fraction[:3].ljust(3, '0')) if fraction else 0
+    return (datetime.strptime(seconds, DATE_FORMAT) - EPOCH) // timedelta(milliseconds=1) + millis
+
+
+def format_timestamp(timestamp: int) -> str:
+    """ Formats a timestamp the same way `to_simple_date_string` formats the date it was converted from. Formatting
+    only happens when writing output, and the date part is cached per day since engagements cluster around few days.
+    :param timestamp: Epoch milliseconds. May be None.
+    :return: Date string in `YYYY-mm-dd HH:MM` format, or None.
+    """
+    if timestamp is None:
+        return None
+    (day, minute_of_day) = divmod(timestamp // MILLIS_PER_MINUTE, MINUTES_PER_DAY)
+    return _format_day(day) + _TIMES_OF_DAY[minute_of_day]
+
+
+@lru_cache(maxsize=65536)
+def _format_day(day: int) -> str:
+    return (EPOCH + timedelta(days=day)).strftime('%Y-%m-%d ')
+
+
+def min_timestamp(first: int, second: int) -> int:
+    """
+    :return: The earliest of two timestamps, or whichever one is present.
+    """
+    return second if first is None else first if second is None or first <= second else second
+
+
+def max_timestamp(first: int, second: int) -> int:
+    """
+    :return: The latest of two timestamps, or whichever one is present.
+    """
+    return second if first is None else first if second is None or first >= second else second
 
 
 # 2023-11-15T18:55:34.000Z
@@ -35,6 +96,30 @@ def get_earliest_date(first_date_str, second_date_str) -> str:
     return first_date_str if first_date and first_date < second_date else second_date_str
 
 
+def min_date_string(first_date_str: str, second_date_str: str) -> str:
+    """ Gets the earliest of two date strings without parsing them. Both must be in the same zero-padded format
+    (e.g. `YYYY-mm-dd HH:MM`), which sorts chronologically.
+    :param first_date_str: First date to be compared. May be None.
+    :param second_date_str: Second date to be compared. May be None.
+    :return: earliest of the two dates, or whichever one is present.
+    """
+    if not first_date_str or not second_date_str:
+        return first_date_str or second_date_str
+    return min(first_date_str, second_date_str)
+
+
+def max_date_string(first_date_str: str, second_date_str: str) -> str:
+    """ Gets the latest of two date strings without parsing them. Both must be in the same zero-padded format
+    (e.g. `YYYY-mm-dd HH:MM`), which sorts chronologically.
+    :param first_date_str: First date to be compared. May be None.
+    :param second_date_str: Second date to be compared. May be None.
+    :return: latest of the two dates, or whichever one is present.
+    """
+    if not first_date_str or not second_date_str:
+        return first_date_str or second_date_str
+    return max(first_date_str, second_date_str)
+
+
 def now():
     """
     :return: Current date in YYYY-mm-DD'T'HH:MM:SS format
@@ -1,12 +1,116 @@
-import os
+from threading import Lock
 
+from mailforce import CONFIG, RESOURCES_PATH
 
-def _get_domains() -> list:
-    with open('../resources/domains.txt', 'r') as f:
+DOMAINS_FILE_PATH: str = f'{RESOURCES_PATH}/domains.txt'
+""" Marks the node of the suffix trie at which an allow-listed domain ends. A dot can never be a label. """
+_END: str = '.'
+
+
+class DomainMatcher:
+    """ Matches domains against an allow-list in constant time with respect to the size of the allow-list. Domains
+    are compared case-insensitively and without any trailing dot. """
+
+    def __init__(self, domains: list[str], match_subdomains: bool = False):
+        """
+        :param domains: Allow-listed domains.
+        :param match_subdomains: Whether subdomains of allow-listed domains are allow-listed as well, e.g.
+        `mail.kunaico.com` when `kunaico.com` is.
+        """
+        self.domains: frozenset[str] = frozenset(filter(None, map(normalize_domain, domains)))
+        self.match_subdomains: bool = match_subdomains
+        """ Allow-listed domains keyed label by label starting from the top-level domain, e.g. `com` -> `kunaico`. """
+        self.suffix_trie: dict[str, dict] = {}
+        if match_subdomains:
+            for domain in self.domains:
+                node = self.suffix_trie
+                for label in reversed(domain.split('.')):
+                    node = node.setdefault(label, {})
+                node[_END] = {}
+
+    def matches(self, domain: str) -> bool:
+        """
+        :param domain: Domain to be tested.
+        :return: Whether the domain, or with subdomain matching any of its parent domains, is allow-listed.
+        """
+        if not domain:
+            return False
+        domain = normalize_domain(domain)
+        if domain in self.domains:
+            return True
+        if not self.match_subdomains:
+            return False
+        node = self.suffix_trie
+        for label in reversed(domain.split('.')):
+            node = node.get(label)
+            if node is None:
+                return False
+            if _END in node:
+                return True
+        return False
+
+
+def normalize_domain(domain: str) -> str:
+    """
+    :param domain: Domain as found in an email address or in the allow-list.
+    :return: The domain in lower case, without surrounding whitespace or a trailing dot.
+    """
+    return domain.strip().rstrip('.').lower()
+
+
+def _get_domains(path: str = DOMAINS_FILE_PATH) -> list:
+    with open(path, 'r') as f:
         return list(map(lambda line: line.replace('\n', '').strip(), f.readlines()))
 
 
-DOMAINS: list = _get_domains()
+""" Allow-list and its matcher, read from the domains file when first used rather than when this module is imported. """
+_domains: list = None
+_matcher: DomainMatcher = None
+_domains_lock: Lock = Lock()
+
+
+def __getattr__(name: str):
+    """ Keeps `DOMAINS` and `MATCHER` available as module attributes, loading them on first use. """
+    if name == 'DOMAINS':
+        return get_domains()
+    if name == 'MATCHER':
+        return get_matcher()
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+
+def get_domains() -> list:
+    """
+    :return: The allow-listed domains, as read from the domains file on first use.
+    """
+    return _domains if _domains is not None else _load_domains()[0]
+
+
+def get_matcher() -> DomainMatcher:
+    """
+    :return: Matcher of the allow-listed domains, built on first use.
+    """
+    return _matcher if _matcher is not None else _load_domains()[1]
+
+
+def reload_domains(path: str = DOMAINS_FILE_PATH) -> int:
+    """ Reloads the allow-list, e.g. after the domains file was updated, without restarting the process. The new
+    matcher replaces the previous one at once, so concurrent lookups see either the old or the new allow-list.
+    :param path: Path of the domains file.
+    :return: Number of allow-listed domains.
+    """
+    global _domains, _matcher
+    domains = _get_domains(path)
+    matcher = DomainMatcher(domains, CONFIG.match_subdomains)
+    with _domains_lock:
+        (_matcher, _domains) = (matcher, domains)
+    return len(matcher.domains)
+
+
+def reset_domains():
+    """ Drops the allow-list, which is then read again on next use, e.g. once the configuration was reloaded. """
+    global _domains, _matcher
+    with _domains_lock:
+        (_matcher, _domains) = (None, None)
 
 
 def is_valid_domain(domain: str) -> bool:
@@ -14,11 +118,20 @@ def is_valid_domain(domain: str) -> bool:
     :param domain: Domain to be tested for validity.
     :return: Whether this domain is allow-listed.
     """
-    return domain and domain in DOMAINS
+    return (_matcher if _matcher is not None else get_matcher()).matches(domain)
 
 
 def alphabetize_domains() -> list:
     """
     :return: List of alphabetized domains.
     """
-    return sorted(DOMAINS)
+    return sorted(get_domains())
+
+
+def _load_domains() -> (list, DomainMatcher):
+    global _domains, _matcher
+    with _domains_lock:
+        if _matcher is None:
+            domains = _get_domains()
+            (_matcher, _domains) = (DomainMatcher(domains, CONFIG.match_subdomains), domains)
+        return _domains, _matcher
@@ -1,10 +1,61 @@
 import hashlib
 
+from mailforce import CONFIG
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+""" The ID scheme that all documents were written with before schemes were versioned. Its IDs carry no prefix. """
+LEGACY_ID_SCHEME: str = 'v1'
+""" IDs of every other scheme are prefixed with its version, so that they never collide with those of another one. """
+ID_SCHEMES: dict[str, any] = {
+    'v1': lambda data: hashlib.md5(data).hexdigest(),
+    'v2': lambda data: 'v2-' + hashlib.blake2b(data, digest_size=16).hexdigest(),
+    'v3': lambda data: 'v3-' + xxhash.xxh3_128_hexdigest(data)
+}
+
+
+def _get_hasher(scheme: str):
+    if scheme not in ID_SCHEMES:
+        raise ValueError(f'Unknown ID scheme {scheme}, expected one of {list(ID_SCHEMES.keys())}')
+    if scheme == 'v3' and xxhash is None:
+        print('ID scheme v3 requires the xxhash package, falling back to v2.')
+        scheme = 'v2'
+    return ID_SCHEMES[scheme]
+
+
+""" Hasher of the configured ID scheme, chosen on first use so that importing this module reads no settings. """
+_hasher = None
+
+
+def use_id_scheme(scheme: str):
+    """ Switches the scheme used by `deterministic_id` for the rest of the process.
+    :param scheme: Version of the ID scheme, one of `ID_SCHEMES`.
+    """
+    global _hasher
+    _hasher = _get_hasher(scheme)
+
 
 def deterministic_id(*args):
     """
     :param args: List of values to be used in generating a deterministic ID.
-    :return: Deterministic hash based on input.
+    :return: Deterministic hash based on input, using the configured ID scheme.
+    """
+    return (_hasher if _hasher is not None else _configured_hasher())(str(args).encode())
+
+
+def legacy_id(*args):
+    """ Use this for the IDs of documents that are looked up again by later runs, e.g. checkpoints and documents that
+    are merged into, so that switching ID schemes does not orphan them.
+    :param args: List of values to be used in generating a deterministic ID.
+    :return: Deterministic hash based on input, using the legacy ID scheme.
     """
-    input_str = ''.join(list(map(lambda arg: arg, str(args))))
-    return hashlib.md5(input_str.encode()).hexdigest()
+    return ID_SCHEMES[LEGACY_ID_SCHEME](str(args).encode())
+
+
+def _configured_hasher():
+    global _hasher
+    _hasher = _get_hasher(CONFIG.id_scheme)
+    return _hasher
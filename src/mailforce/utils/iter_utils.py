@@ -0,0 +1,130 @@
+from queue import Empty, Full, Queue
+from threading import Event, Thread
+from typing import Callable, Generic, Iterable, Iterator, TypeVar
+
+T = TypeVar('T')
+_DONE = object()
+""" Seconds a producer waits for room in a full queue before it checks again whether it was stopped. """
+_PUT_TIMEOUT_SECONDS: float = 0.1
+
+
+class _Failure:
+    """ Wraps an exception raised by the producer so that it can be re-raised in the consumer. """
+    def __init__(self, exception: BaseException):
+        self.exception: BaseException = exception
+
+
+def prefetch(iterable: Iterable[T], depth: int = 1) -> Iterator[T]:
+    """ Iterates over the given iterable on a background thread so that the next items are being produced while the
+    current one is being consumed. At most `depth` items are buffered ahead of the consumer, which keeps memory
+    bounded. Exceptions raised while producing are re-raised to the consumer.
+    Once the returned iterator is closed, e.g. because the consumer stopped early, the producer stops as well: the
+    buffered items are dropped, the iterable is closed once its current item has been produced, and the background
+    thread is joined. Consumers that may stop early should close it, e.g. with `contextlib.closing`.
+    :param iterable: Iterable to be consumed in the background, e.g. a generator of search result pages.
+    :param depth: Maximum number of items produced ahead of the consumer.
+    :return: Iterator yielding the same items in the same order.
+    """
+    queue: Queue = Queue(maxsize=max(1, depth))
+    stopped = Event()
+
+    def put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                queue.put(item, timeout=_PUT_TIMEOUT_SECONDS)
+                return True
+            except Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except BaseException as e:
+            put(_Failure(e))
+        finally:
+            close = getattr(iterable, 'close', None)
+            if close:
+                close()
+            put(_DONE)
+
+    thread = Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = queue.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.exception
+            yield item
+    finally:
+        stopped.set()
+        _drain(queue)
+        thread.join()
+        _drain(queue)
+
+
+def _drain(queue: Queue):
+    while True:
+        try:
+            queue.get_nowait()
+        except Empty:
+            return
+
+
+class Stage(Generic[T]):
+    """ A stage of a pipeline, which applies a function to every item put into it on its own background thread. At
+    most `depth` items wait for the stage, so a slow stage holds back the one feeding it instead of letting items pile
+    up in memory. Once the function raises, the remaining items are drained without being processed, and the exception
+    is re-raised to the caller when the stage is closed or the next item is put into it. A stage that is not closed
+    must be cancelled, so that its thread does not wait for items forever.
+    """
+
+    def __init__(self, function: Callable[[T], None], depth: int = 1):
+        """
+        :param function: Function applied to every item, in the order the items were put.
+        :param depth: Maximum number of items waiting for the stage.
+        """
+        self.function: Callable[[T], None] = function
+        self.queue: Queue = Queue(maxsize=max(1, depth))
+        self.failure: BaseException = None
+        self.stopped: Event = Event()
+        self.thread: Thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is _DONE:
+                return
+            if self.failure is None and not self.stopped.is_set():
+                try:
+                    self.function(item)
+                except BaseException as e:
+                    self.failure = e
+
+    def put(self, item: T):
+        """
+        :param item: Item to be processed, which blocks while the stage already has `depth` items waiting.
+        """
+        if self.failure is not None:
+            raise self.failure
+        self.queue.put(item)
+
+    def close(self):
+        """ Waits until all the items put so far have been processed. """
+        self.queue.put(_DONE)
+        self.thread.join()
+        if self.failure is not None:
+            raise self.failure
+
+    def cancel(self):
+        """ Stops the stage without processing the items still waiting, e.g. because the pipeline feeding it failed,
+        and waits until the item being processed, if any, is done. """
+        self.stopped.set()
+        _drain(self.queue)
+        self.queue.put(_DONE)
+        self.thread.join()
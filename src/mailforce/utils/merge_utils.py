@@ -0,0 +1,67 @@
+from mailforce.utils.date_utils import min_date_string, max_date_string
+
+ACCOUNT_ROLE_FIELDS: list[str] = ['emails_from', 'emails_to', 'emails_cc']
+
+
+def merge_domain_docs(existing: dict[str, any], new: dict[str, any]) -> dict[str, any]:
+    """ Merges the engagements of a domain computed during this run into the document already stored for it.
+    Counts are added together, and the earliest first contact and latest last contact dates are kept.
+    :param existing: Domain document already present in ES.
+    :param new: Domain document computed during this run.
+    :return: Merged domain document. Fields that are not merged are taken from the new document.
+    """
+    merged: dict[str, any] = dict(new)
+    for field in ['total_cc', 'total_to', 'total_from', 'total_emails']:
+        merged[field] = existing.get(field, 0) + new.get(field, 0)
+    merged['first_contact_date'] = min_date_string(existing.get('first_contact_date'),
+                                                   new.get('first_contact_date'))
+    merged['latest_contact_date'] = max_date_string(existing.get('latest_contact_date'),
+                                                    new.get('latest_contact_date'))
+    merged['email_engagements'] = merge_engagement_lists(existing.get('email_engagements', []),
+                                                         new.get('email_engagements', []),
+                                                         sum_fields=['from_count', 'to_count', 'cc_count',
+                                                                     'total_count'],
+                                                         earliest_field='first_contact_date',
+                                                         latest_field='latest_contact_date')
+    return merged
+
+
+def merge_account_docs(existing: dict[str, any], new: dict[str, any]) -> dict[str, any]:
+    """ Merges the engagements of an account computed during this run into the document already stored for it.
+    Engagements with the same email address are combined within each role.
+    :param existing: Account engagements document already present in ES.
+    :param new: Account engagements document computed during this run.
+    :return: Merged account engagements document.
+    """
+    merged: dict[str, any] = dict(new)
+    for field in ACCOUNT_ROLE_FIELDS:
+        merged[field] = merge_engagement_lists(existing.get(field, []), new.get(field, []),
+                                               sum_fields=['count'],
+                                               earliest_field='earliest_engagement_date',
+                                               latest_field='latest_engagement_date')
+    return merged
+
+
+def merge_engagement_lists(existing: list[dict[str, any]], new: list[dict[str, any]], sum_fields: list[str],
+                           earliest_field: str, latest_field: str) -> list[dict[str, any]]:
+    """ Merges two lists of engagements keyed by email address. Engagements only present in one of the lists are kept
+    as they are, existing ones first.
+    :param existing: Engagements already present in ES.
+    :param new: Engagements computed during this run.
+    :param sum_fields: Count fields that are added together.
+    :param earliest_field: Date field for which the earliest value is kept.
+    :param latest_field: Date field for which the latest value is kept.
+    :return: Merged engagements.
+    """
+    merged: dict[str, dict[str, any]] = {engagement['email_address']: dict(engagement) for engagement in existing}
+    for engagement in new:
+        email_address: str = engagement['email_address']
+        if email_address not in merged:
+            merged[email_address] = dict(engagement)
+            continue
+        current: dict[str, any] = merged[email_address]
+        for field in sum_fields:
+            current[field] = current.get(field, 0) + engagement.get(field, 0)
+        current[earliest_field] = min_date_string(current.get(earliest_field), engagement.get(earliest_field))
+        current[latest_field] = max_date_string(current.get(latest_field), engagement.get(latest_field))
+    return list(merged.values())
@@ -0,0 +1,151 @@
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, TypeVar
+
+from mailforce.models.run_metrics.run_metrics import RunMetrics
+
+T = TypeVar('T')
+SERVICE_NAME: str = 'mailforce'
+""" Kinds of the OpenTelemetry spans of phases and of ES requests. """
+INTERNAL_SPAN_KIND: int = 1
+CLIENT_SPAN_KIND: int = 3
+""" Metrics of the run since the last call to `reset_run_metrics`. """
+_run_metrics: RunMetrics = RunMetrics()
+""" Span ID of the run, and the start of its span in Unix nanoseconds. """
+_root_span: (str, int) = (None, 0)
+""" Span of the phase each thread is in, if any, which the spans it starts are children of. """
+_current = threading.local()
+
+
+def reset_run_metrics(trace: bool = False) -> RunMetrics:
+    """ Starts collecting metrics anew, e.g. at the start of a run.
+    :param trace: Whether every phase and ES request is also kept as a span, to be written by `write_trace`.
+    :return: Metrics that all following phases and requests are recorded in.
+    """
+    global _run_metrics, _root_span
+    _run_metrics = RunMetrics(trace_id=os.urandom(16).hex() if trace else None)
+    _root_span = (os.urandom(8).hex(), time.time_ns())
+    return _run_metrics
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """ Records the wall and CPU time of the enclosed code, and the peak memory of the process once it is done, as a
+    call of the given phase. Phases may be nested and run concurrently; CPU time is that of the calling thread. """
+    metrics = _run_metrics
+    parent = getattr(_current, 'span_id', None)
+    span_id = _current.span_id = os.urandom(8).hex() if metrics.trace_id else None
+    start_ns = time.time_ns()
+    start = time.perf_counter()
+    start_cpu = time.thread_time()
+    try:
+        yield
+    finally:
+        wall_seconds = time.perf_counter() - start
+        metrics.record_phase(name, wall_seconds, time.thread_time() - start_cpu,
+                             resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+        _current.span_id = parent
+        if span_id:
+            metrics.add_span(_span(metrics, span_id, parent, name, INTERNAL_SPAN_KIND, start_ns,
+                                   start_ns + int(wall_seconds * 1e9), {}))
+
+
+def timed_request(operation: str, request_bytes: int, send: Callable[[], T]) -> T:
+    """ Sends a request to ES, and records its latency and size.
+    :param operation: Kind of request, e.g. `search`.
+    :param request_bytes: Size of the request body.
+    :param send: Sends the request, and returns its response.
+    :return: The response.
+    """
+    metrics = _run_metrics
+    start_ns = time.time_ns()
+    start = time.perf_counter()
+    response = None
+    try:
+        response = send()
+        return response
+    finally:
+        seconds = time.perf_counter() - start
+        response_bytes = _response_bytes(response)
+        metrics.record_request(operation, seconds, request_bytes, response_bytes, failed=response is None)
+        if metrics.trace_id:
+            metrics.add_span(_span(metrics, os.urandom(8).hex(), getattr(_current, 'span_id', None),
+                                   f'es.{operation}', CLIENT_SPAN_KIND, start_ns, start_ns + int(seconds * 1e9),
+                                   {'db.system': 'elasticsearch', 'db.operation': operation,
+                                    'http.request_content_length': request_bytes,
+                                    'http.response_content_length': response_bytes,
+                                    'error': response is None}))
+
+
+def json_size(body) -> int:
+    """
+    :return: Size in bytes of the given request body once serialized to JSON.
+    """
+    return len(json.dumps(body, default=str).encode())
+
+
+def record_pages(pages: int):
+    """
+    :param pages: Number of search pages the engagements of an account took.
+    """
+    _run_metrics.record_pages(pages)
+
+
+def write_trace(path: str, run_metrics: RunMetrics, attributes: dict[str, any] = None):
+    """ Writes the spans of a traced run to a file, as an OpenTelemetry trace in the OTLP JSON encoding, under a span
+    covering the whole run, which e.g. an OpenTelemetry collector can import.
+    :param path: Path of the file.
+    :param run_metrics: Metrics of the run, which must have been reset with `trace` set.
+    :param attributes: Attributes of the span of the run, e.g. its counts.
+    """
+    (root_span_id, start_ns) = _root_span
+    attributes = {**(attributes if attributes else {}), 'dropped_spans': run_metrics.dropped_spans}
+    root = _span(run_metrics, root_span_id, None, 'collect', INTERNAL_SPAN_KIND, start_ns, time.time_ns(), attributes)
+    trace = {'resourceSpans': [{
+        'resource': {'attributes': _attributes({'service.name': SERVICE_NAME})},
+        'scopeSpans': [{'scope': {'name': SERVICE_NAME}, 'spans': [root] + run_metrics.spans}]
+    }]}
+    with open(path, 'w') as f:
+        json.dump(trace, f)
+    print(f'Wrote {len(run_metrics.spans) + 1} spans to {path}')
+
+
+def _span(run_metrics: RunMetrics, span_id: str, parent_span_id: str, name: str, kind: int, start_ns: int,
+          end_ns: int, attributes: dict[str, any]) -> dict[str, any]:
+    # Spans started by threads that are not in any phase, e.g. those of thread pools, belong to the run.
+    parent_span_id = parent_span_id if parent_span_id else _root_span[0] if span_id != _root_span[0] else ''
+    return {
+        'traceId': run_metrics.trace_id,
+        'spanId': span_id,
+        'parentSpanId': parent_span_id,
+        'name': name,
+        'kind': kind,
+        'startTimeUnixNano': str(start_ns),
+        'endTimeUnixNano': str(end_ns),
+        'attributes': _attributes({**attributes, 'thread.name': threading.current_thread().name})
+    }
+
+
+def _attributes(attributes: dict[str, any]) -> list[dict[str, any]]:
+    def value(attribute):
+        if isinstance(attribute, bool):
+            return {'boolValue': attribute}
+        if isinstance(attribute, int):
+            return {'intValue': str(attribute)}
+        if isinstance(attribute, float):
+            return {'doubleValue': attribute}
+        return {'stringValue': str(attribute)}
+
+    return [{'key': key, 'value': value(attribute)} for key, attribute in attributes.items()]
+
+
+def _response_bytes(response) -> int:
+    meta = getattr(response, 'meta', None)
+    try:
+        return int(meta.headers.get('content-length', 0)) if meta is not None else 0
+    except (AttributeError, ValueError):
+        return 0
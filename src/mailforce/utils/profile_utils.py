@@ -0,0 +1,114 @@
+import cProfile
+import pstats
+import threading
+import time
+import tracemalloc
+
+from mailforce.models.profile.profile import Profile
+
+CPU_PROFILE: str = 'cpu'
+ALLOC_PROFILE: str = 'alloc'
+""" Seconds between the checks of the memory traced by an `alloc` profile, at which a snapshot is taken if it grew past
+its previous peak. """
+ALLOC_SAMPLE_SECONDS: float = 0.5
+
+
+class Profiler:
+    """ Profiles the code run between `start` and `stop`, in every thread started in between, e.g. those of the fetch
+    and write pools. Work done in other processes, such as that of the `process` domain engine, is not profiled.
+        * `cpu` profiles every function call with cProfile, and reports the functions most time was spent in.
+        * `alloc` traces allocations with tracemalloc, and reports the sites that held the most memory when the traced
+          memory peaked, as last sampled.
+    """
+
+    def __init__(self, kind: str, top: int = 20):
+        """
+        :param kind: What to profile: `cpu` or `alloc`.
+        :param top: Number of functions or allocation sites reported.
+        """
+        if kind not in (CPU_PROFILE, ALLOC_PROFILE):
+            raise ValueError(f'Unknown profile {kind}')
+        self.kind: str = kind
+        self.top: int = top
+        self.profile: Profile = None
+        self._start: float = 0.0
+        self._profiles: list[cProfile.Profile] = []
+        self._lock: threading.Lock = threading.Lock()
+        self._stopped: threading.Event = threading.Event()
+        self._sampler: threading.Thread = None
+        self._peak_snapshot: tracemalloc.Snapshot = None
+        self._peak_size: int = -1
+
+    def start(self):
+        self._start = time.perf_counter()
+        if self.kind == CPU_PROFILE:
+            threading.setprofile(self._profile_thread)
+            self._profile_thread()
+        else:
+            tracemalloc.start()
+            self._sampler = threading.Thread(target=self._sample, daemon=True)
+            self._sampler.start()
+
+    def stop(self) -> Profile:
+        """ May be called more than once, e.g. once the run is done, and again in case it failed.
+        :return: The profile of the code run since `start`.
+        """
+        if self.profile is not None:
+            return self.profile
+        self.profile = Profile({'kind': self.kind, 'seconds': time.perf_counter() - self._start})
+        if self.kind == CPU_PROFILE:
+            threading.setprofile(None)
+            with self._lock:
+                profiles = list(self._profiles)
+            for profile in profiles:
+                profile.disable()
+            self.profile.entries = _hot_functions(profiles, self.top)
+        else:
+            self._stopped.set()
+            self._sampler.join()
+            self._take_snapshot()
+            (_, self.profile.peak_bytes) = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.profile.entries = _allocation_sites(self._peak_snapshot, self.top)
+        return self.profile
+
+    def _profile_thread(self, *args):
+        """ Installed as the profile function of every new thread, which it replaces with a profiler of its own. """
+        profile = cProfile.Profile()
+        with self._lock:
+            self._profiles.append(profile)
+        profile.enable()
+
+    def _sample(self):
+        while not self._stopped.wait(ALLOC_SAMPLE_SECONDS):
+            self._take_snapshot()
+
+    def _take_snapshot(self):
+        (size, _) = tracemalloc.get_traced_memory()
+        if size > self._peak_size:
+            self._peak_size = size
+            self._peak_snapshot = tracemalloc.take_snapshot()
+
+
+def _hot_functions(profiles: list[cProfile.Profile], top: int) -> list[dict[str, any]]:
+    profiles = list(filter(lambda profile: profile.getstats(), profiles))
+    if not profiles:
+        return []
+    stats = pstats.Stats(*profiles)
+    functions = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:top]
+    return [{
+        'function': f'{file}:{line}({name})',
+        'calls': calls,
+        'self_seconds': self_seconds,
+        'cumulative_seconds': cumulative_seconds
+    } for (file, line, name), (_, calls, self_seconds, cumulative_seconds, _) in functions]
+
+
+def _allocation_sites(snapshot: tracemalloc.Snapshot, top: int) -> list[dict[str, any]]:
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__),
+                                       tracemalloc.Filter(False, '<frozen importlib._bootstrap*>')])
+    return [{
+        'site': f'{statistic.traceback[0].filename}:{statistic.traceback[0].lineno}',
+        'bytes': statistic.size,
+        'blocks': statistic.count
+    } for statistic in snapshot.statistics('lineno')[:top]]
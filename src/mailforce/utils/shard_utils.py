@@ -0,0 +1,21 @@
+import hashlib
+
+
+def shard_of(account: str, shards: int) -> int:
+    """
+    :param account: Name of the account.
+    :param shards: Total number of shards.
+    :return: Shard the account belongs to. This only depends on the account name, so an account stays in the same
+    shard across invocations and processes, unlike with the built-in `hash` which is salted per process.
+    """
+    return int(hashlib.md5(account.encode()).hexdigest(), 16) % shards
+
+
+def accounts_in_shard(accounts: list[str], shard: int, shards: int) -> list[str]:
+    """
+    :param accounts: Accounts to be partitioned.
+    :param shard: Index of the shard, starting at 0.
+    :param shards: Total number of shards.
+    :return: The accounts belonging to the given shard, in their original order.
+    """
+    return list(filter(lambda account: shard_of(account, shards) == shard, accounts))
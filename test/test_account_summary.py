@@ -0,0 +1,16 @@
+from unittest import TestCase
+
+from mailforce.models.account_summary.account_summary import AccountSummary
+
+
+class TestAccountSummary(TestCase):
+    def test_from_bucket(self):
+        summary = AccountSummary({'key': {'account': 'kunai'}, 'doc_count': 12,
+                                  'latest_date': {'value': 1704067200000.0,
+                                                  'value_as_string': '2024-01-01T00:00:00.000Z'}})
+        self.assertEqual({'account': 'kunai', 'doc_count': 12, 'latest_date': '2024-01-01T00:00:00.000Z'},
+                         summary.to_json())
+
+    def test_without_latest_date(self):
+        summary = AccountSummary({'key': {'account': 'kunai'}, 'doc_count': 1})
+        self.assertIsNone(summary.latest_date)
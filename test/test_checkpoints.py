@@ -0,0 +1,46 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from mailforce.client_operations.checkpoints.checkpoint_store import CheckpointStore
+from mailforce.client_operations.checkpoints.json_checkpoint_store import JsonCheckpointStore
+from mailforce.models.checkpoint.checkpoint import ACCOUNTS_STREAM, MESSAGE_ROLES_STREAM, Checkpoint
+
+
+class TestCheckpoints(TestCase):
+    def test_advance_is_monotonic(self):
+        checkpoint = Checkpoint('kunai-jim', ACCOUNTS_STREAM)
+        checkpoint.advance('2024-01-02T00:00:00.000Z', 2)
+        checkpoint.advance('2024-01-01T00:00:00.000Z', 1)
+        self.assertEqual('2024-01-02T00:00:00.000Z', checkpoint.date)
+        self.assertEqual(2, checkpoint.search_after)
+
+    def test_advance_breaks_ties_on_the_same_date(self):
+        checkpoint = Checkpoint('*', MESSAGE_ROLES_STREAM)
+        checkpoint.advance('2024-01-02T00:00:00.000Z', [1704153600000, 'm2'])
+        checkpoint.advance('2024-01-02T00:00:00.000Z', [1704153600000, 'm1'])
+        self.assertEqual([1704153600000, 'm2'], checkpoint.search_after)
+        checkpoint.advance('2024-01-02T00:00:00.000Z', [1704153600000, 'm3'])
+        self.assertEqual([1704153600000, 'm3'], checkpoint.search_after)
+        self.assertTrue(checkpoint.has_cursor())
+        self.assertFalse(Checkpoint('*', MESSAGE_ROLES_STREAM, '2024-01-02T00:00:00.000Z', 1704153600000).has_cursor())
+
+    def test_json_store_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = JsonCheckpointStore(os.path.join(directory, 'checkpoints.json'))
+            self.assertEqual({}, store.load(['kunai-jim'], ACCOUNTS_STREAM))
+            store.save([Checkpoint('kunai-jim', ACCOUNTS_STREAM, '2024-01-02T00:00:00.000Z'),
+                        Checkpoint('kunai-jim', MESSAGE_ROLES_STREAM, '2024-01-01T00:00:00.000Z', 1704067200000)])
+            checkpoints = store.load(['kunai-jim', 'kunai-joe'], ACCOUNTS_STREAM)
+            self.assertEqual(['kunai-jim'], list(checkpoints.keys()))
+            self.assertEqual('2024-01-02T00:00:00.000Z', checkpoints['kunai-jim'].date)
+            message_roles = store.load(['kunai-jim'], MESSAGE_ROLES_STREAM)['kunai-jim']
+            self.assertEqual(1704067200000, message_roles.search_after)
+
+    def test_incomplete_store_cannot_be_created(self):
+        class LoadOnlyCheckpointStore(CheckpointStore):
+            def load(self, accounts: list[str], stream: str) -> dict[str, Checkpoint]:
+                return {}
+
+        with self.assertRaises(TypeError):
+            LoadOnlyCheckpointStore()
@@ -1,10 +1,28 @@
 from unittest import TestCase
 
-from utils.date_utils import to_simple_date_string
+from utils.date_utils import format_timestamp, max_timestamp, min_timestamp, parse_timestamp, \
+    to_simple_date_string, to_timestamp
 
 
 class TestDateUtils(TestCase):
     def test_get_date_string(self):
         date_string = '2023-11-15T18:55:34.000Z'
         date_as_string = to_simple_date_string(date_string)
-        self.assertEquals('2023-11-15 18:55', date_as_string)
\ No newline at end of file
+        self.assertEquals('2023-11-15 18:55', date_as_string)
+
+    def test_timestamp_formats_like_date_string(self):
+        date_json = {'value_as_string': '2023-11-15T18:55:34.000Z', 'value': 1700074534000}
+        self.assertEqual(1700074534000, to_timestamp(date_json))
+        self.assertEqual(1700074534000, to_timestamp({'value_as_string': date_json['value_as_string']}))
+        self.assertEqual(to_simple_date_string(date_json['value_as_string']), format_timestamp(to_timestamp(date_json)))
+        self.assertIsNone(format_timestamp(None))
+
+    def test_min_max_timestamp(self):
+        self.assertEqual(1, min_timestamp(None, 1))
+        self.assertEqual(1, min_timestamp(2, 1))
+        self.assertEqual(2, max_timestamp(2, None))
+        self.assertEqual(2, max_timestamp(1, 2))
+
+    def test_parse_timestamp_keeps_millis(self):
+        self.assertEqual(1700074534345, parse_timestamp('2023-11-15T18:55:34.345Z'))
+        self.assertEqual(1700074534000, parse_timestamp('2023-11-15T18:55:34'))
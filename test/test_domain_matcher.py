@@ -0,0 +1,36 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from mailforce.utils import domain_utils
+from mailforce.utils.domain_utils import DomainMatcher
+
+
+class TestDomainMatcher(TestCase):
+    def test_exact_match_ignores_case(self):
+        matcher = DomainMatcher(['Kunaico.com', ' aexp.com.', ''])
+        self.assertTrue(matcher.matches('KUNAICO.COM'))
+        self.assertTrue(matcher.matches('aexp.com'))
+        self.assertFalse(matcher.matches('mail.kunaico.com'))
+        self.assertFalse(matcher.matches(''))
+        self.assertFalse(matcher.matches(None))
+
+    def test_subdomain_match(self):
+        matcher = DomainMatcher(['kunaico.com'], match_subdomains=True)
+        self.assertTrue(matcher.matches('kunaico.com'))
+        self.assertTrue(matcher.matches('Mail.EU.kunaico.com'))
+        self.assertFalse(matcher.matches('notkunaico.com'))
+        self.assertFalse(matcher.matches('com'))
+
+    def test_reload(self):
+        original = domain_utils.DOMAINS_FILE_PATH
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'domains.txt')
+            with open(path, 'w') as f:
+                f.write('reloaded.com\n')
+            try:
+                self.assertEqual(1, domain_utils.reload_domains(path))
+                self.assertTrue(domain_utils.is_valid_domain('reloaded.com'))
+            finally:
+                domain_utils.reload_domains(original)
+        self.assertFalse(domain_utils.is_valid_domain('reloaded.com'))
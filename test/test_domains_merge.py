@@ -0,0 +1,33 @@
+from unittest import TestCase
+
+from mailforce.models.domain.domains import Domains, merge_domains
+from test_engagement_columns import EMAILS
+
+
+def _domains(emails) -> Domains:
+    domains = Domains()
+    for email in emails:
+        domains.add_email(email)
+    return domains
+
+
+class TestDomainsMerge(TestCase):
+    def test_merge_matches_adding_all_emails(self):
+        expected = _domains(EMAILS)
+        merged = _domains(EMAILS[:2])
+        merged.merge(_domains(EMAILS[2:]))
+        self.assertEqual(set(expected.domains.keys()), set(merged.domains.keys()))
+        for name, domain in expected.domains.items():
+            self.assertEqual(domain.id(), merged.domains[name].id())
+            self.assertEqual(sorted(domain.to_csv()), sorted(merged.domains[name].to_csv()))
+
+    def test_merge_domains_of_every_partition(self):
+        expected = _domains(EMAILS)
+        for size in range(1, len(EMAILS) + 1):
+            with self.subTest(size=size):
+                merged = merge_domains([_domains([email]) for email in EMAILS[:size]])
+                self.assertEqual(len(_domains(EMAILS[:size]).domains), len(merged.domains))
+        merged = merge_domains([_domains([email]) for email in EMAILS])
+        for name, domain in expected.domains.items():
+            self.assertEqual(domain.id(), merged.domains[name].id())
+        self.assertEqual({}, merge_domains([]).domains)
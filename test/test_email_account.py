@@ -0,0 +1,51 @@
+import json
+from unittest import TestCase
+
+from mailforce.models.domain.domains import Domains
+from mailforce.models.email.account.email_account import EmailAccount
+
+
+class TestEmailAccount(TestCase):
+    def test_add_buckets(self):
+        with open('./resources/buckets.json', 'r') as f:
+            input_json = json.loads(f.read())
+        aggregations = input_json['aggregations']
+        expected = EmailAccount(input_json, 'samantha@kunaico.com')
+        email_account = EmailAccount(account='samantha@kunaico.com')
+        self.assertEqual(0, email_account.total_email_count)
+        email_account.add_buckets(aggregations['group_by_cc']['buckets'], 'cc')
+        email_account.add_buckets(aggregations['group_by_to']['buckets'], 'to')
+        email_account.add_buckets(aggregations['group_by_from']['buckets'], 'from')
+        self.assertEqual(expected.emails_from_count, email_account.emails_from_count)
+        self.assertEqual(expected.emails_to_count, email_account.emails_to_count)
+        self.assertEqual(expected.emails_cc_count, email_account.emails_cc_count)
+        self.assertEqual(expected.total_email_count, email_account.total_email_count)
+        self.assertEqual(expected.id(), email_account.id())
+
+    def test_append_emails_updates_counts(self):
+        with open('./resources/buckets.json', 'r') as f:
+            input_json = json.loads(f.read())
+        email_account = EmailAccount(input_json, 'samantha@kunaico.com')
+        email_account.append_emails(EmailAccount(input_json, 'samantha@kunaico.com'))
+        self.assertEqual(8, email_account.emails_from_count)
+        self.assertEqual(22, email_account.total_email_count)
+
+    def test_engagements_share_strings(self):
+        with open('./resources/buckets.json', 'r') as f:
+            first = EmailAccount(json.loads(f.read()), 'samantha@kunaico.com')
+        with open('./resources/buckets.json', 'r') as f:
+            second = EmailAccount(json.loads(f.read()), 'samantha@kunaico.com')
+        self.assertIs(first.emails_from[0].email_address, second.emails_from[0].email_address)
+        self.assertIs(first.emails_from[0].domain, second.emails_from[0].domain)
+        self.assertFalse(hasattr(first.emails_from[0], '__dict__'))
+
+    def test_mixed_case_addresses_share_a_domain(self):
+        email_account = EmailAccount(account='kunai')
+        email_account.add_buckets([{'key': address, 'doc_count': 1, 'min_date': {'value': 1700000000000},
+                                    'max_date': {'value': 1700000000000}}
+                                   for address in ['bob@AEXP.com', 'al@aexp.com.', 'eve@Aexp.Com']], 'to')
+        self.assertEqual(3, email_account.emails_to_count)
+        domains = Domains()
+        domains.add_account(email_account)
+        self.assertEqual(['aexp.com'], list(domains.domains.keys()))
+        self.assertEqual(3, domains.domains['aexp.com'].total_to)
@@ -0,0 +1,62 @@
+import pickle
+from unittest import TestCase
+
+from mailforce.models.domain import engagement_columns
+from mailforce.models.domain.domains import Domains
+from mailforce.models.domain.engagement_columns import EngagementColumns, engagement_rows, rollup_rows
+from mailforce.models.email.account.email_account import EmailAccount
+from mailforce.models.email.engagement.email_engagement import EmailEngagement
+
+
+def _email(address: str, relationship: str, count: int, earliest: int = None, latest: int = None) -> EmailEngagement:
+    bucket = {'key': address, 'doc_count': count, 'min_date': {'value': earliest}, 'max_date': {'value': latest}}
+    if earliest is None:
+        bucket['min_date'] = bucket['max_date'] = {'value': None, 'value_as_string': '2024-01-01T00:00:00.000Z'}
+    return EmailEngagement(bucket, relationship, 'kunai')
+
+
+EMAILS: list[EmailEngagement] = [
+    _email('bob@aexp.com', 'to', 2, 1700000000000, 1700000060000),
+    _email('al@chase.com', 'cc', 1, 1600000000000, 1600000000000),
+    _email('bob@aexp.com', 'from', 3, 1690000000000, 1710000000000),
+    _email('eve@aexp.com', 'cc', 4, 1650000000000, 1660000000000),
+    _email('al@chase.com', 'to', 5),
+]
+
+
+class TestEngagementColumns(TestCase):
+    def test_rollup_matches_domains(self):
+        domains = Domains()
+        columns = EngagementColumns()
+        for email in EMAILS:
+            domains.add_email(email)
+            columns.add_email(email)
+        self.assertEqual(len(EMAILS), len(columns))
+        for np in {engagement_columns.np, None}:
+            with self.subTest(numpy=np is not None):
+                original = engagement_columns.np
+                engagement_columns.np = np
+                try:
+                    rolled_up = columns.rollup()
+                finally:
+                    engagement_columns.np = original
+                self.assertEqual(list(domains.domains.keys()), list(rolled_up.domains.keys()))
+                for name, domain in domains.domains.items():
+                    self.assertEqual(domain.to_csv(), rolled_up.domains[name].to_csv())
+                    self.assertEqual(domain.id(), rolled_up.domains[name].id())
+
+    def test_rows_roll_up_the_same_and_domains_pickle_compactly(self):
+        email_account = EmailAccount(account='kunai')
+        for email in EMAILS:
+            getattr(email_account, f'emails_{email.relationship}').append(email)
+        domains = Domains()
+        domains.add_account(email_account)
+        rolled_up = pickle.loads(pickle.dumps(rollup_rows(engagement_rows([email_account]))))
+        self.assertEqual(list(domains.domains.keys()), list(rolled_up.domains.keys()))
+        for name, domain in domains.domains.items():
+            self.assertEqual(domain.to_csv(), rolled_up.domains[name].to_csv())
+            self.assertEqual(domain.id(), rolled_up.domains[name].id())
+            self.assertEqual(list(domain.email_mappings.keys()), list(rolled_up.domains[name].email_mappings.keys()))
+
+    def test_empty_rollup(self):
+        self.assertEqual({}, EngagementColumns().rollup().domains)
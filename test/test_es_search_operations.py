@@ -0,0 +1,153 @@
+from unittest import TestCase
+
+from mailforce.client_operations.es import set_client
+from mailforce.client_operations.es import es_search_operations
+from mailforce.client_operations.es.es_search_operations import INDEX, get_aggregated_emails_by_accounts, \
+    get_domain_rollups, iter_message_roles
+from mailforce.client_operations.es.fake_elasticsearch import FakeElasticsearch
+from mailforce.models.checkpoint.checkpoint import ALL_ACCOUNTS, MESSAGE_ROLES_STREAM, Checkpoint
+
+
+def _message(account: str, message_id: str, date: str, to: str = 'al@chase.com') -> dict[str, any]:
+    return {'account': account, 'messageId': message_id, 'date': date, 'from': [{'address': f'{account}@aexp.com'}],
+            'to': [{'address': to}]}
+
+
+class _MsearchRecordingElasticsearch(FakeElasticsearch):
+    """ Records the accounts searched by every msearch request, and sends the searches of `failing_account` to an
+    index that does not exist, so that only they fail. """
+
+    def __init__(self, failing_account: str):
+        super().__init__()
+        self.failing_account: str = failing_account
+        self.msearch_accounts: list[list[str]] = []
+
+    def msearch(self, searches: list[dict[str, any]] = None, **kwargs):
+        requests = searches[1::2]
+        accounts = [request['query']['bool']['must'][0]['term']['account'] for request in requests]
+        self.msearch_accounts.append(accounts)
+        searches = []
+        for account, request in zip(accounts, requests):
+            searches += [{'index': 'missing' if account == self.failing_account else INDEX}, request]
+        return super().msearch(searches=searches, **kwargs)
+
+
+MESSAGES: list[dict[str, any]] = [
+    _message('kunai', 'm1', '2024-01-01T00:00:00.000Z'),
+    _message('kunai', 'm2', '2024-01-03T00:00:00.000Z'),
+    _message('shinobi', 'm3', '2024-01-04T00:00:00.000Z'),
+    _message('ronin', 'm4', '2024-01-05T00:00:00.000Z'),
+]
+
+
+class TestEsSearchOperations(TestCase):
+    def setUp(self):
+        self.client = FakeElasticsearch()
+        self.client.add_documents(INDEX, MESSAGES)
+        set_client(self.client)
+        self.search = es_search_operations._search
+        self.rollup_accounts_per_query = es_search_operations.ROLLUP_ACCOUNTS_PER_QUERY
+        self.composite_page_size = es_search_operations.COMPOSITE_PAGE_SIZE
+        self.batch_size = es_search_operations.BATCH_SIZE
+
+    def tearDown(self):
+        set_client(None)
+        es_search_operations._search = self.search
+        es_search_operations.ROLLUP_ACCOUNTS_PER_QUERY = self.rollup_accounts_per_query
+        es_search_operations.COMPOSITE_PAGE_SIZE = self.composite_page_size
+        es_search_operations.BATCH_SIZE = self.batch_size
+
+    def test_message_roles_query_applies_watermark_and_account_filters(self):
+        query = es_search_operations._message_roles_query('2024-01-02T00:00:00.000Z', accounts=['kunai', 'shinobi'],
+                                                          excluded_accounts=['shinobi'])['query']['bool']
+        self.assertEqual('2024-01-02T00:00:00.000Z', query['must'][0]['range']['date']['gt'])
+        self.assertEqual([{'terms': {'account': ['kunai', 'shinobi']}}], query['filter'])
+        self.assertEqual([{'terms': {'account': ['shinobi']}}], query['must_not'])
+
+    def test_full_rebuild_message_roles_query_has_no_watermark(self):
+        query = es_search_operations._message_roles_query(None)['query']['bool']
+        self.assertNotIn('gt', query['must'][0]['range']['date'])
+        self.assertIn('lte', query['must'][0]['range']['date'])
+        self.assertEqual({'must'}, set(query.keys()))
+
+    def test_message_roles_query_resumes_after_a_hit_on_its_date(self):
+        query = es_search_operations._message_roles_query('2024-01-02T00:00:00.000Z',
+                                                          search_after=[1704153600000, 'm2'])
+        self.assertEqual('2024-01-02T00:00:00.000Z', query['query']['bool']['must'][0]['range']['date']['gte'])
+        self.assertNotIn('gt', query['query']['bool']['must'][0]['range']['date'])
+        self.assertEqual([1704153600000, 'm2'], query['search_after'])
+        self.assertEqual(['date', 'messageId'], [field for sort in query['sort'] for field in sort])
+
+    def test_message_roles_sharing_a_date_are_resumed_from_the_checkpoint(self):
+        date = '2024-01-02T00:00:00.000Z'
+        self.client.add_documents(INDEX, [_message('shinobi', message_id, date) for message_id in ['m7', 'm5', 'm6']])
+        es_search_operations.BATCH_SIZE = 2
+        checkpoint = Checkpoint(ALL_ACCOUNTS, MESSAGE_ROLES_STREAM)
+        message_roles = iter_message_roles('2024-01-01T00:00:00.000Z', checkpoint=checkpoint)
+        # The checkpoint is advanced once the consumer moves past the first page, which ends within the date.
+        self.assertEqual(['m5', 'm6', 'm7'], [next(message_roles).message_id for _ in range(3)])
+        message_roles.close()
+        self.assertEqual(date, checkpoint.date)
+        self.assertEqual('m6', checkpoint.search_after[1])
+        self.assertEqual(['m7', 'm2', 'm3', 'm4'], [message_roles.message_id for message_roles in
+                                                    iter_message_roles('2024-01-01T00:00:00.000Z',
+                                                                       checkpoint=checkpoint)])
+
+    def test_message_roles_are_extracted_after_the_watermark(self):
+        message_ids = [message_roles.message_id for message_roles in
+                       iter_message_roles('2024-01-02T00:00:00.000Z', accounts=['kunai', 'shinobi'],
+                                          excluded_accounts=['shinobi'])]
+        self.assertEqual(['m2'], message_ids)
+        self.assertEqual(['m1', 'm2', 'm3', 'm4'],
+                         [message_roles.message_id for message_roles in iter_message_roles()])
+
+    def test_domain_rollups_are_queried_per_group_of_accounts(self):
+        es_search_operations.ROLLUP_ACCOUNTS_PER_QUERY = 2
+        queries = []
+
+        def bucket(address: str, count: int, timestamp: int) -> dict[str, any]:
+            return {'key': {'address': address}, 'doc_count': count, 'min_date': {'value': timestamp},
+                    'max_date': {'value': timestamp}}
+
+        def search(query: dict[str, any], index: str, search_after=None) -> dict[str, any]:
+            queries.append(query)
+            first_group = len(queries) == 1
+            to_buckets = [bucket('bob@aexp.com', 2, 1700000000000)] if first_group \
+                else [bucket('bob@aexp.com', 1, 1710000000000), bucket('al@chase.com', 1, 1710000000000)]
+            return {'aggregations': {aggregation: {'buckets': to_buckets if aggregation == 'group_by_to' else []}
+                                     for aggregation in query['aggs']}}
+
+        es_search_operations._search = search
+        domains = get_domain_rollups({'kunai': ('2024-01-01T00:00:00.000Z', '2024-02-01T00:00:00.000Z'),
+                                      'shinobi': (None, None),
+                                      'ronin': ('2024-01-02T00:00:00.000Z', None)})
+        self.assertEqual([2, 1], [len(query['query']['bool']['should']) for query in queries])
+        (kunai, shinobi) = [clause['bool']['filter'] for clause in queries[0]['query']['bool']['should']]
+        self.assertEqual([{'term': {'account': 'kunai'}}, {'range': {'date': {
+            'format': 'strict_date_optional_time', 'lte': '2024-02-01T00:00:00.000Z',
+            'gt': '2024-01-01T00:00:00.000Z'}}}], kunai)
+        self.assertNotIn('gt', shinobi[1]['range']['date'])
+        self.assertEqual({'aexp.com': 3, 'chase.com': 1},
+                         {name: domain.total_to for name, domain in domains.domains.items()})
+        self.assertEqual(1, len(domains.domains['aexp.com'].email_mappings))
+
+    def test_msearch_responses_are_demultiplexed_per_account(self):
+        client = _MsearchRecordingElasticsearch(failing_account='broken')
+        client.add_documents(INDEX, [_message('kunai', 'm1', '2024-01-01T00:00:00.000Z', to='al@chase.com'),
+                                     _message('kunai', 'm2', '2024-01-02T00:00:00.000Z', to='bo@chase.com'),
+                                     _message('kunai', 'm3', '2024-01-03T00:00:00.000Z', to='cy@chase.com'),
+                                     _message('shinobi', 'm4', '2024-01-04T00:00:00.000Z'),
+                                     _message('broken', 'm5', '2024-01-05T00:00:00.000Z')])
+        set_client(client)
+        es_search_operations.COMPOSITE_PAGE_SIZE = 1
+        (email_accounts, errors) = get_aggregated_emails_by_accounts({'kunai': None, 'broken': None, 'shinobi': None,
+                                                                      'ronin': None})
+        # A full page may be followed by an empty one, so shinobi takes two rounds and kunai's three addresses four.
+        self.assertEqual([['kunai', 'broken', 'shinobi', 'ronin'], ['kunai', 'shinobi'], ['kunai'], ['kunai']],
+                         client.msearch_accounts)
+        self.assertEqual(['broken'], list(errors.keys()))
+        self.assertEqual({'kunai', 'shinobi'}, set(email_accounts.keys()))
+        self.assertEqual(['al@chase.com', 'bo@chase.com', 'cy@chase.com'],
+                         [email.email_address for email in email_accounts['kunai'].emails_to])
+        self.assertEqual(['al@chase.com'], [email.email_address for email in email_accounts['shinobi'].emails_to])
+        self.assertEqual('2024-01-04T00:00:00.000Z', email_accounts['shinobi'].latest_date)
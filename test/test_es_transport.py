@@ -0,0 +1,41 @@
+from unittest import TestCase
+
+from mailforce import CONFIG
+from mailforce.client_operations.es import get_client, set_client
+from mailforce.client_operations.es.fake_elasticsearch import FakeElasticsearch
+from mailforce.client_operations.es.transport import SEARCH_OPERATION, connections_per_node, transport_options
+
+SETTINGS: list[str] = ['es_connections_per_node', 'search_workers', 'bulk_threads', 'es_sniff', 'elastic_cloud_id']
+
+
+class TestEsTransport(TestCase):
+    def setUp(self):
+        self.settings = {name: getattr(CONFIG, name) for name in SETTINGS}
+
+    def tearDown(self):
+        for name, value in self.settings.items():
+            setattr(CONFIG, name, value)
+        set_client(None)
+
+    def test_connections_are_sized_to_the_threads_sending_requests(self):
+        (CONFIG.es_connections_per_node, CONFIG.search_workers, CONFIG.bulk_threads) = (0, 16, 4)
+        self.assertEqual(22, connections_per_node())
+        CONFIG.es_connections_per_node = 5
+        self.assertEqual(5, transport_options()['connections_per_node'])
+
+    def test_sniffing_is_skipped_on_elastic_cloud(self):
+        (CONFIG.es_sniff, CONFIG.elastic_cloud_id) = (True, None)
+        self.assertTrue(transport_options()['sniff_on_start'])
+        CONFIG.elastic_cloud_id = 'cluster:abc'
+        self.assertNotIn('sniff_on_start', transport_options())
+
+    def test_operation_clients_are_reused(self):
+        set_client(FakeElasticsearch())
+        self.assertIs(get_client(SEARCH_OPERATION), get_client(SEARCH_OPERATION))
+
+    def test_fake_counts_compressed_bytes(self):
+        (plain, compressed) = (FakeElasticsearch(), FakeElasticsearch(http_compress=True, connections=1))
+        for client in [plain, compressed]:
+            client.add_documents('emails', [{'account': 'kunai', 'subject': 'Quarterly report'}] * 100)
+            client.search(index='emails', body={'size': 100})
+        self.assertLess(compressed.stats()['search']['response_bytes'] * 5, plain.stats()['search']['response_bytes'])
@@ -0,0 +1,61 @@
+from unittest import TestCase
+
+from elasticsearch import NotFoundError, helpers
+
+from mailforce.client_operations.es.fake_elasticsearch import FakeElasticsearch
+
+DOCS: list[dict[str, any]] = [
+    {'account': 'kunai', 'date': '2024-01-01T00:00:00.000Z', 'to': [{'address': 'bob@aexp.com'}]},
+    {'account': 'kunai', 'date': '2024-01-02T00:00:00.000Z', 'to': [{'address': 'bob@aexp.com'},
+                                                                    {'address': 'al@chase.com'}]},
+    {'account': 'shinobi', 'date': '2024-01-03T00:00:00.000Z', 'to': [{'address': 'al@chase.com'}]},
+]
+
+
+class TestFakeElasticsearch(TestCase):
+    def setUp(self):
+        self.client = FakeElasticsearch()
+        self.client.add_documents('emails', DOCS)
+
+    def test_search_after_pages_in_date_order(self):
+        query = {'size': 2, 'sort': [{'date': {'order': 'asc'}}], 'fields': ['account', 'to.address'],
+                 'query': {'bool': {'must': [{'range': {'date': {'gt': '2024-01-01T00:00:00'}}}]}}}
+        first = self.client.search(index='emails', body=query)['hits']['hits']
+        self.assertEqual([['bob@aexp.com', 'al@chase.com'], ['al@chase.com']],
+                         [hit['fields']['to.address'] for hit in first])
+        query['search_after'] = first[-1]['sort']
+        self.assertEqual([], self.client.search(index='emails', body=query)['hits']['hits'])
+
+    def test_composite_pages_with_sub_aggregations(self):
+        aggs = {'emails': {'composite': {'size': 1, 'sources': [{'address': {'terms': {'field': 'to.address'}}}]},
+                           'aggs': {'max_date': {'max': {'field': 'date'}}}}}
+        query = {'size': 0, 'aggs': aggs, 'query': {'term': {'account': 'kunai'}}}
+        composite = self.client.search(index='emails', body=query)['aggregations']['emails']
+        self.assertEqual([{'key': {'address': 'al@chase.com'}, 'doc_count': 1,
+                           'max_date': {'value': 1704153600000.0, 'value_as_string': '2024-01-02T00:00:00.000Z'}}],
+                         composite['buckets'])
+        aggs['emails']['composite']['after'] = composite['after_key']
+        composite = self.client.search(index='emails', body=query)['aggregations']['emails']
+        self.assertEqual([('bob@aexp.com', 2)], [(bucket['key']['address'], bucket['doc_count'])
+                                                 for bucket in composite['buckets']])
+
+    def test_msearch_reports_errors_per_search(self):
+        responses = self.client.msearch(searches=[{'index': 'emails'}, {'query': {'terms': {'account': ['shinobi']}}},
+                                                  {'index': 'missing'}, {}])['responses']
+        self.assertEqual(1, responses[0]['hits']['total']['value'])
+        self.assertEqual(404, responses[1]['status'])
+        with self.assertRaises(NotFoundError):
+            self.client.search(index='missing', body={})
+        self.assertEqual(1, self.client.stats()['search']['calls'])
+
+    def test_bulk_detects_conflicts(self):
+        (written, errors) = helpers.bulk(self.client, [{'_index': 'checkpoints', '_id': 'a', 'date': 'x'}],
+                                         raise_on_error=False)
+        self.assertEqual((1, []), (written, errors))
+        seq_no = self.client.mget(index='checkpoints', ids=['a'])['docs'][0]['_seq_no']
+        actions = [{'_op_type': 'index', '_index': 'checkpoints', '_id': 'a', 'if_seq_no': seq_no,
+                    'if_primary_term': 1, 'date': 'y'}] * 2
+        (written, errors) = helpers.bulk(self.client, actions, raise_on_error=False)
+        self.assertEqual(1, written)
+        self.assertEqual(409, errors[0]['index']['status'])
+        self.assertEqual({'date': 'y'}, self.client.mget(index='checkpoints', ids=['a'])['docs'][0]['_source'])
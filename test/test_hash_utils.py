@@ -0,0 +1,24 @@
+import hashlib
+from unittest import TestCase
+
+from mailforce.utils import hash_utils
+from mailforce.utils.hash_utils import deterministic_id, legacy_id, use_id_scheme
+
+
+class TestHashUtils(TestCase):
+    def tearDown(self):
+        use_id_scheme(hash_utils.LEGACY_ID_SCHEME)
+
+    def test_legacy_scheme_is_unchanged(self):
+        expected = hashlib.md5(''.join(list(map(lambda arg: arg, str(('kunai-jim', 1, None))))).encode()).hexdigest()
+        self.assertEqual(expected, deterministic_id('kunai-jim', 1, None))
+        self.assertEqual(expected, legacy_id('kunai-jim', 1, None))
+
+    def test_other_schemes_are_prefixed(self):
+        use_id_scheme('v2')
+        self.assertTrue(deterministic_id('kunai-jim').startswith('v2-'))
+        self.assertEqual(hashlib.md5(str(('kunai-jim',)).encode()).hexdigest(), legacy_id('kunai-jim'))
+
+    def test_unknown_scheme(self):
+        with self.assertRaises(ValueError):
+            use_id_scheme('v0')
@@ -0,0 +1,81 @@
+import itertools
+import threading
+from unittest import TestCase
+
+from mailforce.utils.iter_utils import Stage, prefetch
+
+
+class TestIterUtils(TestCase):
+    def test_prefetch_preserves_order(self):
+        self.assertEqual(list(range(100)), list(prefetch(iter(range(100)), depth=3)))
+
+    def test_prefetch_reraises(self):
+        def failing():
+            yield 1
+            raise ValueError('page failed')
+
+        iterator = prefetch(failing())
+        self.assertEqual(1, next(iterator))
+        with self.assertRaises(ValueError):
+            next(iterator)
+
+    def test_prefetch_stops_when_abandoned(self):
+        closed = threading.Event()
+
+        def endless():
+            try:
+                yield from itertools.count()
+            finally:
+                closed.set()
+
+        threads = threading.active_count()
+        iterator = prefetch(endless(), depth=2)
+        self.assertEqual(0, next(iterator))
+        iterator.close()
+        self.assertTrue(closed.is_set())
+        self.assertEqual(threads, threading.active_count())
+
+    def test_stage_processes_in_order(self):
+        processed = []
+        stage = Stage(processed.append, depth=2)
+        for i in range(100):
+            stage.put(i)
+        stage.close()
+        self.assertEqual(list(range(100)), processed)
+
+    def test_stage_reraises_on_close(self):
+        def failing(item: int):
+            if item == 3:
+                raise ValueError('write failed')
+
+        stage = Stage(failing)
+        for i in range(10):
+            try:
+                stage.put(i)
+            except ValueError:
+                break
+        with self.assertRaises(ValueError):
+            stage.close()
+
+    def test_cancelled_stage_drops_waiting_items(self):
+        started = threading.Event()
+        release = threading.Event()
+        processed = []
+
+        def slow(item: int):
+            started.set()
+            release.wait()
+            processed.append(item)
+
+        stage = Stage(slow, depth=3)
+        for i in range(3):
+            stage.put(i)
+        started.wait()
+        cancelling = threading.Thread(target=stage.cancel)
+        cancelling.start()
+        while not stage.stopped.is_set():
+            cancelling.join(0.01)
+        release.set()
+        cancelling.join()
+        self.assertEqual([0], processed)
+        self.assertFalse(stage.thread.is_alive())
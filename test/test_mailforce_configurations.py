@@ -0,0 +1,26 @@
+from unittest import TestCase
+
+from mailforce.models.configurations.mailforce_configurations import MailforceConfigurations
+
+
+class TestMailforceConfigurations(TestCase):
+    def test_lazy_settings_are_loaded_on_first_read(self):
+        configurations = MailforceConfigurations(lazy=True)
+        self.assertFalse(configurations._loaded)
+        self.assertEqual(int, type(configurations.search_workers))
+        self.assertTrue(configurations._loaded)
+
+    def test_settings_assigned_before_loading_are_kept_until_reloaded(self):
+        configurations = MailforceConfigurations(lazy=True)
+        configurations.domain_engine = 'batch'
+        default_workers = MailforceConfigurations().search_workers
+        self.assertEqual(default_workers, configurations.search_workers)
+        self.assertEqual('batch', configurations.domain_engine)
+        configurations.search_workers = default_workers + 1
+        configurations.reload()
+        self.assertEqual(default_workers, configurations.search_workers)
+        self.assertEqual(MailforceConfigurations().domain_engine, configurations.domain_engine)
+
+    def test_unknown_settings(self):
+        with self.assertRaises(AttributeError):
+            MailforceConfigurations(lazy=True).unknown_setting
@@ -0,0 +1,220 @@
+import threading
+import time
+from unittest import TestCase
+
+import mailforce.main as main_module
+from mailforce import CONFIG
+from mailforce.client_operations.es import set_client
+from mailforce.client_operations.checkpoints import get_checkpoint_store
+from mailforce.client_operations.es.es_index_operations import ACCOUNTS_ENGAGEMENTS_INDEX, \
+    DOMAINS_ENGAGEMENTS_INDEX, MESSAGE_ROLES_INDEX, RUNTIME_STATS_INDEX, SHARD_PARTIALS_INDEX
+from mailforce.client_operations.es.es_search_operations import INDEX
+from mailforce.client_operations.es.fake_elasticsearch import FakeElasticsearch
+from mailforce.models.checkpoint.checkpoint import ACCOUNTS_STREAM, DOMAINS_STREAM, Checkpoint
+from mailforce.models.continuation.continuation import Continuation
+from mailforce.models.email.account.email_accounts import EmailAccounts
+from mailforce.models.shard.shard_result import ShardResult
+
+SETTINGS: list[str] = ['search_workers', 'msearch_batch_size', 'accounts_cache_ttl_seconds', 'checkpoint_backend',
+                       'write_mode']
+
+
+def _message(account: str, message_id: str, date: str) -> dict[str, any]:
+    return {'account': account, 'messageId': message_id, 'date': date, 'from': [{'address': f'{account}@aexp.com'}],
+            'to': [{'address': 'al@chase.com'}]}
+
+
+def _fake_client(messages: list[dict[str, any]], last_run_date: str = None) -> FakeElasticsearch:
+    client = FakeElasticsearch()
+    client.add_documents(INDEX, messages)
+    client.indices.create(index=RUNTIME_STATS_INDEX)
+    if last_run_date:
+        client.add_documents(RUNTIME_STATS_INDEX, [{'run_date': last_run_date}])
+    return client
+
+
+def _engagement_counts(client: FakeElasticsearch) -> list[int]:
+    (_, doc) = next(iter(client.documents[ACCOUNTS_ENGAGEMENTS_INDEX].values()))
+    return [engagement['count'] for engagement in doc['doc']['emails_to']]
+
+
+def _domain_totals(client: FakeElasticsearch) -> dict[str, int]:
+    return {doc['doc']['domain']: doc['doc']['total_emails']
+            for (_, doc) in client.documents[DOMAINS_ENGAGEMENTS_INDEX].values()}
+
+
+class TestMain(TestCase):
+    def setUp(self):
+        self.settings = {name: getattr(CONFIG, name) for name in SETTINGS}
+        self.fetch_accounts = main_module._fetch_accounts
+        self.merge_domains_stats = main_module.merge_domains_stats
+        self.merge_accounts = main_module.merge_accounts
+        self.insert_domains_stats = main_module.insert_domains_stats
+        self.insert_message_roles = main_module.insert_message_roles
+        self.get_latest_timestamps = main_module.get_latest_timestamps
+        (CONFIG.accounts_cache_ttl_seconds, CONFIG.checkpoint_backend) = (0, 'es')
+
+    def tearDown(self):
+        for name, value in self.settings.items():
+            setattr(CONFIG, name, value)
+        main_module._fetch_accounts = self.fetch_accounts
+        main_module.merge_domains_stats = self.merge_domains_stats
+        main_module.merge_accounts = self.merge_accounts
+        main_module.insert_domains_stats = self.insert_domains_stats
+        main_module.insert_message_roles = self.insert_message_roles
+        main_module.get_latest_timestamps = self.get_latest_timestamps
+        set_client(None)
+
+    def test_accounts_are_fetched_concurrently_and_fail_on_their_own(self):
+        (CONFIG.search_workers, CONFIG.msearch_batch_size) = (3, 1)
+        lock = threading.Lock()
+        searches = {'running': 0, 'most': 0}
+
+        def fetch_accounts(accounts: list[str], last_runtime_date: str, checkpoints=None):
+            with lock:
+                searches['running'] += 1
+                searches['most'] = max(searches['most'], searches['running'])
+            time.sleep(0.05)
+            with lock:
+                searches['running'] -= 1
+            if accounts[0] == 'broken':
+                raise ConnectionError('search failed')
+            return {accounts[0]: accounts[0]}, {}
+
+        main_module._fetch_accounts = fetch_accounts
+        accounts = [f'account{i}' for i in range(5)] + ['broken'] + [f'account{i}' for i in range(5, 10)]
+        email_accounts = EmailAccounts()
+        fetched = list(main_module._iter_email_accounts(None, accounts, email_accounts))
+        self.assertEqual([account for account in accounts if account != 'broken'], fetched)
+        self.assertEqual(['broken'], email_accounts.failed_accounts)
+        self.assertEqual(3, searches['most'])
+
+    def test_full_rebuild_ignores_the_last_runtime_date(self):
+        messages = [_message('kunai', 'm1', '2024-01-01T00:00:00.000Z'),
+                    _message('shinobi', 'm2', '2024-01-02T00:00:00.000Z')]
+        client = _fake_client(messages, last_run_date='2024-02-01T00:00:00.000Z')
+        set_client(client)
+        main_module._collect()
+        self.assertNotIn(MESSAGE_ROLES_INDEX, client.documents)
+        main_module._collect(full_rebuild=True)
+        self.assertEqual(2, len(client.documents[MESSAGE_ROLES_INDEX]))
+
+    def test_merged_accounts_are_checkpointed_even_if_the_domains_fail(self):
+        CONFIG.write_mode = 'merge'
+        client = _fake_client([_message('kunai', 'm1', '2024-01-01T00:00:00.000Z')])
+        set_client(client)
+        main_module.merge_domains_stats = lambda domains, replace=False: False
+        main_module._collect()
+        self.assertIn('kunai', get_checkpoint_store().load(['kunai'], ACCOUNTS_STREAM))
+        self.assertEqual({}, get_checkpoint_store().load(['kunai'], DOMAINS_STREAM))
+        # Only the checkpoint keeps the next run from merging the same email into the account documents again, while
+        # the domains catch up on it.
+        main_module.merge_domains_stats = self.merge_domains_stats
+        main_module._collect()
+        client.add_documents(INDEX, [_message('kunai', 'm2', '2024-01-02T00:00:00.000Z')])
+        main_module._collect()
+        self.assertEqual([2], _engagement_counts(client))
+        self.assertEqual({'aexp.com': 2, 'chase.com': 2}, _domain_totals(client))
+
+    def test_domains_are_not_merged_again_when_the_accounts_catch_up(self):
+        CONFIG.write_mode = 'merge'
+        client = _fake_client([_message('kunai', 'm1', '2024-01-01T00:00:00.000Z')])
+        set_client(client)
+        main_module.merge_accounts = lambda email_accounts, replace=False: []
+        # Without a run date, the account documents are caught up from the start.
+        self.assertIsNone(main_module._collect().run_date)
+        self.assertEqual({}, get_checkpoint_store().load(['kunai'], ACCOUNTS_STREAM))
+        main_module.merge_accounts = self.merge_accounts
+        client.add_documents(INDEX, [_message('kunai', 'm2', '2024-01-02T00:00:00.000Z')])
+        main_module._collect()
+        self.assertEqual([2], _engagement_counts(client))
+        self.assertEqual({'aexp.com': 2, 'chase.com': 2}, _domain_totals(client))
+
+    def test_full_rebuild_replaces_merged_documents_without_reading_them(self):
+        CONFIG.write_mode = 'merge'
+        client = _fake_client([_message('kunai', 'm1', '2024-01-01T00:00:00.000Z')])
+        set_client(client)
+        main_module._collect(full_rebuild=True)
+        main_module._collect(full_rebuild=True)
+        self.assertNotIn('mget', client.stats())
+        (_, doc) = next(iter(client.documents[ACCOUNTS_ENGAGEMENTS_INDEX].values()))
+        self.assertEqual([1], [engagement['count'] for engagement in doc['doc']['emails_to']])
+
+    def test_message_roles_that_failed_to_be_written_are_resumed(self):
+        set_client(_fake_client([_message('kunai', 'm1', '2024-01-01T00:00:00.000Z'),
+                                 _message('kunai', 'm2', '2024-01-02T00:00:00.000Z')]))
+        main_module.insert_message_roles = lambda message_roles_container: False
+        runtime_stats = main_module._collect()
+        self.assertIsNone(runtime_stats.run_date)
+        self.assertFalse(runtime_stats.continuation.message_roles_done)
+        self.assertIsNone(runtime_stats.continuation.message_roles_date)
+        continuation = Continuation({'message_roles_done': False, 'message_roles_date': '2024-01-01T00:00:00.000Z',
+                                     'run_date': '2024-02-01T00:00:00.000Z'})
+        runtime_stats = main_module._collect(continuation=continuation)
+        self.assertEqual('2024-01-01T00:00:00.000Z', runtime_stats.continuation.message_roles_date)
+        main_module.insert_message_roles = self.insert_message_roles
+        runtime_stats = main_module._collect(continuation=continuation)
+        self.assertIsNone(runtime_stats.continuation)
+        self.assertEqual('2024-02-01T00:00:00.000Z', runtime_stats.run_date)
+
+    def test_accounts_without_emails_after_their_start_date_are_skipped(self):
+        set_client(_fake_client([_message('kunai', 'm1', '2024-01-03T00:00:00.000Z'),
+                                 _message('shinobi', 'm2', '2024-01-01T00:00:00.000Z'),
+                                 _message('ronin', 'm3', '2024-01-01T00:00:00.000Z')]))
+        checkpoints = {'shinobi': Checkpoint('shinobi', ACCOUNTS_STREAM, '2023-12-01T00:00:00.000Z')}
+        email_accounts = EmailAccounts()
+        accounts = ['ronin', 'kunai', 'shinobi', 'sensei']
+        changed_accounts = main_module._changed_accounts('2024-01-02T00:00:00.000Z', accounts, checkpoints,
+                                                         email_accounts)
+        # Only kunai has an email after the last runtime date, but shinobi resumes from its earlier checkpoint.
+        self.assertEqual(['kunai', 'shinobi'], changed_accounts)
+        self.assertEqual(['ronin', 'sensei'], email_accounts.skipped_accounts)
+
+    def test_all_accounts_are_processed_if_the_probe_fails(self):
+        def get_latest_timestamps(accounts: list[str], after: str = None) -> dict[str, int]:
+            raise ConnectionError('probe failed')
+
+        main_module.get_latest_timestamps = get_latest_timestamps
+        email_accounts = EmailAccounts()
+        accounts = ['ronin', 'kunai']
+        self.assertEqual(accounts, main_module._changed_accounts('2024-01-02T00:00:00.000Z', accounts, {},
+                                                                 email_accounts))
+        self.assertEqual([], email_accounts.skipped_accounts)
+
+    def test_run_date_is_not_recorded_if_the_domains_fail(self):
+        client = _fake_client([_message('kunai', 'm1', '2024-01-01T00:00:00.000Z')])
+        set_client(client)
+        main_module.insert_domains_stats = lambda domains: False
+        self.assertIsNone(main_module._collect().run_date)
+        self.assertEqual({}, get_checkpoint_store().load(['kunai'], ACCOUNTS_STREAM))
+        main_module.insert_domains_stats = self.insert_domains_stats
+        self.assertIsNotNone(main_module._collect().run_date)
+        (_, doc) = next(iter(client.documents[DOMAINS_ENGAGEMENTS_INDEX].values()))
+        self.assertEqual('chase.com', doc['doc']['domain'])
+
+    def test_reduce_reads_the_domains_the_shards_staged(self):
+        client = _fake_client([_message('kunai', 'm1', '2024-01-01T00:00:00.000Z'),
+                               _message('jim', 'm2', '2024-01-02T00:00:00.000Z')])
+        set_client(client)
+        shard_results = [main_module._collect(shard=shard, shards=2, run_id='run').shard_result.to_json()
+                         for shard in range(2)]
+        # Shard results only hold counts, however many domains the shards computed.
+        self.assertEqual([2, 2], [shard_result['domains'] for shard_result in shard_results])
+        self.assertNotIn(DOMAINS_ENGAGEMENTS_INDEX, client.documents)
+        self.assertIsNotNone(main_module._reduce(list(map(ShardResult, shard_results))).run_date)
+        self.assertEqual({'aexp.com': 2, 'chase.com': 2}, _domain_totals(client))
+        self.assertEqual({'kunai', 'jim'}, set(get_checkpoint_store().load(['kunai', 'jim'], ACCOUNTS_STREAM)))
+        self.assertEqual({}, client.documents[SHARD_PARTIALS_INDEX])
+
+    def test_parts_whose_staged_documents_are_missing_are_not_checkpointed(self):
+        client = _fake_client([_message('kunai', 'm1', '2024-01-01T00:00:00.000Z'),
+                               _message('jim', 'm2', '2024-01-02T00:00:00.000Z')])
+        set_client(client)
+        shard_results = [main_module._collect(shard=shard, shards=2, run_id='run').shard_result
+                         for shard in range(2)]
+        staged = client.documents[SHARD_PARTIALS_INDEX]
+        for doc_id in [doc_id for doc_id in staged if doc_id.startswith(shard_results[1].staging_key())]:
+            del staged[doc_id]
+        self.assertIsNone(main_module._reduce(shard_results).run_date)
+        self.assertEqual({'aexp.com': 1, 'chase.com': 1}, _domain_totals(client))
+        self.assertEqual({'kunai'}, set(get_checkpoint_store().load(['kunai', 'jim'], ACCOUNTS_STREAM)))
@@ -0,0 +1,57 @@
+from unittest import TestCase
+
+from mailforce.utils.merge_utils import merge_account_docs, merge_domain_docs
+
+
+class TestMergeUtils(TestCase):
+    def test_merge_domain_docs(self):
+        existing = {
+            'domain': 'visa.com', 'date': '2024-01-01T00:00:00', 'total_cc': 1, 'total_to': 2, 'total_from': 3,
+            'total_emails': 6, 'first_contact_date': '2023-05-11 16:52', 'latest_contact_date': '2023-11-30 18:29',
+            'email_engagements': [
+                {'email_address': 'a@visa.com', 'first_contact_date': '2023-05-11 16:52',
+                 'latest_contact_date': '2023-11-30 18:29', 'from_count': 3, 'to_count': 2, 'cc_count': 1,
+                 'total_count': 6}
+            ]
+        }
+        new = {
+            'domain': 'visa.com', 'date': '2024-02-01T00:00:00', 'total_cc': 0, 'total_to': 1, 'total_from': 1,
+            'total_emails': 2, 'first_contact_date': '2024-01-03 10:00', 'latest_contact_date': '2024-01-20 11:00',
+            'email_engagements': [
+                {'email_address': 'a@visa.com', 'first_contact_date': '2024-01-03 10:00',
+                 'latest_contact_date': '2024-01-03 10:00', 'from_count': 1, 'to_count': 0, 'cc_count': 0,
+                 'total_count': 1},
+                {'email_address': 'b@visa.com', 'first_contact_date': '2024-01-20 11:00',
+                 'latest_contact_date': '2024-01-20 11:00', 'from_count': 0, 'to_count': 1, 'cc_count': 0,
+                 'total_count': 1}
+            ]
+        }
+        merged = merge_domain_docs(existing, new)
+        self.assertEqual(8, merged['total_emails'])
+        self.assertEqual(4, merged['total_from'])
+        self.assertEqual('2023-05-11 16:52', merged['first_contact_date'])
+        self.assertEqual('2024-01-20 11:00', merged['latest_contact_date'])
+        self.assertEqual('2024-02-01T00:00:00', merged['date'])
+        engagements = {engagement['email_address']: engagement for engagement in merged['email_engagements']}
+        self.assertEqual(7, engagements['a@visa.com']['total_count'])
+        self.assertEqual('2024-01-03 10:00', engagements['a@visa.com']['latest_contact_date'])
+        self.assertEqual(1, engagements['b@visa.com']['to_count'])
+
+    def test_merge_account_docs(self):
+        existing = {'account': 'kunai-jim', 'emails_cc': [], 'emails_to': [], 'emails_from': [
+            {'relationship': 'from', 'email_address': 'a@visa.com', 'count': 2,
+             'earliest_engagement_date': '2023-05-11 16:52', 'latest_engagement_date': '2023-11-30 18:29'}
+        ]}
+        new = {'account': 'kunai-jim', 'emails_cc': [], 'emails_from': [
+            {'relationship': 'from', 'email_address': 'a@visa.com', 'count': 1,
+             'earliest_engagement_date': '2024-01-03 10:00', 'latest_engagement_date': '2024-01-03 10:00'}
+        ], 'emails_to': [
+            {'relationship': 'to', 'email_address': 'a@visa.com', 'count': 1,
+             'earliest_engagement_date': '2024-01-03 10:00', 'latest_engagement_date': '2024-01-03 10:00'}
+        ]}
+        merged = merge_account_docs(existing, new)
+        self.assertEqual(1, len(merged['emails_from']))
+        self.assertEqual(3, merged['emails_from'][0]['count'])
+        self.assertEqual('2023-05-11 16:52', merged['emails_from'][0]['earliest_engagement_date'])
+        self.assertEqual('2024-01-03 10:00', merged['emails_from'][0]['latest_engagement_date'])
+        self.assertEqual(1, len(merged['emails_to']))
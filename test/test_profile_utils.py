@@ -0,0 +1,34 @@
+import threading
+from unittest import TestCase
+
+from mailforce.utils.profile_utils import ALLOC_PROFILE, CPU_PROFILE, Profiler
+
+
+def _busy_function():
+    return sum(i * i for i in range(200000))
+
+
+class TestProfileUtils(TestCase):
+    def test_cpu_profile_covers_new_threads(self):
+        profiler = Profiler(CPU_PROFILE, top=50)
+        profiler.start()
+        thread = threading.Thread(target=_busy_function)
+        thread.start()
+        thread.join()
+        profile = profiler.stop()
+        self.assertIs(profile, profiler.stop())
+        self.assertEqual(CPU_PROFILE, profile.kind)
+        self.assertTrue(any('_busy_function' in entry['function'] for entry in profile.entries))
+
+    def test_alloc_profile_reports_peak_sites(self):
+        profiler = Profiler(ALLOC_PROFILE, top=5)
+        profiler.start()
+        held = [str(i) for i in range(100000)]
+        profile = profiler.stop()
+        self.assertGreater(profile.peak_bytes, 0)
+        self.assertIn(__file__, profile.entries[0]['site'])
+        self.assertEqual(100000, len(held))
+
+    def test_unknown_profile(self):
+        with self.assertRaises(ValueError):
+            Profiler('wall')
@@ -0,0 +1,64 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from mailforce.models.run_metrics.run_metrics import RunMetrics
+from mailforce.utils import metrics_utils
+
+
+class _Meta:
+    def __init__(self, content_length: int):
+        self.headers: dict[str, str] = {'content-length': str(content_length)}
+
+
+class _Response:
+    def __init__(self, content_length: int):
+        self.meta: _Meta = _Meta(content_length)
+
+
+class TestRunMetrics(TestCase):
+    def test_records_phases_and_requests(self):
+        run_metrics = metrics_utils.reset_run_metrics()
+        with metrics_utils.phase('fetch_accounts'):
+            metrics_utils.timed_request('search', 10, lambda: _Response(200))
+        with self.assertRaises(RuntimeError):
+            metrics_utils.timed_request('search', 5, lambda: (_ for _ in ()).throw(RuntimeError('boom')))
+        metrics_utils.record_pages(3)
+        metrics_utils.record_pages(1)
+        self.assertEqual(1, run_metrics.phases['fetch_accounts'].calls)
+        self.assertEqual({'requests': 2, 'failed': 1, 'request_bytes': 15, 'response_bytes': 200},
+                         {key: value for key, value in run_metrics.requests['search'].to_json().items()
+                          if key in ['requests', 'failed', 'request_bytes', 'response_bytes']})
+        self.assertEqual(2, sum(run_metrics.requests['search'].latency_histogram))
+        self.assertEqual((2, 4, 3), (run_metrics.accounts_paged, run_metrics.pages,
+                                     run_metrics.max_pages_per_account))
+        self.assertEqual([], run_metrics.spans)
+
+    def test_add_round_trips_through_json(self):
+        run_metrics = RunMetrics()
+        run_metrics.record_phase('bulk_write', 1.0, 0.5, 100)
+        run_metrics.record_request('bulk', 0.02, 10, 20)
+        run_metrics.record_pages(2)
+        total = RunMetrics(run_metrics.to_json())
+        total.add(RunMetrics(run_metrics.to_json()))
+        self.assertEqual({'calls': 2, 'wall_seconds': 2.0, 'cpu_seconds': 1.0, 'peak_rss_kb': 100},
+                         total.phases['bulk_write'].to_json())
+        self.assertEqual([0, 2] + [0] * 9, total.requests['bulk'].latency_histogram)
+        self.assertEqual((2, 4, 2), (total.accounts_paged, total.pages, total.max_pages_per_account))
+
+    def test_writes_nested_spans(self):
+        run_metrics = metrics_utils.reset_run_metrics(trace=True)
+        with metrics_utils.phase('bulk_write'):
+            metrics_utils.timed_request('bulk', 10, lambda: _Response(20))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'trace.json')
+            metrics_utils.write_trace(path, run_metrics, {'emails_processed': 1})
+            with open(path) as f:
+                spans = json.load(f)['resourceSpans'][0]['scopeSpans'][0]['spans']
+        spans = {span['name']: span for span in spans}
+        self.assertEqual(['collect', 'es.bulk', 'bulk_write'], list(spans.keys()))
+        self.assertEqual('', spans['collect']['parentSpanId'])
+        self.assertEqual(spans['collect']['spanId'], spans['bulk_write']['parentSpanId'])
+        self.assertEqual(spans['bulk_write']['spanId'], spans['es.bulk']['parentSpanId'])
+        self.assertEqual({run_metrics.trace_id}, {span['traceId'] for span in spans.values()})
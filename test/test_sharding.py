@@ -0,0 +1,35 @@
+from unittest import TestCase
+
+import mailforce.main as main_module
+
+from mailforce.models.domain.domains import Domains
+from mailforce.models.email.account.email_accounts import EmailAccounts
+from mailforce.models.runtime_stats.runtime_stats import RuntimeStats
+from mailforce.models.shard.shard_result import ShardResult
+from mailforce.utils.shard_utils import accounts_in_shard, shard_of
+
+
+class TestSharding(TestCase):
+    def test_shards_partition_accounts(self):
+        accounts = [f'kunai-{i}' for i in range(100)]
+        shards = [accounts_in_shard(accounts, shard, 4) for shard in range(4)]
+        self.assertEqual(sorted(accounts), sorted(sum(shards, [])))
+        self.assertTrue(all(shards))
+
+    def test_shard_is_stable(self):
+        # Accounts must not move between shards across processes or releases.
+        self.assertEqual(6, shard_of('kunai-jim', 7))
+
+    def test_counts_are_combined(self):
+        runtime_stats = RuntimeStats(None, Domains(), EmailAccounts(), 0, 0)
+        for result in [ShardResult({'counts': {'email_accounts_processed': 2, 'emails_processed': 5}}),
+                       ShardResult(ShardResult({'counts': {'email_accounts_processed': 3}}).to_json())]:
+            runtime_stats.add_counts(result.counts)
+        self.assertEqual(5, runtime_stats.email_accounts_processed)
+        self.assertEqual(5, runtime_stats.emails_processed)
+        self.assertEqual(0, runtime_stats.email_accounts_failed)
+
+    def test_shard_events_share_a_run_id(self):
+        events = main_module._shard_events({main_module.MODE_KEY: main_module.COORDINATOR_MODE}, 3)
+        self.assertEqual(1, len(set(map(lambda event: event[main_module.RUN_ID_KEY], events))))
+        self.assertNotIn(main_module.MODE_KEY, events[0])
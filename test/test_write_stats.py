@@ -0,0 +1,30 @@
+from threading import Thread
+from unittest import TestCase
+
+from mailforce.models.write_stats.write_stats import WriteStats
+
+
+class TestWriteStats(TestCase):
+    def test_record_from_threads(self):
+        write_stats = WriteStats()
+
+        def record():
+            for _ in range(1000):
+                write_stats.record('search-domains-engagements', succeeded=1, requests=1, seconds=0.001)
+
+        threads = [Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = write_stats.indices['search-domains-engagements']
+        self.assertEqual(4000, stats.succeeded)
+        self.assertEqual(4000, stats.requests)
+
+    def test_add_round_trip(self):
+        write_stats = WriteStats()
+        write_stats.record('search-message-roles', succeeded=2, failed=1, retried=3, requests=1, seconds=0.5)
+        combined = WriteStats(write_stats.to_json())
+        combined.add(write_stats)
+        self.assertEqual({'succeeded': 4, 'failed': 2, 'retried': 6, 'requests': 2, 'seconds': 1.0},
+                         combined.to_json()['search-message-roles'])